@@ -2,102 +2,162 @@
 Sheet Music Analysis Script
 Uses OCR to identify which scales are on which pages.
 Run this first to generate correct mapping, then use crop_sheet_music.py
+
+Only the text lines found on each page (text_regions.py) are OCRed, one
+single-line box at a time; the full page and left-hand strips are the
+fallback when none of them names a scale (or with --no-localize).
 """
 
-from PIL import Image
-import pytesseract
+import argparse
 import os
-import re
+import sys
 
-# Set Tesseract path for Windows
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+from ocr_cache import NullCache, add_cache_arguments, cache_key, file_hash, open_cache
+import ocr_engine
+from ocr_engine import OcrUnavailable, add_engine_argument
+from page_decode import decode_page
+import page_geometry
+from page_geometry import add_flatten_argument
+from page_store import PageStore, add_store_argument
+from sheet_music_image import PageBuffer
+from text_regions import LABEL_PSM, add_localize_argument, cached_label_boxes
+import sheet_music_trace as tracing
+from label_matcher import MIN_SCORE, default_matcher, describe
 
 SOURCE_DIR = "sheet-music"
 
-def analyze_page(filename):
-    """Analyze a page and extract text to identify scales."""
+# OCR settings; part of the OCR cache key
+OCR_CONFIG = '--psm 6'
+LABEL_CONFIG = f'--psm {LABEL_PSM}'
+PREPROCESS = {"exif_rotate": True, "grayscale": True}
+
+
+def page_preprocess(flatten=None):
+    """PREPROCESS for a page, plus the flatten mode and geometry parameters
+    when the page was flattened (its pixels, and so its OCR, differ)."""
+    if not flatten:
+        return PREPROCESS
+    return dict(PREPROCESS, flatten=flatten, geometry=page_geometry.params_digest())
+
+
+def analyze_page(filename, cache=None, img=None, store=None, flatten=None, localize=True):
+    """Analyze a page and extract text to identify scales.
+
+    `img` is the already decoded, upright page when the pipeline runner
+    shares it with the crop stage (flattened when `flatten` is set). With a
+    PageStore the grayscale page is memory-mapped from it instead of
+    decoded. Pages this function decodes itself go through
+    page_decode.decode_page(), like the crops, so they match the cropped
+    pages pixel for pixel; `flatten` deskews (or perspective-corrects) them
+    the same way and is part of every OCR cache key. `localize` OCRs the
+    label lines first and the fixed regions only if none matches.
+    """
     filepath = os.path.join(SOURCE_DIR, filename)
     
     if not os.path.exists(filepath):
         print(f"  ERROR: {filepath} not found")
         return
     
-    img = Image.open(filepath)
-    
-    # Auto-rotate based on EXIF
-    try:
-        exif = img._getexif()
-        if exif:
-            orientation = exif.get(274)
-            if orientation == 3:
-                img = img.rotate(180, expand=True)
-            elif orientation == 6:
-                img = img.rotate(270, expand=True)
-            elif orientation == 8:
-                img = img.rotate(90, expand=True)
-    except:
-        pass
+    cache = cache or NullCache()
+    image_hash = file_hash(filepath)
+    preprocess = page_preprocess(flatten)
+    page = None
+    if img is None and store is not None:
+        page = PageBuffer(store.array(filepath, "L", flatten))
+        size = page.size
+    else:
+        if img is None:
+            img = decode_page(filepath, flatten=flatten)
+        size = img.size
     
     print(f"\n{'='*60}")
     print(f"Analyzing: {filename}")
-    print(f"Size: {img.size}")
+    print(f"Size: {size}")
     print(f"{'='*60}")
     
     # Get dimensions
-    width, height = img.size
+    width, height = size
     
-    # Extract text from the left margin where scale names appear
-    # Try multiple regions
-    regions = [
-        ("Full page", img),
-        ("Left 20%", img.crop((0, 0, int(width * 0.2), height))),
-        ("Top third left", img.crop((0, 0, int(width * 0.3), int(height * 0.33)))),
-        ("Middle third left", img.crop((0, int(height * 0.33), int(width * 0.3), int(height * 0.66)))),
-        ("Bottom third left", img.crop((0, int(height * 0.66), int(width * 0.3), height))),
-    ]
+    # The page is converted to grayscale once (on the first cache miss) and
+    # each region is a view into that buffer.
+    matcher = default_matcher()
     
-    for region_name, region_img in regions:
+    def grayscale():
+        nonlocal page
+        if page is None:
+            with tracing.span("grayscale", source=filename):
+                page = PageBuffer.from_image(img)
+            tracing.count("pixels_processed", width * height)
+        return page
+    
+    def read(region_name, box, config):
+        """OCR one region and print its matches. Returns True if it names a scale."""
         try:
-            # Convert to grayscale for better OCR
-            if region_img.mode != 'L':
-                gray = region_img.convert('L')
+            key = cache_key(image_hash, box, preprocess, config)
+            text = cache.get(key)
+            if text is None:
+                region = grayscale().region(box)
+                tracing.count("ocr_calls")
+                tracing.count("pixels_ocr", region.size)
+                with tracing.span("ocr", source=filename, region=region_name):
+                    text = ocr_engine.image_to_string(region, config=config)
+                cache.put(key, text)
             else:
-                gray = region_img
-            
-            text = pytesseract.image_to_string(gray, config='--psm 6')
-            
-            # Look for scale identifiers
-            scale_patterns = [
-                r'[Aa]b\s*[Mm]ajor', r'[Gg]#?\s*[Mm]inor', r'[Gg]b?\s*[Mm]inor',
-                r'[Cc]\s*[Mm]ajor', r'[Cc]\s*[Mm]inor', 
-                r'[Dd]b?\s*[Mm]ajor', r'[Cc]#?\s*[Mm]inor',
-                r'[Ee]b?\s*[Mm]ajor', r'[Ee]b?\s*[Mm]inor',
-                r'[Ee]\s*[Mm]ajor', r'[Ee]\s*[Mm]inor',
-                r'[Mm]elodic', r'[Hh]armonic',
-                r'[Oo]ctaves?', r'3rds?', r'6ths?',
-                r'[Dd]ominant', r'[Dd]iminished', r'[Cc]hromatic',
-            ]
+                tracing.count("ocr_cache_hits")
             
-            found = []
-            for pattern in scale_patterns:
-                matches = re.findall(pattern, text, re.IGNORECASE)
-                found.extend(matches)
+            # Rank questions by their catalog titles in one pass over the text
+            ranked, lines = matcher.scan(text)
             
-            if found:
+            if ranked and ranked[0][1] >= MIN_SCORE:
                 print(f"\n{region_name}:")
-                print(f"  Found patterns: {', '.join(found)}")
+                print(f"  Best matches: {describe(ranked, limit=5)}")
                 
                 # Print relevant lines
-                lines = text.split('\n')
-                for line in lines:
-                    line = line.strip()
-                    if any(re.search(p, line, re.IGNORECASE) for p in scale_patterns):
-                        print(f"  Line: {line}")
+                text_lines = text.split('\n')
+                for i in lines:
+                    print(f"  Line: {text_lines[i].strip()}")
+                return True
+        except OcrUnavailable:
+            raise
         except Exception as e:
             print(f"  {region_name}: Error - {e}")
+        return False
+    
+    # Scale names are short lines of text next to the staves
+    found = False
+    if localize:
+        with tracing.span("localize", source=filename):
+            labels = cached_label_boxes(cache, image_hash, lambda: grayscale().array, preprocess)
+        print(f"Text lines: {len(labels)}")
+        for i, box in enumerate(labels, 1):
+            found |= read(f"Line {i} at {box}", box, LABEL_CONFIG)
+    if found:
+        return
+    
+    # Fallback: the full page and the left margin where scale names appear
+    regions = [
+        ("Full page", (0, 0, width, height)),
+        ("Left 20%", (0, 0, int(width * 0.2), height)),
+        ("Top third left", (0, 0, int(width * 0.3), int(height * 0.33))),
+        ("Middle third left", (0, int(height * 0.33), int(width * 0.3), int(height * 0.66))),
+        ("Bottom third left", (0, int(height * 0.66), int(width * 0.3), height)),
+    ]
+    for region_name, box in regions:
+        read(region_name, box, OCR_CONFIG)
 
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Identify scales on each page via OCR.")
+    add_cache_arguments(parser)
+    add_engine_argument(parser)
+    add_flatten_argument(parser)
+    add_localize_argument(parser)
+    add_store_argument(parser)
+    tracing.add_trace_argument(parser)
+    args = parser.parse_args(argv)
+    ocr_engine.configure(args.ocr_engine)
+    tracing.start(args)
+    
     print("Sheet Music Analysis - Identifying Scales via OCR")
     print("=" * 60)
     
@@ -106,14 +166,29 @@ def main():
     
     print(f"Found {len(files)} images to analyze")
     
-    for i, filename in enumerate(files, 1):
-        print(f"\n[{i}/{len(files)}]")
-        analyze_page(filename)
+    cache = open_cache(no_cache=args.no_cache, clear=args.clear_cache)
+    store = PageStore() if args.page_store else None
+    try:
+        for i, filename in enumerate(files, 1):
+            print(f"\n[{i}/{len(files)}]")
+            with tracing.span("page", source=filename):
+                analyze_page(filename, cache, store=store, flatten=args.flatten,
+                             localize=not args.no_localize)
+    except OcrUnavailable as e:
+        print(f"\nERROR: {e}")
+        return 2
+    finally:
+        print(f"\n{cache.summary()}")
+        if store:
+            print(store.summary())
+        cache.close()
+        tracing.finish(args)
     
     print("\n" + "=" * 60)
     print("Analysis complete!")
     print("Use this information to update the PAGES mapping in crop_sheet_music.py")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""
+Sheet Music Pipeline Benchmarks
+Times each image-pipeline step (decode, rotate, crop, resize, enhance,
+encode, preprocess, OCR) and the whole crop + verify run on the 13 pages in
+sheet-music/, and compares the results against a committed baseline.
+
+Each stage runs in a fresh process, so its peak RSS is its own. Wall and
+CPU times (CPU includes tesseract subprocesses) are medians over --repeat
+runs, and only the step itself is timed, not the setup that feeds it.
+
+    python scripts/benchmark_sheet_music.py                  # compare to baseline
+    python scripts/benchmark_sheet_music.py --save-baseline  # record a new baseline
+"""
+
+from PIL import Image, ImageEnhance
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import crop_sheet_music
+import ocr_engine
+import verify_sheet_music
+from ocr_cache import NullCache
+import page_decode
+
+BASELINE_PATH = "tests/benchmarks/sheet-music-baseline.json"
+
+# Fail when a metric is this much worse than the baseline (0.10 = 10%)
+DEFAULT_THRESHOLD = 0.10
+# Ignore time changes smaller than this; they are timer noise
+NOISE_FLOOR_S = 0.005
+
+METRICS = ("wall_s", "cpu_s", "peak_rss_mb")
+
+# Set in each stage process; end_to_end only OCRs when tesseract is used
+OCR_ENABLED = True
+
+
+class Stopwatch:
+    """Accumulates wall and CPU time over the `with` blocks it is used in."""
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    @staticmethod
+    def _cpu():
+        t = os.times()
+        # children_* covers tesseract subprocesses of the subprocess OCR
+        # engine (always 0 on Windows); tesserocr runs in this process
+        return t.user + t.system + t.children_user + t.children_system
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu_start = self._cpu()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall += time.perf_counter() - self._wall
+        self.cpu += self._cpu() - self._cpu_start
+
+
+def fixture_pages():
+    """(source_path, [(scale_id, top, bottom, left, right)]) for every PAGES entry."""
+    pages = []
+    for source_path, scales in crop_sheet_music.PAGES:
+        boxes = [
+            tuple(entry) + (crop_sheet_music.LEFT_PCT, crop_sheet_music.RIGHT_PCT)
+            for entry in scales if not isinstance(entry, str)
+        ]
+        pages.append((source_path, boxes))
+    return pages
+
+
+def check_fixtures(pages):
+    """Error message if a fixture is missing or still a Git LFS pointer, else None."""
+    for source_path, _ in pages:
+        if not os.path.exists(source_path):
+            return f"missing fixture {source_path}"
+        with open(source_path, 'rb') as f:
+            if f.read(40).startswith(b"version https://git-lfs"):
+                return f"{source_path} is a Git LFS pointer (run `git lfs pull`)"
+    return None
+
+
+def pixel_boxes(size, box):
+    width, height = size
+    _, top, bottom, left, right = box
+    return (int(width * left), int(height * top), int(width * right), int(height * bottom))
+
+
+def upright(source_path):
+    img = page_decode.load_page(source_path)
+    img.load()
+    return img
+
+
+def crops_of(source_path, boxes):
+    img = upright(source_path)
+    return [img.crop(pixel_boxes(img.size, box)) for box in boxes]
+
+
+def encoded_crops(source_path, boxes):
+    """800px crops as the crop script writes them, decoded back from JPEG."""
+    for cropped in crops_of(source_path, boxes):
+        data = crop_sheet_music.encode_jpeg(crop_sheet_music.fit_width(cropped, crop_sheet_music.MAX_WIDTH),
+                                            crop_sheet_music.JPEG_QUALITY)
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        yield img
+
+
+# Stages: fn(pages, stopwatch). Only the `with sw:` blocks are timed.
+
+def bench_decode(pages, sw):
+    for source_path, _ in pages:
+        with sw:
+            Image.open(source_path).load()
+
+
+def bench_rotate(pages, sw):
+    for source_path, _ in pages:
+        img = Image.open(source_path)
+        img.load()
+        with sw:
+            page_decode.auto_rotate(img)
+
+
+def bench_crop(pages, sw):
+    for source_path, boxes in pages:
+        img = upright(source_path)
+        with sw:
+            for box in boxes:
+                img.crop(pixel_boxes(img.size, box))
+
+
+def bench_resize(pages, sw):
+    max_width = crop_sheet_music.MAX_WIDTH
+    for source_path, boxes in pages:
+        for cropped in crops_of(source_path, boxes):
+            w, h = cropped.size
+            with sw:
+                cropped.resize((max_width, int(h * max_width / w)), Image.LANCZOS)
+
+
+def bench_enhance(pages, sw):
+    max_width = crop_sheet_music.MAX_WIDTH
+    for source_path, boxes in pages:
+        for cropped in crops_of(source_path, boxes):
+            w, h = cropped.size
+            resized = cropped.resize((max_width, int(h * max_width / w)), Image.LANCZOS).convert('RGB')
+            with sw:
+                ImageEnhance.Contrast(resized).enhance(crop_sheet_music.CONTRAST_FACTOR)
+
+
+def bench_encode(pages, sw):
+    for source_path, boxes in pages:
+        for cropped in crops_of(source_path, boxes):
+            base = crop_sheet_music.fit_width(cropped, crop_sheet_music.MAX_WIDTH)
+            with sw:
+                crop_sheet_music.encode_jpeg(base, crop_sheet_music.JPEG_QUALITY)
+
+
+def bench_preprocess(pages, sw):
+    for source_path, boxes in pages:
+        for img in encoded_crops(source_path, boxes):
+            with sw:
+                verify_sheet_music.preprocess_page(img)
+
+
+def bench_ocr(pages, sw):
+    """One tesseract call per crop: the first region/PSM verify tries."""
+    psm = verify_sheet_music.PSM_MODES[0]
+    for source_path, boxes in pages:
+        for img in encoded_crops(source_path, boxes):
+            page = verify_sheet_music.preprocess_page(img)
+            region = page.region(verify_sheet_music.region_boxes(img.size)[0][1])
+            with sw:
+                ocr_engine.image_to_string(region, config=f'--psm {psm} --oem 3')
+
+
+def bench_end_to_end(pages, sw):
+    """render_crop() for every crop, then OCR verification of every output."""
+    with tempfile.TemporaryDirectory() as out_dir:
+        crop_sheet_music.OUTPUT_DIR = out_dir
+        verify_sheet_music.CROPPED_DIR = out_dir
+        with sw:
+            for source_path, boxes in pages:
+                img = Image.open(source_path)
+                img = page_decode.auto_rotate(img)
+                for box in boxes:
+                    crop_sheet_music.render_crop(img, *box)
+            if OCR_ENABLED:
+                for qid in verify_sheet_music.EXPECTED:
+                    verify_sheet_music.verify_one(qid, NullCache())
+
+
+STAGES = {
+    "decode": bench_decode,
+    "rotate": bench_rotate,
+    "crop": bench_crop,
+    "resize": bench_resize,
+    "enhance": bench_enhance,
+    "encode": bench_encode,
+    "preprocess": bench_preprocess,
+    "ocr": bench_ocr,
+    "end_to_end": bench_end_to_end,
+}
+OCR_STAGES = ("ocr",)
+
+
+def run_stage(name, repeat, ocr=True):
+    """Child-process entry point: median times over `repeat` runs plus peak RSS.
+
+    `ocr` is the OCR engine name, or False to skip OCR.
+    """
+    global OCR_ENABLED
+    OCR_ENABLED = bool(ocr)
+    pages = fixture_pages()
+    walls, cpus = [], []
+    for _ in range(repeat):
+        sw = Stopwatch()
+        STAGES[name](pages, sw)
+        walls.append(sw.wall)
+        cpus.append(sw.cpu)
+    peak = crop_sheet_music.peak_rss_mb()
+    return {
+        "wall_s": round(statistics.median(walls), 4),
+        "cpu_s": round(statistics.median(cpus), 4),
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+        "repeat": repeat,
+        "ocr": ocr,
+    }
+
+
+def environment():
+    import PIL
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_benchmarks(stages, repeat, ocr=True):
+    results = {}
+    spawn = multiprocessing.get_context("spawn")
+    for name in stages:
+        # A fresh process per stage keeps peak RSS and caches separate
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            results[name] = pool.submit(run_stage, name, repeat, ocr).result()
+        r = results[name]
+        rss = f"{r['peak_rss_mb']:.0f}MB" if r["peak_rss_mb"] is not None else "n/a"
+        print(f"  {name:<12} wall {r['wall_s']:8.3f}s  cpu {r['cpu_s']:8.3f}s  peak RSS {rss}")
+    return results
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except OSError:
+        return None
+
+
+def save_results(path, results):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"environment": environment(), "stages": results}, f, indent=4)
+        f.write("\n")
+
+
+def compare(results, baseline, threshold):
+    """Print the comparison table. Returns the list of regressions."""
+    regressions = []
+    print(f"\nAgainst baseline (threshold {threshold:.0%}):")
+    for name, current in results.items():
+        before = baseline["stages"].get(name)
+        if not before:
+            print(f"  {name:<12} no baseline")
+            continue
+        if before.get("ocr") != current["ocr"] and name in OCR_STAGES + ("end_to_end",):
+            print(f"  {name:<12} not comparable (baseline ocr={before.get('ocr')})")
+            continue
+        cells = []
+        for metric in METRICS:
+            old, new = before.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            noise = metric != "peak_rss_mb" and abs(new - old) < NOISE_FLOOR_S
+            flag = ""
+            if change > threshold and not noise:
+                flag = " REGRESSION"
+                regressions.append((name, metric, old, new))
+            cells.append(f"{metric} {change:+.0%}{flag}")
+        print(f"  {name:<12} " + ", ".join(cells))
+    if baseline.get("environment") != environment():
+        print("  note: baseline was recorded on a different environment:")
+        print(f"    {baseline.get('environment')}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sheet music image pipeline.")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma-separated stages to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage (default: 3)")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="baseline JSON file (default: %(default)s)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown before failing, as a fraction (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results as the new baseline instead of comparing")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--no-ocr", action="store_true", help="skip the tesseract stage")
+    ocr_engine.add_engine_argument(parser)
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+    # Stage processes are spawned, so they pick the engine up from the environment
+    os.environ["OCR_ENGINE"] = args.ocr_engine
+    ocr_engine.configure(args.ocr_engine)
+    ocr = not args.no_ocr and ocr_engine.available() and ocr_engine.get_engine().name
+    if not ocr:
+        if not args.no_ocr:
+            print("no OCR engine available: skipping OCR")
+        stages = [s for s in stages if s not in OCR_STAGES]
+
+    problem = check_fixtures(fixture_pages())
+    if problem:
+        print(f"ERROR: {problem}")
+        return 2
+
+    print("Sheet Music Pipeline Benchmarks")
+    print("=" * 60)
+    results = run_benchmarks(stages, args.repeat, ocr)
+
+    if args.output:
+        save_results(args.output, results)
+    if args.save_baseline:
+        save_results(args.baseline, results)
+        print(f"\nSaved baseline: {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"\nNo baseline at {args.baseline} (record one with --save-baseline)")
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\nFAILED: {len(regressions)} regression(s) over {args.threshold:.0%}")
+        for name, metric, old, new in regressions:
+            print(f"  {name} {metric}: {old} -> {new}")
+        return 1
+    print("\nOK: no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,7 +19,37 @@ CORRECT PAGE MAPPING (verified via OCR/visual inspection):
 """
 
 from PIL import Image, ImageEnhance
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import argparse
+import asyncio
+import base64
+import functools
+import hashlib
+import io
+import json
+import math
 import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from ocr_cache import source_hash
+from page_decode import OrientedPage, decode_page, load_page
+import page_geometry
+import png_optimize
+from page_geometry import GEOMETRY_PARAMS, add_flatten_argument
+from page_layout import ANALYSIS_HEIGHT, LAYOUT_PARAMS, detect_systems
+from page_store import add_store_argument, default_store
+import sheet_music_atlas
+from sheet_music_atlas import add_atlas_arguments
+from sheet_music_assets import (
+    HASH_LENGTH, asset_entries, hashed_filename, public_url, question_sort_key, unhashed_filename,
+    write_headers, write_map_module,
+)
+from sheet_music_image import otsu_threshold, ssim
+import sheet_music_trace as tracing
 
 # Output directory
 OUTPUT_DIR = "public/sheet-music/cropped"
@@ -28,41 +58,291 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 # Target max dimension for web (keeps aspect ratio)
 MAX_WIDTH = 800
 JPEG_QUALITY = 75  # Good balance of quality/size
+CONTRAST_FACTOR = 1.1  # Slight enhancement after resize
+# Progressive JPEGs paint a coarse full frame first and refine it as the rest
+# arrives (and come out ~5% smaller at these sizes than baseline ones)
+JPEG_PROGRESSIVE = True
+
+# Inline placeholder per crop for the map module: a grayscale thumbnail this
+# wide as a low-quality JPEG data: URL (~250 bytes); upscaling blurs it
+PLACEHOLDER_WIDTH = 48
+PLACEHOLDER_QUALITY = 40
+
+# Default horizontal margins for every crop
+LEFT_PCT = 0.03
+RIGHT_PCT = 0.97
+
+# Build manifest used for incremental rebuilds; its "assets" list describes
+# every published crop file
+MANIFEST_PATH = "assets/asset-manifest.json"
+
+# Crop files that make up one question's outputs, by conventional name
+# (content hashes stripped): <id>.jpg or <id>.png and <id>-<width>w.<ext>
+OUTPUT_NAME = re.compile(r"^(?P<stem>.+?)(-\d+w)?\.(?P<ext>jpg|png|webp|avif)$")
+
+# Responsive ladder (--responsive): widths x formats, never upscaled.
+# The MAX_WIDTH JPEG is always written as the plain <id>.jpg fallback.
+RESPONSIVE_WIDTHS = (400, 800, 1600)
+RESPONSIVE_FORMATS = ("webp", "jpeg")
+WEBP_QUALITY = 72
+AVIF_QUALITY = 50
+
+# Per-image JPEG search (--target-ssim / --max-kb): quality range and chroma
+# subsampling options tried (2 = 4:2:0, 0 = 4:4:4)
+SEARCH_QUALITY_RANGE = (30, 95)
+SEARCH_SUBSAMPLING = (2, 0)
+SUBSAMPLING_NAMES = {0: "4:4:4", 1: "4:2:2", 2: "4:2:0"}
+
+# Grayscale palette crops (--palette): bits per pixel -> gray levels. 1-bit
+# crops are thresholded at the Otsu level, 4-bit crops dithered to 16 grays
+# after stretching levels so that most paper (all but its darkest
+# PAPER_PERCENTILE %) is pure white and typical ink pure black - dithering
+# the paper's noise would cost more than the JPEG saved.
+PALETTE_LEVELS = {1: 2, 4: 16}
+PAPER_PERCENTILE = 10
+INK_PERCENTILE = 50
 
+# --stream: decoded pages held at once (the memory bound), encoded crops
+# queued for writing, and concurrent file writes
+STREAM_PAGES_IN_FLIGHT = 3
+STREAM_WRITE_QUEUE = 16
+STREAM_WRITERS = 2
 
-def auto_rotate(img):
-    """Auto-rotate image based on EXIF orientation tag."""
+# --page-store: memory-map upright pages instead of decoding them (output is
+# identical, so this is not part of the crop key)
+USE_PAGE_STORE = False
+
+# Options for a plain run: fixed quality, no responsive variants
+DEFAULT_OPTIONS = {"variants": (), "encoder": {"mode": "fixed"}}
+
+
+def output_filename(scale_id):
+    """Conventional output file name for a scale, e.g. II-10 -> ii_10.jpg.
+
+    Files are written under content-hashed versions of these names
+    (ii_10.3f9a0c2b1d.jpg).
+    """
+    return f"{scale_id.lower().replace('-', '_')}.jpg"
+
+
+def load_manifest():
+    """Load the asset manifest, keeping any sections owned by other tools."""
     try:
-        exif = img._getexif()
-        if exif:
-            orientation = exif.get(274)
-            if orientation == 3:
-                img = img.rotate(180, expand=True)
-            elif orientation == 6:
-                img = img.rotate(270, expand=True)
-            elif orientation == 8:
-                img = img.rotate(90, expand=True)
-    except:
-        pass
-    return img
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {"defaults": {"project_id": "virtuoso-8"}, "assets": []}
+    manifest.setdefault("sheet_music", {})
+    manifest["sheet_music"].setdefault("sources", {})
+    manifest["sheet_music"].setdefault("crops", {})
+    manifest["sheet_music"].setdefault("layouts", {})
+    return manifest
 
 
-def crop_and_compress(img, scale_id, top_pct, bottom_pct, left_pct=0.03, right_pct=0.97):
-    """Crop a portion of the image, compress, and save."""
-    width, height = img.size
-    
-    left = int(width * left_pct)
-    right = int(width * right_pct)
-    top = int(height * top_pct)
-    bottom = int(height * bottom_pct)
-    
-    cropped = img.crop((left, top, right, bottom))
+def save_manifest(manifest):
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4)
+        f.write("\n")
+
+
+def crop_key(source_sha, scale_id, top_pct, bottom_pct, left_pct, right_pct, options=None):
+    """Cache key covering every input that affects a crop's output bytes."""
+    options = options or DEFAULT_OPTIONS
+    inputs = {
+        "options": options,
+        "source": source_sha,
+        "crop": [scale_id, top_pct, bottom_pct, left_pct, right_pct],
+        "max_width": MAX_WIDTH,
+        "jpeg_quality": JPEG_QUALITY,
+        "contrast": CONTRAST_FACTOR,
+        "hash_length": HASH_LENGTH,
+        "progressive": JPEG_PROGRESSIVE,
+        "placeholder": [PLACEHOLDER_WIDTH, PLACEHOLDER_QUALITY],
+    }
+    if options["variants"]:
+        inputs["variant_quality"] = [WEBP_QUALITY, AVIF_QUALITY]
+    if options["encoder"]["mode"] != "fixed":
+        inputs["search"] = [SEARCH_QUALITY_RANGE, SEARCH_SUBSAMPLING]
+    if options.get("flatten"):
+        inputs["geometry"] = GEOMETRY_PARAMS
+    if options.get("palette"):
+        inputs["png"] = png_optimize.SEARCH
+        inputs["palette_levels"] = [PAPER_PERCENTILE, INK_PERCENTILE]
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def detect_layout(source_path, count, manifest, flatten=None):
+    """Auto-detected boxes for a page, cached in the manifest by source hash.
+
+    With `flatten` the boxes are found on (and apply to) the flattened page.
+    """
+    sha = source_hash(source_path, manifest["sheet_music"]["sources"])
+    inputs = [sha, count, LAYOUT_PARAMS]
+    if flatten:
+        inputs += [flatten, GEOMETRY_PARAMS]
+    key = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+    layouts = manifest["sheet_music"]["layouts"]
+    entry = layouts.get(source_path)
+    if entry and entry["key"] == key:
+        return [tuple(box) for box in entry["boxes"]] if entry["boxes"] else None
     
-    # Resize to max width while maintaining aspect ratio
+    # Detection works at about ANALYSIS_HEIGHT rows, so a draft decode will do
+    page = load_page(source_path, min_width=ANALYSIS_HEIGHT)
+    if flatten:
+        page = page_geometry.flatten(page, flatten)[0]
+    boxes = detect_systems(page, count)
+    layouts[source_path] = {"key": key, "boxes": boxes}
+    return boxes
+
+
+def resolve_layout(pages, manifest, auto=False, flatten=None):
+    """Turn PAGES into crop boxes: (source_path, [(scale_id, top, bottom, left, right)]).
+
+    Bare scale IDs are placed by staff-system detection; (id, top, bottom)
+    entries are overrides used as-is, unless `auto` re-detects every page.
+    Detection failures fall back to the table values where there are any.
+    `flatten` detects on flattened pages, as the crops will be cut from them.
+    """
+    resolved = []
+    for source_path, scales in pages:
+        entries = [(entry,) if isinstance(entry, str) else tuple(entry) for entry in scales]
+        wanted = [auto or len(entry) == 1 for entry in entries]
+        boxes = None
+        if any(wanted) and os.path.exists(source_path):
+            boxes = detect_layout(source_path, len(entries), manifest, flatten)
+            if boxes is None:
+                print(f"  WARNING: staff detection failed for {source_path}")
+        
+        crops = []
+        for entry, detect, box in zip(entries, wanted, boxes or [None] * len(entries)):
+            if detect and box:
+                crops.append((entry[0],) + tuple(box))
+            elif len(entry) == 3:
+                crops.append(entry + (LEFT_PCT, RIGHT_PCT))
+            else:
+                print(f"  WARNING: no crop box for {entry[0]}, skipping")
+        resolved.append((source_path, crops))
+    return resolved
+
+
+def plan_build(pages, manifest, force=False, options=None):
+    """Split resolved pages into work to do and keys for the crops being rebuilt.
+
+    Returns (pending_pages, keys, skipped) where pending_pages has the same
+    shape as `pages` but only lists crops whose inputs or output changed.
+    """
+    sources = manifest["sheet_music"]["sources"]
+    crops = manifest["sheet_music"]["crops"]
+    pending_pages = []
+    keys = {}
+    skipped = 0
+    for source_path, scales in pages:
+        if not os.path.exists(source_path):
+            # Let the build report the missing file
+            pending_pages.append((source_path, scales))
+            continue
+        sha = source_hash(source_path, sources)
+        pending = []
+        for crop in scales:
+            scale_id = crop[0]
+            key = crop_key(sha, *crop, options=options)
+            entry = crops.get(scale_id)
+            if (not force and entry and entry["key"] == key
+                    and os.path.exists(os.path.join(OUTPUT_DIR, entry["file"]))):
+                skipped += 1
+                continue
+            keys[scale_id] = key
+            pending.append(crop)
+        if pending:
+            pending_pages.append((source_path, pending))
+    return pending_pages, keys, skipped
+
+
+def record_build(manifest, keys, outputs):
+    """Record freshly written crops and their variants in the manifest."""
+    crops = manifest["sheet_music"]["crops"]
+    for scale_id, key in keys.items():
+        written = outputs.get(scale_id)
+        if not written:
+            continue
+        base = written[0]
+        crops[scale_id] = {
+            "file": base["file"],
+            "key": key,
+            "width": base["width"],
+            "height": base["height"],
+            "bytes": base["bytes"],
+            "variants": [{k: v for k, v in output.items() if k != "placeholder"} for output in written],
+        }
+        if "placeholder" in base:
+            crops[scale_id]["placeholder"] = base["placeholder"]
+
+
+@functools.lru_cache(maxsize=2)
+def cached_page(source_path, min_width=None, stored=False, flatten=None):
+    """Decode a page once per process (crops are queued page by page).
+
+    With min_width (--low-memory) the page is draft-decoded near that width
+    and returned as an OrientedPage, so only crops are ever transposed.
+    """
+    return decode_page(source_path, min_width, stored, flatten)
+
+
+def page_decode_width(scales, options=None):
+    """Upright page width to draft-decode at for --low-memory, else None.
+
+    Wide enough that the narrowest crop still covers the largest output
+    width, so draft decoding never costs output resolution.
+    """
+    options = options or DEFAULT_OPTIONS
+    if not options.get("low_memory"):
+        return None
+    target = max([MAX_WIDTH] + [width for width, _ in options["variants"]])
+    narrowest = min(right - left for _, _, _, left, right in scales)
+    return math.ceil(target / max(narrowest, 0.01))
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unknown."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def avif_supported():
+    """True if this Pillow can write AVIF (built in, or via pillow-avif-plugin)."""
+    try:
+        import pillow_avif  # noqa: F401 - registers the plugin on older Pillow
+    except ImportError:
+        pass
+    Image.init()
+    return 'AVIF' in Image.SAVE
+
+
+def output_variants(responsive=False, avif=False):
+    """(width, format) pairs to write for every crop, besides <id>.jpg."""
+    if not responsive:
+        return ()
+    formats = (("avif",) if avif else ()) + RESPONSIVE_FORMATS
+    return tuple((width, fmt) for width in RESPONSIVE_WIDTHS for fmt in formats)
+
+
+def variant_filename(scale_id, width, fmt):
+    """e.g. II-10 at 400px WebP -> ii_10-400w.webp"""
+    stem = output_filename(scale_id)[:-len('.jpg')]
+    return f"{stem}-{width}w.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def fit_width(cropped, max_width):
+    """Downscale to max_width (keeping aspect ratio), RGB, slight contrast boost."""
     crop_w, crop_h = cropped.size
-    if crop_w > MAX_WIDTH:
-        ratio = MAX_WIDTH / crop_w
-        new_size = (MAX_WIDTH, int(crop_h * ratio))
+    if crop_w > max_width:
+        ratio = max_width / crop_w
+        new_size = (max_width, int(crop_h * ratio))
         cropped = cropped.resize(new_size, Image.LANCZOS)
     
     # Convert to RGB for JPEG
@@ -71,38 +351,401 @@ def crop_and_compress(img, scale_id, top_pct, bottom_pct, left_pct=0.03, right_p
     
     # Enhance slightly
     enhancer = ImageEnhance.Contrast(cropped)
-    cropped = enhancer.enhance(1.1)
+    return enhancer.enhance(CONTRAST_FACTOR)
+
+
+def palette_crop(img, bits):
+    """Grayscale palette version of a fit_width() crop at 1 or 4 bits per pixel."""
+    gray = img.convert('L')
+    pixels = np.asarray(gray)
+    level = otsu_threshold(pixels)
+    if bits == 1:
+        return gray.point(lambda v: 255 if v >= level else 0).convert('1', dither=Image.Dither.NONE)
+    paper, ink = pixels[pixels >= level], pixels[pixels < level]
+    white = np.percentile(paper, PAPER_PERCENTILE) if len(paper) else 255
+    black = np.percentile(ink, INK_PERCENTILE) if len(ink) else 0
+    stretched = (pixels.astype(np.float32) - black) * (255 / max(white - black, 1))
+    gray = Image.fromarray(np.clip(stretched, 0, 255).round().astype(np.uint8))
+    levels = PALETTE_LEVELS[bits]
+    palette = Image.new('P', (1, 1))
+    palette.putpalette([round(i * 255 / (levels - 1)) for i in range(levels) for _ in range(3)])
+    return gray.convert('RGB').quantize(palette=palette, dither=Image.Dither.FLOYDSTEINBERG)
+
+
+def encode_jpeg(img, quality, subsampling=-1):
+    """JPEG bytes for img (subsampling -1 = Pillow's default for the quality)."""
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality, optimize=True, subsampling=subsampling,
+             progressive=JPEG_PROGRESSIVE)
+    return buffer.getvalue()
+
+
+def placeholder(img):
+    """data: URL of a tiny grayscale JPEG preview of a crop."""
+    height = max(1, round(img.size[1] * PLACEHOLDER_WIDTH / img.size[0]))
+    thumb = img.convert('L').resize((PLACEHOLDER_WIDTH, height), Image.LANCZOS, reducing_gap=3.0)
+    buffer = io.BytesIO()
+    thumb.save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY, optimize=True)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _jpeg_ssim(reference, data):
+    return ssim(reference, np.asarray(Image.open(io.BytesIO(data)).convert('L')))
+
+
+def search_jpeg(img, encoder):
+    """Binary-search JPEG quality per subsampling mode for one image.
+
+    "ssim" mode finds the lowest quality whose SSIM against the pre-encode
+    image reaches the target and keeps the smallest result; "bytes" mode
+    finds the highest quality within the byte budget and keeps the most
+    faithful result. Returns (data, quality, subsampling).
+    """
+    reference = np.asarray(img.convert('L'))
+    candidates = []
+    for subsampling in SEARCH_SUBSAMPLING:
+        lo, hi = SEARCH_QUALITY_RANGE
+        best = None
+        while lo <= hi:
+            quality = (lo + hi) // 2
+            data = encode_jpeg(img, quality, subsampling)
+            if encoder["mode"] == "ssim":
+                ok = _jpeg_ssim(reference, data) >= encoder["target"]
+            else:
+                ok = len(data) <= encoder["budget"]
+            if ok:
+                best = (data, quality, subsampling)
+            # ssim: look for lower quality; bytes: look for higher quality
+            if ok == (encoder["mode"] == "ssim"):
+                hi = quality - 1
+            else:
+                lo = quality + 1
+        if best is None:
+            # Unreachable target: best effort at the edge of the range
+            quality = SEARCH_QUALITY_RANGE[1 if encoder["mode"] == "ssim" else 0]
+            best = (encode_jpeg(img, quality, subsampling), quality, subsampling)
+        candidates.append(best)
     
-    # Save as JPEG for smaller file size
-    output_filename = f"{scale_id.lower().replace('-', '_')}.jpg"
-    output_path = os.path.join(OUTPUT_DIR, output_filename)
-    cropped.save(output_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    if encoder["mode"] == "ssim":
+        return min(candidates, key=lambda c: len(c[0]))
+    within = [c for c in candidates if len(c[0]) <= encoder["budget"]] or candidates
+    return max(within, key=lambda c: (_jpeg_ssim(reference, c[0]), -len(c[0])))
+
+
+def jpeg_output(img, encoder):
+    """JPEG bytes using the fixed quality or a per-image search.
+
+    Returns (data, extra) where extra holds manifest fields for searched
+    images (quality, subsampling and the size the fixed JPEG_QUALITY encode
+    would have had).
+    """
+    if encoder["mode"] == "fixed":
+        return encode_jpeg(img, JPEG_QUALITY), {}
+    data, quality, subsampling = search_jpeg(img, encoder)
+    return data, {
+        "quality": quality,
+        "subsampling": SUBSAMPLING_NAMES[subsampling],
+        "baseline_bytes": len(encode_jpeg(img, JPEG_QUALITY)),
+    }
+
+
+def variant_output(img, fmt, encoder):
+    """(data, extra) for one responsive variant."""
+    if fmt == "jpeg":
+        return jpeg_output(img, encoder)
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        img.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+    else:
+        img.save(buffer, 'AVIF', quality=AVIF_QUALITY)
+    return buffer.getvalue(), {}
+
+
+def encode_crop(img, scale_id, top_pct, bottom_pct, left_pct=LEFT_PCT, right_pct=RIGHT_PCT,
+                options=None):
+    """Crop a portion of the image and compress it, in memory.
+
+    Returns (size, files) where files are (path, data, output) for the
+    <id>.jpg fallback (<id>.png with options["palette"]) first and then every
+    variant; output is the manifest dict of file, format, width, height,
+    bytes, sha256 (the first one also holds the placeholder data: URL). File
+    names carry the content hash of their data.
+    """
+    options = options or DEFAULT_OPTIONS
+    encoder = options["encoder"]
+    width, height = img.size
+    
+    left = int(width * left_pct)
+    right = int(width * right_pct)
+    top = int(height * top_pct)
+    bottom = int(height * bottom_pct)
+    
+    with tracing.span("crop", qid=scale_id):
+        cropped = img.crop((left, top, right, bottom))
+    tracing.count("pixels_cropped", cropped.size[0] * cropped.size[1])
+    
+    # Resize to max width while maintaining aspect ratio
+    with tracing.span("resize", qid=scale_id, width=MAX_WIDTH):
+        base = fit_width(cropped, MAX_WIDTH)
+    
+    if options.get("palette"):
+        # Ink on paper: a small palette PNG instead of the JPEG
+        with tracing.span("encode", qid=scale_id, format="png", width=MAX_WIDTH, bits=options["palette"]):
+            data = png_optimize.optimize_image(palette_crop(base, options["palette"]))
+        filename = output_filename(scale_id)[:-len('.jpg')] + ".png"
+        output_path = os.path.join(OUTPUT_DIR, hashed_filename(filename, data))
+        files = [(output_path, data, dict(_describe(output_path, "png", base.size, data),
+                                          bits=options["palette"]))]
+    else:
+        # Save as JPEG for smaller file size
+        with tracing.span("encode", qid=scale_id, format="jpeg", width=MAX_WIDTH, mode=encoder["mode"]):
+            data, extra = jpeg_output(base, encoder)
+        output_path = os.path.join(OUTPUT_DIR, hashed_filename(output_filename(scale_id), data))
+        files = [(output_path, data, dict(_describe(output_path, "jpeg", base.size, data), **extra))]
+    with tracing.span("placeholder", qid=scale_id, width=PLACEHOLDER_WIDTH):
+        files[0][2]["placeholder"] = placeholder(base)
     
-    # Get file size
-    file_size = os.path.getsize(output_path) / 1024  # KB
-    print(f"  {scale_id}: {cropped.size[0]}x{cropped.size[1]} ({file_size:.1f}KB) -> {output_filename}")
+    # Responsive ladder, resized from the full-resolution crop
+    resized = {MAX_WIDTH: base}
+    for target, fmt in options["variants"]:
+        if target == MAX_WIDTH and fmt == "jpeg" and not options.get("palette"):
+            continue  # written above as <id>.jpg
+        if target > cropped.size[0] and target != MAX_WIDTH:
+            continue
+        if target not in resized:
+            with tracing.span("resize", qid=scale_id, width=target):
+                resized[target] = fit_width(cropped, target)
+        with tracing.span("encode", qid=scale_id, format=fmt, width=target, mode=encoder["mode"]):
+            data, extra = variant_output(resized[target], fmt, encoder)
+        path = os.path.join(OUTPUT_DIR, hashed_filename(variant_filename(scale_id, target, fmt), data))
+        files.append((path, data, dict(_describe(path, fmt, resized[target].size, data), **extra)))
     
+    return base.size, files
+
+
+def write_files(files):
+    """Write encode_crop() files to disk. Returns their output dicts."""
+    with tracing.span("write", files=len(files)):
+        for path, data, _ in files:
+            with open(path, 'wb') as f:
+                f.write(data)
+    tracing.count("bytes_written", sum(len(data) for _, data, _ in files))
+    return [output for _, _, output in files]
+
+
+def render_crop(img, scale_id, top_pct, bottom_pct, left_pct=LEFT_PCT, right_pct=RIGHT_PCT,
+                options=None):
+    """Crop a portion of the image, compress, and save.
+
+    Returns (path, size, outputs) where outputs describes every file written
+    (the <id>.jpg fallback first) as dicts of file, format, width, height, bytes.
+    """
+    size, files = encode_crop(img, scale_id, top_pct, bottom_pct, left_pct, right_pct, options)
+    return files[0][0], size, write_files(files)
+
+
+def _describe(path, fmt, size, data):
+    return {
+        "file": os.path.basename(path),
+        "format": fmt,
+        "width": size[0],
+        "height": size[1],
+        "bytes": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+
+def report_crop(scale_id, output_path, size, outputs):
+    """Print the one-line summary for a written crop."""
+    file_size = outputs[0]["bytes"] / 1024  # KB
+    extra = ""
+    if outputs and "bits" in outputs[0]:
+        extra += f" {outputs[0]['bits']}-bit"
+    if outputs and "quality" in outputs[0]:
+        extra += f" q={outputs[0]['quality']} {outputs[0]['subsampling']}"
+    if len(outputs) > 1:
+        extra += f" (+{len(outputs) - 1} variants)"
+    print(f"  {scale_id}: {size[0]}x{size[1]} ({file_size:.1f}KB) -> {os.path.basename(output_path)}{extra}")
+
+
+def crop_and_compress(img, scale_id, top_pct, bottom_pct, left_pct=LEFT_PCT, right_pct=RIGHT_PCT,
+                      options=None, outputs=None):
+    """Crop a portion of the image, compress, and save."""
+    output_path, size, written = render_crop(img, scale_id, top_pct, bottom_pct,
+                                             left_pct, right_pct, options)
+    report_crop(scale_id, output_path, size, written)
+    if outputs is not None:
+        outputs[scale_id] = written
     return output_path
 
 
-def process_page(source_path, scales):
-    """Process a single page and crop all scales from it."""
+def process_page(source_path, scales, options=None, outputs=None, img=None):
+    """Process a single page and crop all scales from it. Returns elapsed seconds.
+
+    Written files per scale are collected into `outputs` when given. `img`
+    is an already decoded, upright page shared by the pipeline runner.
+    """
     print(f"\nProcessing: {source_path}")
     
     if not os.path.exists(source_path):
         print(f"  ERROR: File not found!")
-        return
+        return None
+    
+    options = options or DEFAULT_OPTIONS
+    start = time.perf_counter()
+    with tracing.span("page", source=source_path, crops=len(scales)):
+        if img is None:
+            img = cached_page(source_path, page_decode_width(scales, options), USE_PAGE_STORE,
+                              options.get("flatten"))
+        
+        if isinstance(img, OrientedPage):
+            label = "Decoded size"
+        else:
+            label = "Flattened size" if options.get("flatten") else "Original size"
+        print(f"  {label}: {img.size[0]}x{img.size[1]}")
+        
+        for scale_id, *box in scales:
+            crop_and_compress(img, scale_id, *box, options=options, outputs=outputs)
+    
+    return time.perf_counter() - start
+
+
+def _crop_task(source_path, scale_id, top_pct, bottom_pct, left_pct, right_pct, options=None,
+               min_width=None, stored=False, flatten=None):
+    """Worker entry point: render one crop from the worker's cached page.
+
+    Returns the render_crop() result, elapsed seconds and the worker's trace
+    events (None unless tracing).
+    """
+    start = time.perf_counter()
+    with tracing.span("task", qid=scale_id, source=source_path):
+        img = cached_page(source_path, min_width, stored, flatten)
+        result = render_crop(img, scale_id, top_pct, bottom_pct, left_pct, right_pct, options)
+    return result + (time.perf_counter() - start, tracing.drain())
+
+
+def process_pages_parallel(pages, jobs, options=None, outputs=None):
+    """Fan every crop out over a process pool. Returns {source_path: seconds}.
+
+    Output is byte-identical to the serial path since both go through
+    render_crop(); per-page times are the summed worker time for that page.
+    Per-image quality searches run inside the workers, so they parallelize
+    the same way.
+    """
+    timings = {}
+    initializer = tracing.enable if tracing.enabled() else None
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer) as pool:
+        futures = []
+        for source_path, scales in pages:
+            if not os.path.exists(source_path):
+                print(f"\nProcessing: {source_path}")
+                print(f"  ERROR: File not found!")
+                continue
+            min_width = page_decode_width(scales, options)
+            for crop in scales:
+                future = pool.submit(_crop_task, source_path, *crop, options=options,
+                                     min_width=min_width, stored=USE_PAGE_STORE,
+                                     flatten=(options or DEFAULT_OPTIONS).get("flatten"))
+                futures.append((source_path, crop[0], future))
+        
+        # Report in PAGES order regardless of completion order
+        current = None
+        for source_path, scale_id, future in futures:
+            if source_path != current:
+                print(f"\nProcessing: {source_path}")
+                current = source_path
+            output_path, size, written, elapsed, trace_events = future.result()
+            tracing.merge(trace_events)
+            report_crop(scale_id, output_path, size, written)
+            if outputs is not None:
+                outputs[scale_id] = written
+            timings[source_path] = timings.get(source_path, 0.0) + elapsed
+    return timings
+
+
+async def _stream_pages(pages, jobs, options, outputs):
+    """decode -> crop/encode -> write, connected by bounded queues.
+
+    Decoding and encoding run on a thread pool of `jobs` workers (Pillow
+    releases the GIL while it decodes, resamples and encodes); writes run on
+    their own threads so disk I/O overlaps the CPU work. A page slot is held
+    from decode until its last crop is encoded, so at most
+    STREAM_PAGES_IN_FLIGHT decoded pages exist however many pages are fed in.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(STREAM_PAGES_IN_FLIGHT)
+    crops = asyncio.Queue(maxsize=jobs)
+    encoded = asyncio.Queue(maxsize=STREAM_WRITE_QUEUE)
+    started, unencoded, unwritten, timings = {}, {}, {}, {}
+    
+    async def decode(cpu):
+        for source_path, scales in pages:
+            if not os.path.exists(source_path):
+                print(f"\nProcessing: {source_path}")
+                print(f"  ERROR: File not found!")
+                continue
+            await slots.acquire()
+            started[source_path] = time.perf_counter()
+            img = await loop.run_in_executor(cpu, decode_page, source_path,
+                                             page_decode_width(scales, options), USE_PAGE_STORE,
+                                             options.get("flatten"))
+            print(f"\nDecoded: {source_path} ({img.size[0]}x{img.size[1]})")
+            unencoded[source_path] = unwritten[source_path] = len(scales)
+            for crop in scales:
+                await crops.put((source_path, img, crop))
+            # Only the queued crops may keep the page alive while the next
+            # one waits for a slot
+            del img
+        for _ in range(jobs):
+            await crops.put(None)
     
-    img = Image.open(source_path)
-    img = auto_rotate(img)
+    async def transform(cpu):
+        while (item := await crops.get()) is not None:
+            source_path, img, crop = item
+            size, files = await loop.run_in_executor(
+                cpu, functools.partial(encode_crop, img, *crop, options=options))
+            # Drop this task's reference so a finished page can be freed
+            del item, img
+            unencoded[source_path] -= 1
+            if not unencoded[source_path]:
+                slots.release()
+            await encoded.put((source_path, crop[0], size, files))
     
-    print(f"  Original size: {img.size[0]}x{img.size[1]}")
+    async def write(disk):
+        while (item := await encoded.get()) is not None:
+            source_path, scale_id, size, files = item
+            written = await loop.run_in_executor(disk, write_files, files)
+            report_crop(scale_id, files[0][0], size, written)
+            outputs[scale_id] = written
+            unwritten[source_path] -= 1
+            if not unwritten[source_path]:
+                timings[source_path] = time.perf_counter() - started[source_path]
     
-    for scale_id, top_pct, bottom_pct in scales:
-        crop_and_compress(img, scale_id, top_pct, bottom_pct)
+    with ThreadPoolExecutor(max_workers=jobs) as cpu, ThreadPoolExecutor(max_workers=STREAM_WRITERS) as disk:
+        writers = [asyncio.ensure_future(write(disk)) for _ in range(STREAM_WRITERS)]
+        await asyncio.gather(decode(cpu), *(transform(cpu) for _ in range(jobs)))
+        for _ in writers:
+            await encoded.put(None)
+        await asyncio.gather(*writers)
+    return timings
+
+
+def process_pages_streaming(pages, jobs, options=None, outputs=None):
+    """Stream every page through decode, crop/encode and write stages.
+
+    Returns {source_path: seconds from decode start to last write}. Crops are
+    reported as they are written, so their order varies between runs; the
+    files and manifest entries match the serial path.
+    """
+    options = options or DEFAULT_OPTIONS
+    outputs = outputs if outputs is not None else {}
+    return asyncio.run(_stream_pages(pages, jobs, options, outputs))
 
 
 # CORRECT PAGE MAPPING - verified order
+# Entries are (scale_id, top_pct, bottom_pct) overrides. A bare scale ID
+# (e.g. "II-1") is placed automatically by staff-system detection, which
+# --auto-layout applies to every page.
 PAGES = [
     # Page 1: Ab Major, G# Minor Melodic, G# Minor Harmonic
     ("sheet-music/IMG20251212084748.jpg", [
@@ -200,25 +843,210 @@ PAGES = [
 ]
 
 
-def main():
+def start_build(options, force=False, auto_layout=False):
+    """Load the manifest and plan a build. Returns (manifest, layout, pages, keys)."""
+    manifest = load_manifest()
+    layout = resolve_layout(PAGES, manifest, auto=auto_layout, flatten=options.get("flatten"))
+    pages, keys, skipped = plan_build(layout, manifest, force=force, options=options)
+    if skipped:
+        print(f"Up to date: {skipped} crops (use --force to rebuild)")
+    return manifest, layout, pages, keys
+
+
+def prune_outputs(outputs):
+    """Delete superseded files (older hashes, plain names) of rebuilt crops.
+
+    Plain-named PNGs predate the build script and are left alone.
+    """
+    current = {output["file"] for written in outputs.values() for output in written}
+    stems = {output_filename(scale_id)[:-len('.jpg')] for scale_id in outputs}
+    removed = 0
+    for name in os.listdir(OUTPUT_DIR):
+        match = OUTPUT_NAME.match(unhashed_filename(name))
+        if not match or (name == unhashed_filename(name) and match.group("ext") == "png"):
+            continue
+        if name not in current and match.group("stem") in stems:
+            os.remove(os.path.join(OUTPUT_DIR, name))
+            removed += 1
+    return removed
+
+
+def finish_build(manifest, layout, keys, outputs, atlas=None):
+    """Record written crops, save the manifest and regenerate the map module
+    and the immutable-caching headers of the hashed files.
+
+    The manifest's "assets" list is rewritten for the sheet music crops and
+    atlases; entries other tools added elsewhere are kept. `atlas` ({"mode",
+    "max_dim", "max_bytes"}) (re)builds sprite atlases; without it atlases
+    that no longer match their crops are dropped.
+    """
+    record_build(manifest, keys, outputs)
+    removed = prune_outputs(outputs)
+    if removed:
+        print(f"Removed {removed} superseded crop files")
+    scale_ids = sorted((crop[0] for _, scales in layout for crop in scales), key=question_sort_key)
+    crops = manifest["sheet_music"]["crops"]
+    
+    section = manifest["sheet_music"].pop("atlas", None)
+    if atlas:
+        print("\nSprite atlases:")
+        section = sheet_music_atlas.build_atlases(crops, scale_ids, OUTPUT_DIR, atlas["mode"], JPEG_QUALITY,
+                                                  section, atlas["max_dim"], atlas["max_bytes"])
+    else:
+        section = sheet_music_atlas.drop_stale(section, crops)
+    if section:
+        manifest["sheet_music"]["atlas"] = section
+    sheet_music_atlas.write_coordinates(section)
+    
+    prefixes = (public_url(OUTPUT_DIR) + "/", public_url(sheet_music_atlas.ATLAS_DIR) + "/")
+    manifest["assets"] = [asset for asset in manifest.get("assets", [])
+                          if not asset.get("path", "").startswith(prefixes)]
+    manifest["assets"] += asset_entries(OUTPUT_DIR, crops, scale_ids)
+    manifest["assets"] += sheet_music_atlas.asset_entries(section)
+    save_manifest(manifest)
+    write_map_module(OUTPUT_DIR, crops, scale_ids, sprites=sheet_music_atlas.sprite_entries(section))
+    write_headers([asset for asset in manifest["assets"] if asset.get("path", "").startswith(prefixes)])
+
+
+def print_search_savings(outputs):
+    """Compare searched JPEGs against what fixed JPEG_QUALITY would have written."""
+    searched = [o for written in outputs.values() for o in written if "baseline_bytes" in o]
+    if not searched:
+        return
+    actual = sum(o["bytes"] for o in searched)
+    baseline = sum(o["baseline_bytes"] for o in searched)
+    saved = baseline - actual
+    print(f"Quality search: {len(searched)} JPEGs, {actual/1024:.1f}KB vs {baseline/1024:.1f}KB "
+          f"at fixed quality {JPEG_QUALITY} (saved {saved/1024:.1f}KB, {saved / max(baseline, 1):.0%})")
+
+
+def print_timings(timings, wall_time, jobs):
+    """Print the per-page and total wall-clock summary."""
+    print("\nTimings:")
+    for source_path, elapsed in timings.items():
+        print(f"  {os.path.basename(source_path)}: {elapsed:.2f}s")
+    print(f"  Total wall clock: {wall_time:.2f}s ({jobs} job{'s' if jobs != 1 else ''})")
+    peak = peak_rss_mb()
+    if peak is not None:
+        print(f"  Peak RSS: {peak:.0f}MB (main process)")
+
+
+def add_crop_arguments(parser, low_memory=True):
+    """Add the switches that decide what a build writes (--flatten included).
+
+    They all go into the crop keys, so every script that rebuilds crops
+    takes the same ones: a rebuild with different switches would replace
+    every crop (and delete the variants the last build wrote). Scripts that
+    share full pages between stages leave out --low-memory.
+    """
+    parser.add_argument("--responsive", action="store_true",
+                        help=f"also write {'/'.join(map(str, RESPONSIVE_WIDTHS))}px WebP and JPEG variants")
+    parser.add_argument("--avif", action="store_true",
+                        help="add AVIF to the responsive variants (needs Pillow AVIF support)")
+    search = parser.add_mutually_exclusive_group()
+    search.add_argument("--target-ssim", type=float, metavar="SCORE",
+                        help="per-image JPEG quality search: smallest file with SSIM >= SCORE (e.g. 0.97)")
+    search.add_argument("--max-kb", type=float, metavar="KB",
+                        help="per-image JPEG quality search: best quality within KB per file")
+    if low_memory:
+        parser.add_argument("--low-memory", action="store_true",
+                            help="draft-decode pages near the output size and transpose only crops "
+                                 "(bounded memory for large scans)")
+    parser.add_argument("--palette", type=int, choices=sorted(PALETTE_LEVELS), metavar="BITS",
+                        help="write <id>.png as a 1-bit (thresholded) or 4-bit (dithered gray) "
+                             "palette PNG instead of the JPEG")
+    add_flatten_argument(parser)
+
+
+def crop_options(args, parser):
+    """Build options from the add_crop_arguments() switches."""
+    low_memory = getattr(args, "low_memory", False)
+    if args.flatten and low_memory:
+        parser.error("--flatten needs full pages; it can't be combined with --low-memory")
+    if args.avif and not avif_supported():
+        parser.error("--avif: this Pillow build cannot write AVIF (pip install pillow-avif-plugin)")
+    if args.target_ssim is not None:
+        encoder = {"mode": "ssim", "target": args.target_ssim}
+    elif args.max_kb is not None:
+        encoder = {"mode": "bytes", "budget": int(args.max_kb * 1024)}
+    else:
+        encoder = {"mode": "fixed"}
+    options = {"variants": output_variants(args.responsive or args.avif, args.avif), "encoder": encoder}
+    if low_memory:
+        options["low_memory"] = True
+    if args.flatten:
+        options["flatten"] = args.flatten
+    if args.palette:
+        options["palette"] = args.palette
+    return options
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crop and compress sheet music pages.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="worker processes for cropping (0 = one per CPU, default: 1)")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild every crop, ignoring the manifest")
+    parser.add_argument("--auto-layout", action="store_true",
+                        help="detect crop boxes from staff lines, using PAGES values only as fallback")
+    parser.add_argument("--stream", action="store_true",
+                        help="overlap decoding, encoding and writing across pages with bounded "
+                             "queues (-j sets the encoder threads)")
+    add_crop_arguments(parser)
+    add_atlas_arguments(parser)
+    add_store_argument(parser)
+    tracing.add_trace_argument(parser)
+    args = parser.parse_args(argv)
+    options = crop_options(args, parser)
+    tracing.start(args)
+    global USE_PAGE_STORE
+    USE_PAGE_STORE = args.page_store
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    
     print("Sheet Music Cropping Script (with compression)")
     print("=" * 50)
     print(f"Max width: {MAX_WIDTH}px, JPEG quality: {JPEG_QUALITY}")
     print("=" * 50)
     
-    for source_path, scales in PAGES:
-        process_page(source_path, scales)
+    start = time.perf_counter()
+    manifest, layout, pages, keys = start_build(options, force=args.force, auto_layout=args.auto_layout)
+    
+    outputs = {}
+    if args.stream and pages:
+        timings = process_pages_streaming(pages, jobs, options, outputs)
+    elif jobs > 1 and pages:
+        timings = process_pages_parallel(pages, jobs, options, outputs)
+    else:
+        timings = {}
+        for source_path, scales in pages:
+            elapsed = process_page(source_path, scales, options, outputs)
+            if elapsed is not None:
+                timings[source_path] = elapsed
+    atlas = None
+    if args.atlas:
+        atlas = {"mode": args.atlas, "max_dim": args.atlas_max_dim, "max_bytes": int(args.atlas_max_kb * 1024)}
+    finish_build(manifest, layout, keys, outputs, atlas)
+    if USE_PAGE_STORE:
+        removed = default_store().prune()
+        if removed:
+            print(f"Removed {removed} stale page store entries")
+    wall_time = time.perf_counter() - start
     
     print("\n" + "=" * 50)
     
-    # Calculate total size
-    total_size = 0
-    files = [f for f in os.listdir(OUTPUT_DIR) if f.endswith('.jpg')]
-    for f in files:
-        total_size += os.path.getsize(os.path.join(OUTPUT_DIR, f))
+    # Calculate total size per format
+    totals = {}
+    for f in os.listdir(OUTPUT_DIR):
+        ext = os.path.splitext(f)[1]
+        count, size = totals.get(ext, (0, 0))
+        totals[ext] = (count + 1, size + os.path.getsize(os.path.join(OUTPUT_DIR, f)))
     
-    print(f"Created {len(files)} files, total size: {total_size/1024/1024:.1f}MB")
+    for ext, (count, size) in sorted(totals.items()):
+        print(f"Created {count} {ext} files, total size: {size/1024/1024:.1f}MB")
     print(f"Output directory: {OUTPUT_DIR}")
+    print_search_savings(outputs)
+    print_timings(timings, wall_time, jobs)
+    tracing.finish(args)
 
 
 if __name__ == "__main__":
@@ -4,10 +4,15 @@ Creates an HTML report with all 42 images for manual visual verification.
 """
 
 from PIL import Image
+import argparse
+import json
 import os
 import base64
 from io import BytesIO
 
+from sheet_music_assets import find_crop, public_url
+from sheet_music_atlas import COORDINATES_PATH
+
 # Directory with cropped images
 CROPPED_DIR = "public/sheet-music/cropped"
 OUTPUT_HTML = "public/sheet-music-verification.html"
@@ -59,8 +64,41 @@ QUESTIONS = [
 ]
 
 
-def generate_report():
-    """Generate an HTML report for visual verification."""
+def sprite_html(sprite, title):
+    """A div showing one atlas region, scaled to the card width."""
+    x, y, w, h = sprite["x"], sprite["y"], sprite["width"], sprite["height"]
+    atlas_w, atlas_h = sprite["atlasWidth"], sprite["atlasHeight"]
+    pos_x = 100 * x / (atlas_w - w) if atlas_w > w else 0
+    pos_y = 100 * y / (atlas_h - h) if atlas_h > h else 0
+    style = (f"aspect-ratio: {w} / {h}; background-image: url('{sprite['src']}'); "
+             f"background-size: {100 * atlas_w / w:.4f}% auto; "
+             f"background-position: {pos_x:.4f}% {pos_y:.4f}%")
+    return f'<div class="sprite" role="img" aria-label="{title}" style="{style}"></div>'
+
+
+def load_sprites(path=COORDINATES_PATH):
+    """Atlas regions by question ID from the coordinates file ({} if none)."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)["sprites"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def generate_report(results=None, versions=None, sprites=None):
+    """Generate an HTML report for visual verification.
+
+    `results` maps question IDs to OCR outcomes ("pass", "fail", "missing")
+    from verify_sheet_music.py; cards that did not pass are highlighted.
+    `versions` maps question IDs to a token (e.g. the crop's build key) added
+    to the image URL, so a reloaded report only refetches crops that changed.
+    `sprites` (from the atlas coordinates file) draws cards from the sprite
+    atlases instead, which checks the atlas regions and loads a few images
+    instead of 42.
+    """
+    results = results or {}
+    versions = versions or {}
+    sprites = sprites or {}
     
     html = """<!DOCTYPE html>
 <html lang="en">
@@ -116,6 +154,10 @@ def generate_report():
         .expected-title {
             color: #a5b4fc;
         }
+        .ocr-result {
+            font-size: 0.8em;
+            color: #cbd5e1;
+        }
         .card-body {
             padding: 10px;
         }
@@ -125,6 +167,12 @@ def generate_report():
             background: white;
             border-radius: 5px;
         }
+        .card-body .sprite {
+            width: 100%;
+            background-color: white;
+            background-repeat: no-repeat;
+            border-radius: 5px;
+        }
         .status {
             margin-top: 10px;
             padding: 10px;
@@ -187,21 +235,28 @@ def generate_report():
 """
     
     for qid, expected_title in QUESTIONS:
-        filename = f"{qid.lower().replace('-', '_')}.jpg"
-        filepath = os.path.join(CROPPED_DIR, filename)
+        filepath = find_crop(CROPPED_DIR, qid)
         
-        if os.path.exists(filepath):
-            # Use correct path from public root
-            img_src = f"/sheet-music/cropped/{filename}"
+        if qid in sprites:
+            img_html = sprite_html(sprites[qid], expected_title)
+        elif os.path.exists(filepath):
+            # Use correct path from public root (content-hashed name)
+            img_src = public_url(filepath)
+            if qid in versions:
+                img_src += f"?v={versions[qid]}"
             img_html = f'<img src="{img_src}" alt="{expected_title}">'
         else:
-            img_html = f'<div class="file-missing">FILE NOT FOUND: {filename}</div>'
+            img_html = f'<div class="file-missing">FILE NOT FOUND: {os.path.basename(filepath)}</div>'
+        
+        card_class = "card error" if results.get(qid) in ("fail", "missing") else "card"
+        ocr_html = f'<span class="ocr-result">OCR: {results[qid].upper()}</span>' if qid in results else ""
         
         html += f"""
-        <div class="card" id="card-{qid}" data-qid="{qid}">
+        <div class="{card_class}" id="card-{qid}" data-qid="{qid}">
             <div class="card-header">
                 <span class="question-id">{qid}</span>
                 <span class="expected-title">Expected: {expected_title}</span>
+                {ocr_html}
             </div>
             <div class="card-body">
                 {img_html}
@@ -258,5 +313,18 @@ def generate_report():
     print(f"Open in browser: http://localhost:5173/sheet-music-verification.html")
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the visual verification report.")
+    parser.add_argument("--atlas", action="store_true",
+                        help=f"draw the crops from the sprite atlases in {COORDINATES_PATH}")
+    args = parser.parse_args(argv)
+    sprites = None
+    if args.atlas:
+        sprites = load_sprites()
+        if not sprites:
+            parser.error(f"no atlases in {COORDINATES_PATH} (run crop_sheet_music.py --atlas first)")
+    generate_report(sprites=sprites)
+
+
 if __name__ == "__main__":
-    generate_report()
+    main()
@@ -0,0 +1,290 @@
+"""
+Fuzzy Label Matching for OCR Output
+Ranks question IDs by how well OCR text matches their titles, tolerating
+typical OCR misreads (♭ read as p/6/h, ♯ as H/4, merged words like
+"Apmajor") and spelled-out accidentals ("E flat").
+
+The matcher is compiled once from the question catalog (src/data/questions.js):
+each title becomes weighted terms - words plus tonic compounds such as
+"abmajor" or "inbb" - and every term's deletion neighbourhood goes into one
+index (the SymSpell technique). Matching tokenizes the text once, looks each
+token and adjacent-token join up in the index, confirms candidates with a
+confusion-aware edit distance and accumulates scores per question. In a
+tonic compound only the word gets an edit budget: the tonic has to be read
+exactly or through an OCR confusion, so "major" never passes for "cmajor",
+and a question whose title has a tonic only matches text that names one.
+tests/python/test_label_matcher.py covers these cases.
+"""
+
+import functools
+import math
+import re
+from collections import defaultdict
+
+QUESTIONS_MODULE = "src/data/questions.js"
+
+# A question matches when it scores at least MIN_SCORE and within
+# MATCH_MARGIN of the best score (a bare "Ab major" label fits the scale and
+# the arpeggio about equally)
+MIN_SCORE = 0.5
+MATCH_MARGIN = 0.05
+# Deletions indexed per term; also the most edits a lookup can bridge
+INDEX_DEPTH = 2
+
+# OCR confusions, costed as a quarter of an ordinary substitution
+CONFUSIONS = {
+    ("b", "p"), ("b", "6"), ("b", "h"),
+    ("#", "h"), ("#", "4"), ("#", "t"),
+    ("l", "1"), ("i", "1"), ("i", "l"), ("o", "0"), ("s", "5"),
+    ("m", "n"), ("r", "n"),
+}
+CONFUSION_COST = 0.25
+
+# Token normalization, applied to titles and OCR text alike
+ACCIDENTALS = {"♭": "b", "♯": "#", "♮": ""}
+SYNONYMS = {
+    "dom": "dominant", "dim": "diminished", "arp": "arpeggio", "chrom": "chromatic",
+    # Spelled-out accidentals ("E flat major") join the tonic like ♭/♯ do
+    "flat": "b", "sharp": "#",
+}
+STOPWORDS = {"in", "on", "the", "of", "and"}
+TONIC = re.compile(r"^[a-g][b#]?$")
+# What an accidental after a tonic can be read as
+ACCIDENTAL_READS = {"b", "#"} | {c for pair in CONFUSIONS if set(pair) & {"b", "#"} for c in pair}
+
+
+def max_distance(term):
+    """Edit budget for a term (the word of a tonic compound): confusions
+    only for short terms."""
+    if len(term) <= 3:
+        return 0.5
+    if len(term) <= 6:
+        return 1.0
+    return 2.0
+
+
+def normalize_token(token):
+    if token in SYNONYMS:
+        return SYNONYMS[token]
+    # Plurals: octaves -> octave, 3rds -> 3rd, arpeggios -> arpeggio
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Lowercased tokens with accidentals spelled b/#."""
+    for symbol, spelled in ACCIDENTALS.items():
+        text = text.replace(symbol, spelled)
+    return [normalize_token(t) for t in re.findall(r"[a-z0-9#]+", text.lower())]
+
+
+def title_terms(title):
+    """Terms for a catalog title, as {term: word it implies or None}.
+
+    Tonics only count joined to a neighbouring word ("abmajor", "inbb"); a
+    match on such a compound also credits that word ("major").
+    """
+    title = re.sub(r"\(.*?\)", " ", title)
+    tokens = tokenize(title)
+    terms = {}
+    for i, token in enumerate(tokens):
+        if TONIC.match(token):
+            if i + 1 < len(tokens):
+                neighbour = tokens[i + 1]
+                terms[token + neighbour] = neighbour
+            elif i:
+                neighbour = tokens[i - 1]
+                terms[neighbour + token] = neighbour
+        elif token not in STOPWORDS:
+            terms.setdefault(token, None)
+    return terms
+
+
+def split_compound(term, word):
+    """(tonic, tonic first) of a tonic compound built with word."""
+    if term.endswith(word):
+        return term[:-len(word)], True
+    return term[len(word):], False
+
+
+def tonic_cost(read, tonic):
+    """Cost of reading `tonic` as `read`: characters must be equal or OCR
+    confusions. None if the tonic was not read."""
+    if len(read) != len(tonic):
+        return None
+    cost = 0.0
+    for a, b in zip(read, tonic):
+        if a == b:
+            continue
+        if (a, b) not in CONFUSIONS and (b, a) not in CONFUSIONS:
+            return None
+        cost += CONFUSION_COST
+    return cost
+
+
+def deletions(word, depth=INDEX_DEPTH):
+    """The word and every string reachable by deleting up to `depth` characters."""
+    result = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+
+def ocr_distance(a, b):
+    """Optimal-string-alignment distance with cheap OCR confusions."""
+    rows = [[float(j) for j in range(len(b) + 1)]]
+    for i in range(1, len(a) + 1):
+        row = [float(i)] + [0.0] * len(b)
+        for j in range(1, len(b) + 1):
+            if a[i - 1] == b[j - 1]:
+                sub = 0.0
+            elif (a[i - 1], b[j - 1]) in CONFUSIONS or (b[j - 1], a[i - 1]) in CONFUSIONS:
+                sub = CONFUSION_COST
+            else:
+                sub = 1.0
+            row[j] = min(rows[i - 1][j] + 1, row[j - 1] + 1, rows[i - 1][j - 1] + sub)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], rows[i - 2][j - 2] + 1)
+        rows.append(row)
+    return rows[-1][-1]
+
+
+def load_catalog(path=QUESTIONS_MODULE):
+    """(question_id, title) pairs from the app's question catalog."""
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    return re.findall(r"id: '([IVX]+-\d+)'.*?title: '([^']*)'", source)
+
+
+class LabelMatcher:
+    """Compiled catalog index. match() ranks question IDs for a text."""
+
+    def __init__(self, catalog):
+        self.titles = dict(catalog)
+        terms = {qid: title_terms(title) for qid, title in catalog}
+        self.implies = {term: word for qid_terms in terms.values()
+                        for term, word in qid_terms.items() if word}
+        self.compounds = {term: split_compound(term, word) for term, word in self.implies.items()}
+        self.tonic_terms = {qid: {term for term, word in qid_terms.items() if word}
+                            for qid, qid_terms in terms.items()}
+
+        # IDF weights: terms shared by many questions (e.g. "major") count less
+        df = defaultdict(int)
+        for qid_terms in terms.values():
+            for term in qid_terms:
+                df[term] += 1
+        n = len(terms)
+        self.weights = {term: math.log(1 + n / count) for term, count in df.items()}
+        self.postings = defaultdict(list)
+        for qid, qid_terms in terms.items():
+            for term in qid_terms:
+                self.postings[term].append(qid)
+        self.totals = {qid: sum(self.weights[t] for t in qid_terms) for qid, qid_terms in terms.items()}
+
+        self.index = defaultdict(set)
+        for term in df:
+            for variant in deletions(term):
+                self.index[variant].add(term)
+
+    def lookup(self, token):
+        """{term: similarity} for catalog terms within their edit budget of token."""
+        candidates = set()
+        for variant in deletions(token):
+            candidates |= self.index.get(variant, set())
+        found = {}
+        for term in candidates:
+            if term in self.compounds:
+                distance = self.compound_distance(token, term)
+            else:
+                distance = ocr_distance(token, term)
+                if distance > max_distance(term):
+                    distance = None
+            if distance is not None:
+                found[term] = 1 - distance / len(term)
+        return found
+
+    def compound_distance(self, token, term):
+        """Distance of token to a tonic compound, or None when the tonic is
+        misread or the word is beyond its edit budget."""
+        tonic, tonic_first = self.compounds[term]
+        word = self.implies[term]
+        if len(token) <= len(tonic):
+            return None
+        if tonic_first:
+            cost, rest = tonic_cost(token[:len(tonic)], tonic), token[len(tonic):]
+            # "ebmajor" names E flat, not E: a natural tonic must not be
+            # followed by an accidental (unless the word starts with that letter)
+            if len(tonic) == 1 and rest[0] in ACCIDENTAL_READS and rest[0] != word[0]:
+                return None
+        else:
+            cost, rest = tonic_cost(token[-len(tonic):], tonic), token[:-len(tonic)]
+        if cost is None:
+            return None
+        distance = ocr_distance(rest, word)
+        # "in"/"on" only place the tonic; one misread letter is fine there
+        budget = 1.0 if word in STOPWORDS else max_distance(word)
+        return cost + distance if distance <= budget else None
+
+    def scan(self, text):
+        """Single pass over text. Returns (ranked, lines).
+
+        ranked is [(question_id, score)] best first (score in 0..1); lines
+        are the indices of text lines where any catalog term was found.
+        """
+        best = {}
+        lines = set()
+        seen = {}
+        for line_no, line in enumerate(text.split("\n")):
+            tokens = tokenize(line)
+            for i in range(len(tokens)):
+                # The token alone and joined with the next one or two
+                # ("ab major" -> "abmajor", "a b major" -> "abmajor")
+                for j in range(i + 1, min(i + 4, len(tokens) + 1)):
+                    key = "".join(tokens[i:j])
+                    if key not in seen:
+                        seen[key] = self.lookup(key)
+                    for term, sim in seen[key].items():
+                        lines.add(line_no)
+                        for credited in (term, self.implies.get(term)):
+                            if credited and sim > best.get(credited, 0):
+                                best[credited] = sim
+
+        scores = defaultdict(float)
+        for term, sim in best.items():
+            for qid in self.postings[term]:
+                scores[qid] += self.weights[term] * sim
+        # Without its tonic a title only names the kind of exercise
+        for qid in list(scores):
+            if self.tonic_terms[qid] and not self.tonic_terms[qid] & best.keys():
+                del scores[qid]
+        ranked = sorted(((qid, round(score / self.totals[qid], 3)) for qid, score in scores.items()),
+                        key=lambda item: -item[1])
+        return ranked, sorted(lines)
+
+    def match(self, text, limit=None):
+        """Ranked [(question_id, score)] for text, best first."""
+        ranked = self.scan(text)[0]
+        return ranked[:limit] if limit else ranked
+
+
+def is_match(ranked, qid, min_score=MIN_SCORE):
+    """True if qid is among the top-scoring questions with at least min_score."""
+    if not ranked:
+        return False
+    top = ranked[0][1]
+    return any(q == qid and s >= min_score and s >= top - MATCH_MARGIN for q, s in ranked)
+
+
+def describe(ranked, limit=3):
+    """e.g. "I-1 0.97, II-1 0.93, I-7 0.90" """
+    return ", ".join(f"{qid} {score:.2f}" for qid, score in ranked[:limit]) or "no match"
+
+
+@functools.lru_cache(maxsize=1)
+def default_matcher():
+    """Matcher for the app's question catalog, compiled once per process."""
+    return LabelMatcher(load_catalog())
+
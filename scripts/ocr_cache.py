@@ -0,0 +1,145 @@
+"""
+Persistent OCR Result Cache
+SQLite-backed store shared by verify_sheet_music.py and analyze_sheet_music.py.
+
+Entries are keyed by image content hash, region box, preprocessing parameters
+and tesseract config, so unchanged images never hit tesseract twice. The cache
+is bounded to MAX_ENTRIES and evicts least-recently-used entries.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = ".cache/ocr-cache.sqlite3"
+MAX_ENTRIES = 5000
+
+
+def file_hash(path):
+    """Hex SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_hash(path, records):
+    """file_hash() of a file, reusing records[path] while size/mtime match.
+
+    `records` maps paths to {"sha256", "size", "mtime_ns"}; a rehashed file
+    gets a new record object.
+    """
+    stat = os.stat(path)
+    entry = records.get(path)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha256"]
+    sha = file_hash(path)
+    records[path] = {"sha256": sha, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return sha
+
+
+def cache_key(image_hash, box, preprocess, config):
+    """Key for one OCR call: image content, region, preprocessing and config."""
+    payload = json.dumps([image_hash, list(box), preprocess, config], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class OcrCache:
+    """Size-bounded LRU cache of OCR text. Safe to share between threads."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ocr ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr (last_used)")
+        self._db.commit()
+
+    def get(self, key):
+        """Cached text for key, or None. Refreshes the entry's LRU position."""
+        with self._lock:
+            row = self._db.execute("SELECT text FROM ocr WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE ocr SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key, text):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO ocr (key, text, last_used) VALUES (?, ?, ?)",
+                (key, text, time.time()),
+            )
+            (count,) = self._db.execute("SELECT COUNT(*) FROM ocr").fetchone()
+            if count > self.max_entries:
+                self._db.execute(
+                    "DELETE FROM ocr WHERE key IN "
+                    "(SELECT key FROM ocr ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM ocr")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def summary(self):
+        return f"OCR cache: {self.hits} hits, {self.misses} misses"
+
+
+class NullCache:
+    """Stand-in used with --no-cache: never stores anything."""
+
+    hits = 0
+    misses = 0
+
+    def get(self, key):
+        return None
+
+    def put(self, key, text):
+        pass
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
+
+    def summary(self):
+        return "OCR cache: disabled"
+
+
+def open_cache(no_cache=False, clear=False, path=CACHE_PATH):
+    """Open the cache according to the --no-cache / --clear-cache switches."""
+    if clear and os.path.exists(path):
+        os.remove(path)
+        print(f"Cleared OCR cache: {path}")
+    if no_cache:
+        return NullCache()
+    return OcrCache(path)
+
+
+def add_cache_arguments(parser):
+    """Add the shared --no-cache / --clear-cache switches to an ArgumentParser."""
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always run OCR, neither reading nor writing the cache")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help=f"delete the OCR cache ({CACHE_PATH}) before running")
@@ -0,0 +1,211 @@
+"""
+OCR Engines for the Sheet Music Scripts
+One interface over the ways of running tesseract:
+
+- "tesserocr": in-process through the tesserocr bindings. Every worker thread
+  keeps one initialized API handle, so the language model is loaded once per
+  thread and image buffers are handed over directly, without temp files.
+- "subprocess": pytesseract, which writes a temp image and spawns the
+  tesseract binary for every call. Used when tesserocr is not installed.
+
+Nothing is imported or searched for until the first OCR call, so runs that
+never OCR (everything cached, --hash) don't pay for engine startup. The
+tesseract binary is looked up in $TESSERACT_CMD, then PATH, then the usual
+install locations of each platform.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import threading
+
+import numpy as np
+
+from sheet_music_image import to_gray_array
+import sheet_music_trace as tracing
+
+ENGINES = ("auto", "tesserocr", "subprocess")
+LANG = "eng"
+
+# tesseract defaults when the config doesn't say otherwise
+DEFAULT_PSM = 3
+DEFAULT_OEM = 3
+
+_engine = None
+_engine_error = None
+_preferred = os.environ.get("OCR_ENGINE", "auto")
+_lock = threading.Lock()
+
+
+class OcrUnavailable(RuntimeError):
+    """No OCR engine could be started."""
+
+
+def find_tesseract():
+    """Path of the tesseract binary, or None."""
+    candidates = [os.environ.get("TESSERACT_CMD"), shutil.which("tesseract")]
+    if sys.platform == "win32":
+        for base in (os.environ.get("ProgramFiles"), os.environ.get("ProgramFiles(x86)"),
+                     os.environ.get("LOCALAPPDATA") and os.path.join(os.environ["LOCALAPPDATA"], "Programs")):
+            if base:
+                candidates.append(os.path.join(base, "Tesseract-OCR", "tesseract.exe"))
+    elif sys.platform == "darwin":
+        candidates += ["/opt/homebrew/bin/tesseract", "/usr/local/bin/tesseract"]
+    else:
+        candidates += ["/usr/bin/tesseract", "/usr/local/bin/tesseract"]
+    for path in candidates:
+        if path and os.path.isfile(path):
+            return path
+    return None
+
+
+def parse_config(config):
+    """(psm, oem) from a tesseract config string such as '--psm 6 --oem 3'."""
+    psm, oem = DEFAULT_PSM, DEFAULT_OEM
+    args = config.split()
+    if len(args) % 2:
+        raise ValueError(f"unsupported tesseract config: {config!r}")
+    for option, value in zip(args[::2], args[1::2]):
+        if option == "--psm":
+            psm = int(value)
+        elif option == "--oem":
+            oem = int(value)
+        else:
+            raise ValueError(f"unsupported tesseract option: {option}")
+    return psm, oem
+
+
+class TesserocrEngine:
+    """In-process tesseract with one API handle per thread (and OEM)."""
+
+    name = "tesserocr"
+
+    def __init__(self):
+        try:
+            import tesserocr
+        except ImportError as e:
+            raise OcrUnavailable(f"tesserocr is not installed ({e})")
+        self._tesserocr = tesserocr
+        self._local = threading.local()
+        self._handles = []
+        self._handles_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _api(self, oem):
+        apis = getattr(self._local, "apis", None)
+        if apis is None:
+            apis = self._local.apis = {}
+        if oem not in apis:
+            with tracing.span("ocr_init", engine=self.name, oem=oem):
+                api = self._tesserocr.PyTessBaseAPI(lang=LANG, oem=oem)
+            with self._handles_lock:
+                self._handles.append(api)
+            apis[oem] = api
+        return apis[oem]
+
+    def image_to_string(self, image, config=''):
+        psm, oem = parse_config(config)
+        # Hand tesseract the raw 8-bit buffer; regions are usually
+        # non-contiguous views, so this is the only copy made
+        pixels = image if isinstance(image, np.ndarray) else to_gray_array(image)
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        height, width = pixels.shape[:2]
+        api = self._api(oem)
+        api.SetPageSegMode(psm)
+        api.SetImageBytes(pixels.tobytes(), width, height, 1, width)
+        return api.GetUTF8Text()
+
+    def version(self):
+        return self._tesserocr.tesseract_version().split()[1]
+
+    def close(self):
+        with self._handles_lock:
+            for api in self._handles:
+                api.End()
+            self._handles.clear()
+
+
+class SubprocessEngine:
+    """pytesseract: one tesseract process (and temp file) per call."""
+
+    name = "subprocess"
+
+    def __init__(self):
+        try:
+            import pytesseract
+        except ImportError as e:
+            raise OcrUnavailable(f"pytesseract is not installed ({e})")
+        cmd = find_tesseract()
+        if cmd is None:
+            raise OcrUnavailable("tesseract binary not found (install it, add it to PATH or set TESSERACT_CMD)")
+        pytesseract.pytesseract.tesseract_cmd = cmd
+        self._pytesseract = pytesseract
+        self.cmd = cmd
+
+    def image_to_string(self, image, config=''):
+        return self._pytesseract.image_to_string(image, config=config)
+
+    def version(self):
+        return str(self._pytesseract.get_tesseract_version())
+
+    def close(self):
+        pass
+
+
+ENGINE_CLASSES = {"tesserocr": TesserocrEngine, "subprocess": SubprocessEngine}
+
+
+def configure(name):
+    """Choose the engine ("auto", "tesserocr" or "subprocess") before first use."""
+    global _preferred, _engine, _engine_error
+    if name not in ENGINES:
+        raise ValueError(f"unknown OCR engine: {name}")
+    with _lock:
+        if _engine is not None:
+            _engine.close()
+        _preferred, _engine, _engine_error = name, None, None
+
+
+def get_engine():
+    """The configured engine, started on first use. Raises OcrUnavailable."""
+    global _engine, _engine_error
+    if _engine is not None:
+        return _engine
+    with _lock:
+        if _engine is None and _engine_error is None:
+            names = ("tesserocr", "subprocess") if _preferred == "auto" else (_preferred,)
+            errors = []
+            for name in names:
+                try:
+                    with tracing.span("ocr_engine", engine=name):
+                        _engine = ENGINE_CLASSES[name]()
+                    break
+                except OcrUnavailable as e:
+                    errors.append(f"{name}: {e}")
+            if _engine is None:
+                _engine_error = OcrUnavailable("no OCR engine available - " + "; ".join(errors))
+        if _engine is None:
+            raise _engine_error
+        return _engine
+
+
+def available():
+    """True if an OCR engine can be started."""
+    try:
+        get_engine()
+        return True
+    except OcrUnavailable:
+        return False
+
+
+def image_to_string(image, config=''):
+    """OCR a PIL image or 2-D uint8 array with the configured engine."""
+    return get_engine().image_to_string(image, config)
+
+
+def add_engine_argument(parser):
+    """Add the shared --ocr-engine switch to an ArgumentParser."""
+    parser.add_argument("--ocr-engine", choices=ENGINES, default=_preferred,
+                        help="tesserocr runs in-process, subprocess spawns tesseract per call; "
+                             "auto prefers tesserocr (default: %(default)s, or $OCR_ENGINE)")
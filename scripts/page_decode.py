@@ -0,0 +1,122 @@
+"""
+Page Decoding for the Sheet Music Scripts
+Opens source pages the same way everywhere: upright by lossless EXIF
+transpose (mirrored orientations included), optionally draft-decoded near a
+target width, flattened (page_geometry) or mapped from the page store. Crops
+and analysis therefore see the same pixels.
+"""
+
+from PIL import Image
+import math
+
+import page_geometry
+from page_store import default_store
+import sheet_music_trace as tracing
+
+# EXIF orientation -> lossless transpose that shows the page upright
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+SWAPS_AXES = (Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270,
+              Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE)
+
+
+def exif_transpose_method(img):
+    """Transpose method for the image's EXIF orientation tag, or None."""
+    try:
+        return ORIENTATION_TRANSPOSE.get(img.getexif().get(274))
+    except (OSError, SyntaxError, ValueError):
+        # Unreadable EXIF block: keep the stored orientation
+        return None
+
+
+def auto_rotate(img):
+    """Auto-rotate image based on EXIF orientation tag."""
+    method = exif_transpose_method(img)
+    return img.transpose(method) if method is not None else img
+
+
+class OrientedPage:
+    """A decoded page kept in its stored orientation (--low-memory).
+
+    Looks like the upright page to render_crop() (size, crop), but crop()
+    cuts the box out of the stored pixels and transposes only the crop, so
+    no rotated full-frame copy is ever made.
+    """
+
+    def __init__(self, img):
+        self.img = img
+        self.method = exif_transpose_method(img)
+        w, h = img.size
+        self.size = (h, w) if self.method in SWAPS_AXES else (w, h)
+
+    def crop(self, box):
+        region = self.img.crop(self.stored_box(box))
+        return region.transpose(self.method) if self.method is not None else region
+
+    def stored_box(self, box):
+        """Map an upright (left, top, right, bottom) box to stored pixels."""
+        x0, y0, x1, y1 = box
+        w, h = self.img.size
+        T = Image.Transpose
+        return {
+            None: (x0, y0, x1, y1),
+            T.FLIP_LEFT_RIGHT: (w - x1, y0, w - x0, y1),
+            T.ROTATE_180: (w - x1, h - y1, w - x0, h - y0),
+            T.FLIP_TOP_BOTTOM: (x0, h - y1, x1, h - y0),
+            T.TRANSPOSE: (y0, x0, y1, x1),
+            T.ROTATE_270: (y0, h - x1, y1, h - x0),
+            T.TRANSVERSE: (w - y1, h - x1, w - y0, h - x0),
+            T.ROTATE_90: (w - y1, x0, w - y0, x1),
+        }[self.method]
+
+
+def open_page(source_path, min_width=None):
+    """Open a page lazily, asking the JPEG decoder to scale it down (draft
+    mode: 1/2, 1/4 or 1/8 during the DCT) while the upright page stays at
+    least min_width pixels wide. Nothing is decoded yet.
+    """
+    img = Image.open(source_path)
+    if min_width:
+        upright_width = OrientedPage(img).size[0]
+        if min_width < upright_width:
+            scale = min_width / upright_width
+            img.draft(img.mode, (math.ceil(img.size[0] * scale), math.ceil(img.size[1] * scale)))
+    return img
+
+
+def load_page(source_path, min_width=None):
+    """Open a source page and apply its EXIF orientation."""
+    img = open_page(source_path, min_width)
+    return auto_rotate(img)
+
+
+def decode_page(source_path, min_width=None, stored=False, flatten=None):
+    """Decode a page, upright (or as an OrientedPage with min_width).
+
+    With `stored` the upright page is mapped from the page store instead;
+    min_width takes precedence, since it decodes less than a full page.
+    `flatten` ("deskew" or "perspective") runs page_geometry.flatten() on
+    full pages; the store keeps the flattened page.
+    """
+    if stored and not min_width:
+        return default_store().image(source_path, flatten=flatten)
+    with tracing.span("decode", source=source_path, low_memory=bool(min_width)):
+        if min_width:
+            img = open_page(source_path, min_width)
+            img.load()
+            page = OrientedPage(img)
+        else:
+            img = page = load_page(source_path)
+            img.load()
+    tracing.count("pixels_decoded", img.size[0] * img.size[1])
+    if flatten and not min_width:
+        with tracing.span("flatten", source=source_path, mode=flatten):
+            page = page_geometry.flatten(page, flatten)[0]
+    return page
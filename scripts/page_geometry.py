@@ -0,0 +1,212 @@
+"""
+Page Geometry Normalization
+Flattens phone photos of sheet music before cropping: estimates the skew
+from the staff lines, optionally finds the outline of the sheet of paper,
+and resamples the page once so staff lines run level (and, with the outline,
+the sheet fills the frame as a rectangle).
+
+Skew comes from projection profiles on a page reduced to about
+ANALYSIS_HEIGHT rows: the pixels of horizontal ink runs are sheared by every
+candidate angle at once and the angle whose row histogram is most peaked
+(staff lines collapsing onto single rows) wins, first coarsely, then in
+SKEW_STEP increments. The paper outline is the extreme corners of the bright
+region, kept only when it is clearly smaller than the frame.
+"""
+
+from PIL import Image
+import numpy as np
+import hashlib
+import json
+
+from page_layout import ANALYSIS_HEIGHT
+from sheet_music_image import otsu_threshold, to_gray_array
+
+# Skew search range and final resolution, in degrees
+MAX_SKEW = 5.0
+COARSE_STEP = 0.5
+SKEW_STEP = 0.05
+# Pages flatter than this are left alone rather than resampled
+MIN_SKEW = 0.1
+# Ink pixels sampled for the projection profiles
+MAX_SAMPLES = 100_000
+# Paper outline: the quadrilateral must cover at least MIN_PAGE_AREA of the
+# frame, and one corner must sit more than EDGE_MARGIN inside it
+MIN_PAGE_AREA = 0.4
+EDGE_MARGIN = 0.02
+
+# Part of the crop key (and, as params_digest(), of the page store entry
+# name and the OCR cache keys) when flattening
+GEOMETRY_PARAMS = {
+    "height": ANALYSIS_HEIGHT,
+    "max_skew": MAX_SKEW,
+    "step": SKEW_STEP,
+    "min_skew": MIN_SKEW,
+    "min_page_area": MIN_PAGE_AREA,
+    "edge_margin": EDGE_MARGIN,
+}
+
+# --flatten modes: level the staff lines, or also straighten the paper outline
+MODES = ("deskew", "perspective")
+
+
+def reduced(img):
+    """(image reduced to about ANALYSIS_HEIGHT rows, reduction factor)."""
+    factor = max(1, img.size[1] // ANALYSIS_HEIGHT)
+    return (img.reduce(factor) if factor > 1 else img), factor
+
+
+def line_pixels(mask):
+    """Ink pixels that are part of a horizontal run, as (ys, xs)."""
+    runs = mask[:, :-4] & mask[:, 2:-2] & mask[:, 4:]
+    # Solid rows are shadows or the desk, not lines
+    runs[runs.mean(axis=1) > 0.9] = False
+    ys, xs = np.nonzero(runs)
+    stride = max(1, len(ys) // MAX_SAMPLES)
+    return ys[::stride], xs[::stride] + 2
+
+
+def estimate_skew(mask):
+    """Staff-line angle of an ink mask in degrees (positive: lines descend to
+    the right), 0.0 when there is too little ink to tell."""
+    ys, xs = line_pixels(mask)
+    if len(ys) < 100:
+        return 0.0
+    xs = xs - mask.shape[1] / 2
+
+    def best(angles):
+        # One row histogram per candidate angle, all from a single bincount
+        shear = np.tan(np.radians(angles))
+        rows = np.rint(ys[None, :] - xs[None, :] * shear[:, None]).astype(np.int64)
+        rows -= rows.min()
+        span = int(rows.max()) + 1
+        rows += np.arange(len(angles))[:, None] * span
+        hist = np.bincount(rows.ravel(), minlength=len(angles) * span).reshape(len(angles), span)
+        scores = (hist.astype(np.float64) ** 2).sum(axis=1)
+        return float(angles[int(np.argmax(scores))])
+
+    coarse = best(np.arange(-MAX_SKEW, MAX_SKEW + COARSE_STEP / 2, COARSE_STEP))
+    fine = best(coarse + np.arange(-COARSE_STEP, COARSE_STEP + SKEW_STEP / 2, SKEW_STEP))
+    return round(fine, 3)
+
+
+def find_page_quad(gray):
+    """Corners of the sheet (top-left, top-right, bottom-right, bottom-left)
+    as (x, y) fractions of the frame, or None if the sheet fills the frame."""
+    height, width = gray.shape
+    paper = gray >= otsu_threshold(gray)
+    # Keep the bulk of the sheet, not bright specks on the desk
+    paper &= (paper.mean(axis=1) > 0.2)[:, None] & (paper.mean(axis=0) > 0.2)[None, :]
+    ys, xs = np.nonzero(paper)
+    if not len(ys):
+        return None
+    total, diff = xs + ys, xs - ys
+    corners = np.array([
+        (xs[np.argmin(total)], ys[np.argmin(total)]),
+        (xs[np.argmax(diff)], ys[np.argmax(diff)]),
+        (xs[np.argmax(total)], ys[np.argmax(total)]),
+        (xs[np.argmin(diff)], ys[np.argmin(diff)]),
+    ], dtype=np.float64) / (width - 1, height - 1)
+
+    x, y = corners[:, 0], corners[:, 1]
+    area = 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+    frame = np.array([(0, 0), (1, 0), (1, 1), (0, 1)])
+    if area < MIN_PAGE_AREA or np.abs(corners - frame).max() <= EDGE_MARGIN:
+        return None
+    return [(round(float(cx), 4), round(float(cy), 4)) for cx, cy in corners]
+
+
+def quad_size(quad, size):
+    """Output (width, height) in pixels for a sheet outline on a size page."""
+    points = np.array(quad) * (size[0] - 1, size[1] - 1)
+    tl, tr, br, bl = points
+    width = max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))
+    height = max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))
+    return int(round(width)), int(round(height))
+
+
+def homography(quad, size, out_size):
+    """3x3 matrix mapping output pixels to the outlined sheet on a size page."""
+    points = np.array(quad) * (size[0] - 1, size[1] - 1)
+    w, h = out_size[0] - 1, out_size[1] - 1
+    rows, values = [], []
+    for (u, v), (x, y) in zip([(0, 0), (w, 0), (w, h), (0, h)], points):
+        rows.append([u, v, 1, 0, 0, 0, -u * x, -v * x])
+        rows.append([0, 0, 0, u, v, 1, -u * y, -v * y])
+        values += [x, y]
+    coeffs = np.linalg.solve(np.array(rows, dtype=np.float64), np.array(values))
+    return np.append(coeffs, 1.0).reshape(3, 3)
+
+
+def rotation(angle, size):
+    """3x3 matrix mapping levelled output pixels to a page skewed by angle degrees."""
+    a = np.radians(angle)
+    cos, sin = np.cos(a), np.sin(a)
+    cx, cy = size[0] / 2, size[1] / 2
+    return np.array([
+        [cos, -sin, cx - cx * cos + cy * sin],
+        [sin, cos, cy - cx * sin - cy * cos],
+        [0, 0, 1],
+    ])
+
+
+def warp(img, matrix, size, fill):
+    """Resample img through an output->input matrix in one pass."""
+    matrix = matrix / matrix[2, 2]
+    if np.allclose(matrix[2, :2], 0):
+        return img.transform(size, Image.AFFINE, tuple(matrix[:2].ravel()), Image.BICUBIC, fillcolor=fill)
+    return img.transform(size, Image.PERSPECTIVE, tuple(matrix.ravel()[:8]), Image.BICUBIC, fillcolor=fill)
+
+
+def measure(img, mode="deskew"):
+    """{"skew": degrees, "quad": outline or None} for an upright page."""
+    small, _ = reduced(img)
+    gray = to_gray_array(small)
+    quad = find_page_quad(gray) if mode == "perspective" else None
+    if quad:
+        out_size = quad_size(quad, small.size)
+        gray = to_gray_array(warp(Image.fromarray(gray), homography(quad, small.size, out_size),
+                                  out_size, 255))
+    return {"skew": estimate_skew(gray < otsu_threshold(gray)), "quad": quad}
+
+
+def paper_color(img):
+    """Median colour of the paper, used to fill areas warped in from outside."""
+    small, _ = reduced(img)
+    gray = to_gray_array(small)
+    pixels = np.asarray(small)[gray >= otsu_threshold(gray)]
+    if not len(pixels):
+        return 255 if img.mode == 'L' else (255,) * len(img.getbands())
+    median = np.median(pixels, axis=0)
+    return int(median) if np.ndim(median) == 0 else tuple(int(v) for v in median)
+
+
+def flatten(img, mode="deskew"):
+    """(flattened page, geometry) for an upright PIL page.
+
+    The page comes back unchanged (same object) when it is already level to
+    within MIN_SKEW and no outline was found.
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown flatten mode: {mode}")
+    geometry = measure(img, mode)
+    skew, quad = geometry["skew"], geometry["quad"]
+    if abs(skew) < MIN_SKEW and not quad:
+        return img, geometry
+    size = quad_size(quad, img.size) if quad else img.size
+    matrix = homography(quad, img.size, size) if quad else np.eye(3)
+    if abs(skew) >= MIN_SKEW:
+        matrix = matrix @ rotation(skew, size)
+    return warp(img, matrix, size, paper_color(img)), geometry
+
+
+def params_digest():
+    """Short hash of GEOMETRY_PARAMS, for names and keys of flattened pages."""
+    params = json.dumps(GEOMETRY_PARAMS, sort_keys=True).encode()
+    return hashlib.sha256(params).hexdigest()[:8]
+
+
+def add_flatten_argument(parser):
+    """Add the shared --flatten switch to an ArgumentParser."""
+    parser.add_argument("--flatten", nargs="?", const="deskew", choices=MODES,
+                        help="level the staff lines before cropping/OCR; 'perspective' also "
+                             "straightens the outline of the paper (default mode: deskew)")
@@ -0,0 +1,142 @@
+"""
+Sheet Music Page Layout Analysis
+Finds staff systems on a rotated page from horizontal projection profiles
+and returns crop boxes, so new books don't need hand-tuned percentages.
+
+Staff lines are rows inked across most of the page width; lines are grouped
+into staves by their spacing, and the page is cut into exercises at the
+widest whitespace gaps between staves. Left/right edges are tightened to the
+ink inside each exercise.
+"""
+
+import numpy as np
+
+from sheet_music_image import otsu_threshold, to_gray_array
+
+# Pages are analysed at roughly this height (fractions are scale-invariant)
+ANALYSIS_HEIGHT = 1200
+
+# A row is a staff line candidate if this fraction of the staff width is inked
+STAFF_LINE_COVERAGE = 0.35
+# A row counts as blank if less than this fraction of the staff width is inked
+BLANK_ROW_INK = 0.01
+# Padding around detected ink, in staff-line spacings
+PADDING_SPACINGS = 1.5
+
+# Part of the layout cache key in crop_sheet_music.py
+LAYOUT_PARAMS = {
+    "height": ANALYSIS_HEIGHT,
+    "staff_coverage": STAFF_LINE_COVERAGE,
+    "blank_ink": BLANK_ROW_INK,
+    "padding": PADDING_SPACINGS,
+}
+
+
+def ink_mask(img):
+    """Boolean ink mask of a PIL page, reduced to about ANALYSIS_HEIGHT rows."""
+    factor = max(1, img.size[1] // ANALYSIS_HEIGHT)
+    gray = to_gray_array(img.convert('L').reduce(factor) if factor > 1 else img)
+    return gray < otsu_threshold(gray)
+
+
+def _runs(flags):
+    """(start, end) index pairs of consecutive True values."""
+    padded = np.concatenate(([False], flags, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def find_staves(mask):
+    """Detect staves. Returns (staves, spacing, (left, right)) in mask pixels.
+
+    Each staff is a (top, bottom) row pair spanning its lines.
+    """
+    coverage = mask.mean(axis=1)
+    lines = [(a + b - 1) / 2 for a, b in _runs(coverage > STAFF_LINE_COVERAGE)]
+    if len(lines) < 3:
+        return [], 0, (0, mask.shape[1])
+
+    gaps = np.diff(lines)
+    # Most gaps are between lines of the same staff (4 per staff)
+    spacing = float(np.median(gaps))
+    staves = []
+    group = [lines[0]]
+    for line, gap in zip(lines[1:], gaps):
+        if gap > 2.5 * spacing:
+            staves.append(group)
+            group = []
+        group.append(line)
+    staves.append(group)
+    staves = [(int(g[0]), int(g[-1]) + 1) for g in staves if len(g) >= 3]
+
+    # Horizontal extent of the staff lines
+    line_rows = np.flatnonzero(coverage > STAFF_LINE_COVERAGE)
+    columns = np.flatnonzero(mask[line_rows].mean(axis=0) > 0.5)
+    extent = (int(columns[0]), int(columns[-1]) + 1) if len(columns) else (0, mask.shape[1])
+    return staves, spacing, extent
+
+
+def detect_systems(img, count):
+    """Crop boxes for `count` exercises on a page, top to bottom.
+
+    Returns a list of (top, bottom, left, right) fractions of the page size,
+    or None when fewer than `count` staves are found.
+    """
+    mask = ink_mask(img)
+    height, width = mask.shape
+    staves, spacing, (staff_left, staff_right) = find_staves(mask)
+    if len(staves) < count or count < 1:
+        return None
+
+    # Only look at ink between the staff ends, ignoring shadows at the page edge
+    reach = int(4 * spacing)
+    band_left = max(0, staff_left - reach)
+    band_right = min(width, staff_right + reach)
+    blank = mask[:, band_left:band_right].mean(axis=1) < BLANK_ROW_INK
+
+    def widest_blank(start, end):
+        """(start, end) of the longest blank run in [start, end), or None."""
+        runs = _runs(blank[start:end])
+        if not runs:
+            return None
+        a, b = max(runs, key=lambda r: r[1] - r[0])
+        return start + int(a), start + int(b)
+
+    def cut_between(start, end):
+        """Centre of the widest whitespace, else the emptiest row."""
+        run = widest_blank(start, end)
+        if run:
+            return (run[0] + run[1]) // 2
+        ink = mask[start:end, band_left:band_right].sum(axis=1)
+        return start + int(np.argmin(ink)) if end > start else start
+
+    # Exercises are split at the count - 1 widest gaps between staves
+    gaps = [(staves[i + 1][0] - staves[i][1], i) for i in range(len(staves) - 1)]
+    splits = sorted(i for _, i in sorted(gaps, reverse=True)[:count - 1])
+    cuts = [int(cut_between(staves[i][1], staves[i + 1][0])) for i in splits]
+
+    # Outer edges: the inner end of the page margin's whitespace, so the label
+    # above the first staff stays in the crop
+    margin_top = widest_blank(0, staves[0][0])
+    margin_bottom = widest_blank(staves[-1][1], height)
+    pad = int(PADDING_SPACINGS * spacing)
+    top = max(0, margin_top[1] - pad) if margin_top else 0
+    bottom = min(height, margin_bottom[0] + pad) if margin_bottom else height
+    edges = [top] + cuts + [bottom]
+
+    boxes = []
+    for upper, lower in zip(edges[:-1], edges[1:]):
+        band = mask[upper:lower, band_left:band_right]
+        columns = np.flatnonzero(band.mean(axis=0) > BLANK_ROW_INK)
+        if len(columns):
+            left = band_left + int(columns[0]) - pad
+            right = band_left + int(columns[-1]) + 1 + pad
+        else:
+            left, right = staff_left, staff_right
+        boxes.append((
+            round(upper / height, 4),
+            round(lower / height, 4),
+            round(max(0, left) / width, 4),
+            round(min(width, right) / width, 4),
+        ))
+    return boxes
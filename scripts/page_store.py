@@ -0,0 +1,165 @@
+"""
+Memory-Mapped Page Store
+Decodes each source image once - EXIF-rotated upright, as RGB or grayscale -
+and keeps the pixels in .cache/pages as .npy files (a small header plus the
+raw array). Later runs and every worker process memory-map those files
+instead of decoding the JPEG again, so the pixels come straight from the OS
+page cache and are shared between processes.
+
+Pages can also be stored flattened (page_geometry.flatten), as separate
+entries named after the flatten mode and GEOMETRY_PARAMS.
+
+Entries are named by the source file's content hash, so an edited source gets
+a new entry and the old ones are removed. Hashes are remembered per path while
+size and mtime are unchanged. prune() also drops the entries of sources that
+were deleted, or edited without being read through the store again.
+"""
+
+from PIL import Image, ImageOps
+import numpy as np
+import functools
+import glob
+import json
+import os
+import threading
+
+from ocr_cache import source_hash
+import page_geometry
+import sheet_music_trace as tracing
+
+STORE_DIR = ".cache/pages"
+INDEX_NAME = "index.json"
+
+# Stored layouts. RGB pages are padded to RGBX (Pillow's own in-memory layout)
+# so Image.frombuffer() can wrap the mapped file without copying it.
+STORED_MODES = {"RGB": "RGBX", "L": "L"}
+
+
+class PageStore:
+    """Upright pages as memory-mapped arrays. Safe to share between threads;
+    several processes may use the same directory."""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(root, INDEX_NAME)
+        self._index = self._load_index()
+        self.hits = 0
+        self.writes = 0
+
+    def _source_hash(self, source_path):
+        """Content hash of a source, reusing the indexed one while size/mtime match."""
+        with self._lock:
+            old = self._index.get(source_path)
+        records = {source_path: old} if old else {}
+        sha = source_hash(source_path, records)
+        if records[source_path] is old:
+            return sha
+        with self._lock:
+            self._index[source_path] = records[source_path]
+            self._save_index()
+        if old and old["sha256"] != sha:
+            self._remove(old["sha256"])
+        return sha
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        tmp = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_path)
+
+    def _remove(self, sha):
+        """Delete the entries of a superseded source version."""
+        with self._lock:
+            if any(entry["sha256"] == sha for entry in self._index.values()):
+                return
+        for path in glob.glob(os.path.join(self.root, f"{sha[:32]}-*.npy")):
+            try:
+                os.remove(path)
+            except OSError:  # still mapped on Windows
+                pass
+
+    def prune(self):
+        """Forget sources that no longer exist, rehash those whose size or
+        mtime changed, and delete every entry no indexed source uses (like
+        sheet_music_atlas.prune). Returns the number of files removed."""
+        with self._lock:
+            # Other processes may have indexed sources since this one loaded
+            self._index = dict(self._load_index(), **self._index)
+            for path in list(self._index):
+                try:
+                    source_hash(path, self._index)
+                except OSError:
+                    del self._index[path]
+            self._save_index()
+            live = {entry["sha256"][:32] for entry in self._index.values()}
+        removed = 0
+        for path in glob.glob(os.path.join(self.root, "*.npy")):
+            if os.path.basename(path).split("-", 1)[0] not in live:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:  # still mapped on Windows
+                    pass
+        return removed
+
+    def entry_path(self, sha, mode, flatten=None):
+        name = f"{sha[:32]}-{mode}"
+        if flatten:
+            name += f"-{flatten}-{page_geometry.params_digest()}"
+        return os.path.join(self.root, f"{name}.npy")
+
+    def array(self, source_path, mode="RGB", flatten=None):
+        """Read-only memory-mapped pixels: (h, w) for L, (h, w, 4) RGBX for RGB.
+
+        `flatten` ("deskew" or "perspective") maps the flattened page instead.
+        """
+        path = self.entry_path(self._source_hash(source_path), mode, flatten)
+        if os.path.exists(path):
+            self.hits += 1
+            tracing.count("page_store_hits")
+        else:
+            with tracing.span("page_store_write", source=source_path, mode=mode, flatten=flatten):
+                img = ImageOps.exif_transpose(Image.open(source_path))
+                if flatten:
+                    img = page_geometry.flatten(img, flatten)[0]
+                pixels = np.asarray(img.convert(STORED_MODES[mode]))
+                # Unique temp name: other processes may be writing the same entry
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, 'wb') as f:
+                    np.save(f, pixels)
+                os.replace(tmp, path)
+            self.writes += 1
+            tracing.count("pixels_decoded", pixels.shape[0] * pixels.shape[1])
+        return np.load(path, mmap_mode='r')
+
+    def image(self, source_path, mode="RGB", flatten=None):
+        """A read-only PIL image over the mapped pixels (no decode, no copy)."""
+        pixels = self.array(source_path, mode, flatten)
+        stored = STORED_MODES[mode]
+        height, width = pixels.shape[:2]
+        return Image.frombuffer(stored, (width, height), pixels, 'raw', stored, 0, 1)
+
+    def summary(self):
+        return f"Page store: {self.hits} mapped, {self.writes} written ({self.root})"
+
+
+def add_store_argument(parser):
+    """Add the shared --page-store switch to an ArgumentParser."""
+    parser.add_argument("--page-store", action="store_true",
+                        help=f"memory-map upright pages from {STORE_DIR} instead of decoding "
+                             "the JPEGs (written on first use)")
+
+
+@functools.lru_cache(maxsize=1)
+def default_store():
+    """The store at STORE_DIR, opened once per process."""
+    return PageStore()
@@ -0,0 +1,240 @@
+"""
+Lossless PNG Optimization
+Re-encodes PNGs as small as this script can make them without changing a
+pixel, and writes the palette PNGs of crop_sheet_music.py --palette.
+
+    python scripts/png_optimize.py                  # public/sheet-music/*.png, in place
+    python scripts/png_optimize.py a.png b.png -n   # report only
+
+Each image is first reduced to the simplest equivalent form (no alpha
+channel when it is opaque, grayscale when R=G=B, an exact palette of the
+smallest bit depth when there are few colours). The scanlines are then
+filtered with each PNG filter type - and an adaptive choice per row - and
+deflated with several zlib strategies; the smallest stream wins. Ancillary
+chunks (text, timestamps, resolution) are dropped, transparency is kept.
+Files only get replaced when the result is smaller.
+"""
+
+from PIL import Image
+import numpy as np
+import argparse
+import glob
+import io
+import os
+import struct
+import sys
+import zlib
+
+DEFAULT_GLOB = "public/sheet-music/*.png"
+
+# PNG filter types: None, Sub, Up, Average, Paeth; "adaptive" picks per row
+FILTERS = (0, 1, 2, 3, 4, "adaptive")
+STRATEGIES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE)
+STRATEGY_NAMES = {zlib.Z_DEFAULT_STRATEGY: "default", zlib.Z_FILTERED: "filtered", zlib.Z_RLE: "rle"}
+
+# Part of the crop key for palette crops: changing the search changes bytes
+SEARCH = {"filters": [str(f) for f in FILTERS], "strategies": list(STRATEGY_NAMES.values()), "level": 9}
+
+# PNG colour types
+GRAY, RGB, PALETTE, GRAY_ALPHA, RGBA = 0, 2, 3, 4, 6
+COLOR_TYPES = {"1": GRAY, "L": GRAY, "RGB": RGB, "P": PALETTE, "LA": GRAY_ALPHA, "RGBA": RGBA}
+CHANNELS = {GRAY: 1, RGB: 3, PALETTE: 1, GRAY_ALPHA: 2, RGBA: 4}
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class Unsupported(ValueError):
+    """An image this optimizer can't write losslessly (16-bit, CMYK, ...)."""
+
+
+def _palette_image(indices, colors, mode):
+    """A P image from an index array and its (n, channels) colour table."""
+    img = Image.fromarray(indices.astype(np.uint8), "P")
+    table = colors if mode == "RGB" else np.repeat(colors, 3, axis=1)
+    img.putpalette(table.astype(np.uint8).ravel().tolist())
+    return img
+
+
+def reduce_image(img):
+    """The simplest mode that holds exactly the same pixels."""
+    if img.mode == "P" and "transparency" in img.info:
+        img = img.convert("RGBA")
+    elif img.mode == "P":
+        img = img.convert("RGB")
+    if img.mode not in COLOR_TYPES:
+        raise Unsupported(f"mode {img.mode}")
+    if img.mode == "1":
+        return img
+    if img.mode in ("LA", "RGBA") and img.getchannel("A").getextrema() == (255, 255):
+        img = img.convert(img.mode[:-1])
+    if img.mode == "RGB":
+        pixels = np.asarray(img)
+        if (pixels[..., 0] == pixels[..., 1]).all() and (pixels[..., 1] == pixels[..., 2]).all():
+            img = Image.fromarray(pixels[..., 0], "L")
+    if img.mode in ("L", "RGB"):
+        pixels = np.asarray(img).reshape(img.size[1], img.size[0], -1)
+        colors, indices = np.unique(pixels.reshape(-1, pixels.shape[2]), axis=0, return_inverse=True)
+        if len(colors) == 2 and img.mode == "L" and set(colors.ravel()) == {0, 255}:
+            return img.convert("1")
+        # Grayscale gains nothing from an 8-bit palette; colour does
+        if len(colors) <= (16 if img.mode == "L" else 256):
+            return _palette_image(indices.reshape(img.size[1], img.size[0]), colors, img.mode)
+    return img
+
+
+def bit_depth(img):
+    if img.mode == "1":
+        return 1
+    if img.mode == "P":
+        count = max(1, int(np.asarray(img).max()) + 1)
+        return next(bits for bits in (1, 2, 4, 8) if count <= 1 << bits)
+    return 8
+
+
+def scanlines(img, bits):
+    """(height, row bytes) uint8 array of packed scanlines."""
+    if img.mode == "1":
+        # Pillow's raw "1" layout is already packed MSB first with row padding
+        row = (img.size[0] + 7) // 8
+        return np.frombuffer(img.tobytes(), dtype=np.uint8).reshape(img.size[1], row)
+    pixels = np.asarray(img)
+    if bits == 8:
+        return pixels.reshape(img.size[1], -1)
+    per_byte = 8 // bits
+    width = pixels.shape[1]
+    padded = np.zeros((pixels.shape[0], -(-width // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :width] = pixels
+    groups = padded.reshape(pixels.shape[0], -1, per_byte)
+    shifts = (8 - bits) - bits * np.arange(per_byte)
+    return (groups << shifts).sum(axis=2).astype(np.uint8)
+
+
+def filtered(rows, bpp):
+    """{filter type: (height, 1 + row bytes) filtered scanlines}."""
+    x = rows.astype(np.int16)
+    left = np.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+    up = np.zeros_like(x)
+    up[1:] = x[:-1]
+    upleft = np.zeros_like(x)
+    upleft[1:, bpp:] = x[:-1, :-bpp]
+
+    p = left + up - upleft
+    pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - upleft)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+    residuals = {
+        0: x,
+        1: x - left,
+        2: x - up,
+        3: x - (left + up) // 2,
+        4: x - paeth,
+    }
+    out = {}
+    for kind, residual in residuals.items():
+        data = (residual & 0xFF).astype(np.uint8)
+        out[kind] = np.hstack([np.full((len(data), 1), kind, dtype=np.uint8), data])
+    # Adaptive: per row the filter with the smallest sum of signed residuals
+    cost = np.stack([np.abs(out[k][:, 1:].astype(np.int8).astype(np.int16)).sum(axis=1) for k in range(5)])
+    best = np.argmin(cost, axis=0)
+    out["adaptive"] = np.stack([out[k] for k in range(5)])[best, np.arange(len(best))]
+    return out
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode(img):
+    """Smallest PNG bytes for img (after reduce_image()). Returns (data, choice)."""
+    bits = bit_depth(img)
+    color_type = COLOR_TYPES[img.mode]
+    rows = scanlines(img, bits)
+    bpp = max(1, CHANNELS[color_type] * bits // 8)
+
+    best = None
+    for kind, lines in filtered(rows, bpp).items():
+        raw = lines.tobytes()
+        for strategy in STRATEGIES:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+            stream = compressor.compress(raw) + compressor.flush()
+            if best is None or len(stream) < len(best[0]):
+                best = (stream, kind, strategy)
+    stream, kind, strategy = best
+
+    width, height = img.size
+    chunks = [_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bits, color_type, 0, 0, 0))]
+    if img.mode == "P":
+        count = 1 << bits if bits < 8 else 256
+        palette = (img.getpalette() or [])[:3 * count]
+        used = max(1, int(np.asarray(img).max()) + 1)
+        chunks.append(_chunk(b"PLTE", bytes(palette[:3 * used])))
+    chunks.append(_chunk(b"IDAT", stream))
+    chunks.append(_chunk(b"IEND", b""))
+    return SIGNATURE + b"".join(chunks), {"filter": kind, "strategy": STRATEGY_NAMES[strategy], "bits": bits}
+
+
+def optimize_image(img):
+    """Smallest lossless PNG bytes for a PIL image."""
+    return encode(reduce_image(img))[0]
+
+
+def same_pixels(a, b):
+    """True if two images hold identical RGBA pixels."""
+    return a.size == b.size and np.array_equal(np.asarray(a.convert("RGBA")), np.asarray(b.convert("RGBA")))
+
+
+def optimize_file(path, write=True):
+    """Re-optimize one PNG. Returns (old bytes, new bytes, choice); new is
+    the old size when nothing smaller was found."""
+    with open(path, "rb") as f:
+        original = f.read()
+    with Image.open(path) as img:
+        img.load()
+        if img.format != "PNG":
+            raise Unsupported(f"not a PNG ({img.format})")
+        data, choice = encode(reduce_image(img))
+        with Image.open(io.BytesIO(data)) as check:
+            if not same_pixels(img, check):
+                raise Unsupported("re-encoded pixels differ")
+    if len(data) >= len(original):
+        return len(original), len(original), None
+    if write:
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return len(original), len(data), choice
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Losslessly re-optimize PNG files in place.")
+    parser.add_argument("paths", nargs="*", help=f"PNG files (default: {DEFAULT_GLOB})")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="report savings without writing")
+    args = parser.parse_args(argv)
+    paths = args.paths or sorted(glob.glob(DEFAULT_GLOB))
+
+    print("PNG Optimization" + (" (dry run)" if args.dry_run else ""))
+    print("=" * 60)
+    total_before = total_after = 0
+    for path in paths:
+        name = os.path.basename(path)
+        try:
+            before, after, choice = optimize_file(path, write=not args.dry_run)
+        except (OSError, Unsupported) as e:
+            print(f"  {name}: skipped ({e})")
+            continue
+        total_before += before
+        total_after += after
+        if choice is None:
+            print(f"  {name}: {before / 1024:.1f}KB, already optimal")
+        else:
+            print(f"  {name}: {before / 1024:.1f}KB -> {after / 1024:.1f}KB "
+                  f"(-{1 - after / before:.0%}, {choice['bits']}-bit, filter {choice['filter']}, "
+                  f"{choice['strategy']})")
+    saved = total_before - total_after
+    print(f"\nTotal: {total_before / 1024:.1f}KB -> {total_after / 1024:.1f}KB "
+          f"(saved {saved / 1024:.1f}KB, {saved / max(total_before, 1):.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
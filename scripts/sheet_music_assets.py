@@ -0,0 +1,265 @@
+"""
+Sheet Music Asset Map Generator
+Writes src/data/sheetMusicMap.js from the crop manifest, so the app gets a
+path per question plus srcset-ready entries (format, width, bytes) for every
+responsive variant the crop pipeline produced, and a tiny inline placeholder
+per question to show while the crop loads.
+
+Crop files carry a content hash in their names (i_1.3f9a0c2b1d.jpg), so they
+can be cached as immutable: a changed crop gets a new URL. The helpers here
+map between those names and the conventional ones (i_1.jpg) that the
+verification scripts ask for, and write public/_headers, which marks exactly
+the hashed files immutable on Netlify (plain names such as the legacy i_1.png
+renderings keep the default caching).
+"""
+
+import hashlib
+import os
+import re
+
+MAP_MODULE = "src/data/sheetMusicMap.js"
+PUBLIC_DIR = "public"
+# Netlify headers file, copied to the site root with the rest of public/
+HEADERS_FILE = "public/_headers"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+ROMAN = ["I", "II", "III", "IV", "V", "VI"]
+CATEGORIES = {
+    "I": "Scales",
+    "II": "Arpeggios",
+    "III": "Dominant 7ths",
+    "IV": "Diminished 7ths",
+    "V": "Chromatic Scales",
+    "VI": "Double Stops",
+}
+
+# <picture> sources are listed best-compressed first
+FORMAT_ORDER = ["avif", "webp", "jpeg"]
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+# Hex digits of the SHA-256 in content-hashed file names
+HASH_LENGTH = 10
+HASHED_NAME = re.compile(r"^(?P<stem>.+)\.[0-9a-f]{%d}(?P<ext>\.[a-z0-9]+)$" % HASH_LENGTH)
+
+
+def public_url(path):
+    """URL of a file under public/, e.g. /sheet-music/cropped/i_1.jpg."""
+    return "/" + os.path.relpath(path, PUBLIC_DIR).replace(os.sep, "/")
+
+
+def hashed_filename(filename, data):
+    """e.g. i_1.jpg and its bytes -> i_1.3f9a0c2b1d.jpg"""
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def unhashed_filename(filename):
+    """The conventional name of a content-hashed file (other names unchanged)."""
+    match = HASHED_NAME.match(filename)
+    return match.group("stem") + match.group("ext") if match else filename
+
+
+def find_file(directory, filename):
+    """Path of `filename` (e.g. i_1.jpg) in directory: its content-hashed copy
+    (the newest if there are several), else the plain name."""
+    try:
+        names = [name for name in os.listdir(directory)
+                 if name != filename and unhashed_filename(name) == filename]
+    except OSError:
+        names = []
+    if not names:
+        return os.path.join(directory, filename)
+    paths = [os.path.join(directory, name) for name in names]
+    return max(paths, key=os.path.getmtime)
+
+
+def find_crop(directory, qid):
+    """Path of a question's crop: the newest content-hashed <id>.jpg or
+    <id>.png (palette crops), else the plain <id>.jpg."""
+    stem = qid.lower().replace('-', '_')
+    paths = [find_file(directory, f"{stem}{ext}") for ext in (".jpg", ".png")]
+    hashed = [path for path in paths if HASHED_NAME.match(os.path.basename(path))]
+    return max(hashed, key=os.path.getmtime) if hashed else paths[0]
+
+
+def question_sort_key(qid):
+    category, number = qid.split("-")
+    return ROMAN.index(category), int(number)
+
+
+def image_entry(output_dir, crop):
+    """srcset-ready description of one crop's variants."""
+    sources = []
+    for fmt in FORMAT_ORDER:
+        variants = sorted(
+            (v for v in crop.get("variants", []) if v["format"] == fmt),
+            key=lambda v: v["width"],
+        )
+        if not variants:
+            continue
+        sources.append({
+            "type": MIME_TYPES[fmt],
+            "srcset": ", ".join(
+                f"{public_url(os.path.join(output_dir, v['file']))} {v['width']}w" for v in variants
+            ),
+            "bytes": [v["bytes"] for v in variants],
+        })
+    return {
+        "src": public_url(os.path.join(output_dir, crop["file"])),
+        "width": crop["width"],
+        "height": crop["height"],
+        "sources": sources,
+    }
+
+
+def asset_entries(output_dir, crops, scale_ids):
+    """Manifest "assets" entries (one per crop file) for the given questions."""
+    entries = []
+    for qid in scale_ids:
+        for output in crops.get(qid, {}).get("variants", []):
+            entries.append({
+                "path": public_url(os.path.join(output_dir, output["file"])),
+                "question": qid,
+                "sha256": output["sha256"],
+                "bytes": output["bytes"],
+                "width": output["width"],
+                "height": output["height"],
+                "format": output["format"],
+            })
+    return entries
+
+
+def write_headers(entries, path=HEADERS_FILE):
+    """Write the headers file marking the content-hashed asset paths of
+    manifest entries immutable, one rule per file."""
+    urls = sorted({entry["path"] for entry in entries if HASHED_NAME.match(entry["path"].rsplit("/", 1)[-1])})
+    lines = [
+        "# Generated by scripts/crop_sheet_music.py from assets/asset-manifest.json - do not edit.",
+        "# Only content-hashed sheet music files are immutable; a rebuild gives them new URLs.",
+    ]
+    for url in urls:
+        lines += ["", url, f"  Cache-Control: {IMMUTABLE}"]
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def _js(value, indent):
+    """Format a Python value as a JS literal in the repo's style."""
+    pad = " " * indent
+    if isinstance(value, str):
+        return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, list):
+        if all(isinstance(v, (int, float)) for v in value):
+            return "[" + ", ".join(_js(v, 0) for v in value) + "]"
+        items = "".join(f"{pad}    {_js(v, indent + 4)},\n" for v in value)
+        return "[\n" + items + pad + "]"
+    if isinstance(value, dict):
+        items = "".join(f"{pad}    {k}: {_js(v, indent + 4)},\n" for k, v in value.items())
+        return "{\n" + items + pad + "}"
+    raise TypeError(f"Cannot format {type(value).__name__} as JS")
+
+
+def _grouped(entries, format_value):
+    """Object body lines grouped by category with the usual section comments."""
+    lines = []
+    ids = sorted(entries, key=question_sort_key)
+    for category in ROMAN:
+        group = [qid for qid in ids if qid.split("-")[0] == category]
+        if not group:
+            continue
+        if lines:
+            lines.append("")
+        lines.append(f"    // {CATEGORIES[category]} {group[0]} to {group[-1]}")
+        for qid in group:
+            lines.append(f"    '{qid}': {format_value(entries[qid])},")
+    return lines
+
+
+def _export_object(name, entries):
+    """`export const NAME = {...};` lines, grouped by category."""
+    body = _grouped(entries, lambda value: _js(value, 4))
+    if not body:
+        return [f"export const {name} = {{}};"]
+    return [f"export const {name} = {{"] + body + ["};"]
+
+
+def render_map_module(paths, images, sprites=None, placeholders=None):
+    """Source of sheetMusicMap.js.
+
+    `paths` maps question ID to image path; `images` maps question ID to an
+    image_entry() for questions whose variants are known; `sprites` maps
+    question ID to its region of a sprite atlas (sheet_music_atlas.py);
+    `placeholders` maps question ID to a data: URL preview of its crop.
+    """
+    lines = [
+        "// Sheet music mapping - uses compressed images from cropped photos",
+        "// Generated by scripts/crop_sheet_music.py - do not edit by hand.",
+        "",
+    ]
+    lines += _export_object("SHEET_MUSIC_MAP", paths)
+    lines += [
+        "",
+        "// Responsive variants: <picture> sources (best format first) with",
+        "// srcset strings and per-file byte sizes in the same order as srcset.",
+    ]
+    lines += _export_object("SHEET_MUSIC_IMAGES", images)
+    lines += [
+        "",
+        "// Sprite atlases: the question's region (x, y, width, height) of a",
+        "// shared atlas image of atlasWidth x atlasHeight pixels.",
+    ]
+    lines += _export_object("SHEET_MUSIC_SPRITES", sprites or {})
+    lines += [
+        "",
+        "// Placeholders: tiny blurred grayscale previews as data: URLs, shown",
+        "// (stretched to the image size) until the full crop has loaded.",
+    ]
+    lines += _export_object("SHEET_MUSIC_PLACEHOLDERS", placeholders or {})
+    lines += [
+        "",
+        "// Get the sheet music image path for a question",
+        "export function getSheetMusicPath(questionId) {",
+        "    return SHEET_MUSIC_MAP[questionId] || null;",
+        "}",
+        "",
+        "// Get the responsive image entry (src, size, sources) for a question",
+        "export function getSheetMusicImage(questionId) {",
+        "    return SHEET_MUSIC_IMAGES[questionId] || null;",
+        "}",
+        "",
+        "// Get the atlas region (src, x, y, width, height) for a question",
+        "export function getSheetMusicSprite(questionId) {",
+        "    return SHEET_MUSIC_SPRITES[questionId] || null;",
+        "}",
+        "",
+        "// Get the inline placeholder (data: URL) for a question",
+        "export function getSheetMusicPlaceholder(questionId) {",
+        "    return SHEET_MUSIC_PLACEHOLDERS[questionId] || null;",
+        "}",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def write_map_module(output_dir, crops, scale_ids, path=MAP_MODULE, sprites=None):
+    """Regenerate the map module from manifest crop entries (and atlas sprites)."""
+    paths = {}
+    images = {}
+    placeholders = {}
+    for qid in scale_ids:
+        # Crops that failed to build keep their conventional path
+        crop = crops.get(qid) or {"file": f"{qid.lower().replace('-', '_')}.jpg"}
+        paths[qid] = public_url(os.path.join(output_dir, crop["file"]))
+        if "width" in crop:
+            images[qid] = image_entry(output_dir, crop)
+        if "placeholder" in crop:
+            placeholders[qid] = crop["placeholder"]
+    source = render_map_module(paths, images, sprites, placeholders)
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(source)
+    return path
@@ -0,0 +1,292 @@
+"""
+Sheet Music Sprite Atlases
+Packs the crops of a group of questions into a few atlas images, so a client
+fetches (and caches) one file per group instead of one per question and
+draws each question's region from it.
+
+Groups are a category (I-VI, "category" mode) or every question a practice
+session can draw ("session" mode: one pool, split only by the limits). Crops
+are placed on shelves, tallest first, at multiples of ALIGN pixels: the
+published crops are decoded and re-encoded at the crop quality, and keeping
+their 16x16 JPEG blocks aligned makes that re-encode nearly lossless. A group
+is split into more atlases when its crops don't fit max_dim x max_dim or
+would exceed the byte budget. Atlases are always JPEGs, so the budget is
+planned with each crop's size as a JPEG at the atlas quality (for --palette
+crops, a trial encode of the PNG).
+
+Atlases are written content-hashed to ATLAS_DIR, described in the manifest
+(sheet_music.atlas) and in the coordinates file COORDINATES_PATH, and are
+only rebuilt when one of their crops changed.
+"""
+
+from PIL import Image
+import hashlib
+import io
+import json
+import os
+
+from sheet_music_assets import hashed_filename, public_url, question_sort_key
+
+ATLAS_DIR = "public/sheet-music/atlas"
+COORDINATES_PATH = "public/sheet-music/atlas.json"
+
+MODES = ("category", "session")
+DEFAULT_MAX_DIM = 4096
+DEFAULT_MAX_KB = 512
+# Placement grid: one 4:2:0 JPEG MCU
+ALIGN = 16
+# Written progressive, like the crops
+PROGRESSIVE = True
+BACKGROUND = (255, 255, 255)
+
+
+def _aligned(value):
+    return -(-value // ALIGN) * ALIGN
+
+
+def group_questions(scale_ids, mode):
+    """{group name: [question IDs]} in question order."""
+    if mode not in MODES:
+        raise ValueError(f"unknown atlas mode: {mode}")
+    groups = {}
+    for qid in sorted(scale_ids, key=question_sort_key):
+        name = qid.split("-")[0].lower() if mode == "category" else "session"
+        groups.setdefault(name, []).append(qid)
+    return groups
+
+
+def pack(sizes, max_dim):
+    """Shelf-pack (width, height) boxes, tallest first.
+
+    Returns ([(x, y)] in input order, (atlas width, atlas height)), or None
+    if they don't fit in max_dim x max_dim.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], i))
+    placements = [None] * len(sizes)
+    shelves = []  # [y, height, used width]
+    bottom = 0
+    for i in order:
+        width, height = sizes[i]
+        if width > max_dim or height > max_dim:
+            return None
+        for shelf in shelves:
+            if height <= shelf[1] and shelf[2] + width <= max_dim:
+                break
+        else:
+            if bottom + height > max_dim:
+                return None
+            shelf = [bottom, _aligned(height), 0]
+            shelves.append(shelf)
+            bottom += shelf[1]
+        placements[i] = (shelf[2], shelf[0])
+        shelf[2] += _aligned(width)
+    used_width = max(min(shelf[2], max_dim) for shelf in shelves) if shelves else 0
+    return placements, (used_width, min(bottom, max_dim))
+
+
+def encode(img, quality):
+    """Atlas JPEG bytes for a PIL image."""
+    buffer = io.BytesIO()
+    img.convert("RGB").save(buffer, "JPEG", quality=quality, optimize=True, progressive=PROGRESSIVE)
+    return buffer.getvalue()
+
+
+def jpeg_bytes(crop, crop_dir, quality):
+    """Bytes a crop adds to an atlas: the JPEG crop's own size, or the size
+    of other formats (palette PNGs) re-encoded as the atlas encodes them."""
+    if crop["file"].lower().endswith(".jpg"):
+        return crop["bytes"]
+    with Image.open(os.path.join(crop_dir, crop["file"])) as img:
+        return len(encode(img, quality))
+
+
+def plan_atlases(members, crops, max_dim, max_bytes, estimates=None):
+    """Split a group's question IDs into atlases that fit the limits.
+
+    The budget is checked against the summed `estimates` ({qid: bytes},
+    default the crops' own bytes) - a close estimate of the atlas size;
+    build_atlas() splits further if the encoded atlas still exceeds it.
+    """
+    estimates = estimates or {qid: crops[qid]["bytes"] for qid in members}
+    atlases, current, estimate = [], [], 0
+    for qid in members:
+        trial = current + [qid]
+        fits = pack([(crops[q]["width"], crops[q]["height"]) for q in trial], max_dim)
+        if current and (fits is None or estimate + estimates[qid] > max_bytes):
+            atlases.append(current)
+            trial, estimate = [qid], 0
+        current = trial
+        estimate += estimates[qid]
+    if current:
+        atlases.append(current)
+    return atlases
+
+
+def atlas_key(members, crops, max_dim, quality):
+    """Cache key of an atlas: its crops' build keys plus the packing inputs."""
+    inputs = {
+        "crops": [[qid, crops[qid]["key"]] for qid in members],
+        "max_dim": max_dim,
+        "quality": quality,
+        "align": ALIGN,
+        "progressive": PROGRESSIVE,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def render_atlas(members, crops, crop_dir, max_dim, quality):
+    """(JPEG bytes, size, {qid: [x, y, width, height]}) for one atlas."""
+    sizes = [(crops[qid]["width"], crops[qid]["height"]) for qid in members]
+    placements, size = pack(sizes, max_dim)
+    atlas = Image.new("RGB", size, BACKGROUND)
+    regions = {}
+    for qid, (x, y), (width, height) in zip(members, placements, sizes):
+        with Image.open(os.path.join(crop_dir, crops[qid]["file"])) as img:
+            atlas.paste(img.convert("RGB"), (x, y))
+        regions[qid] = [x, y, width, height]
+    return encode(atlas, quality), size, regions
+
+
+def build_atlas(name, members, crops, crop_dir, max_dim, max_bytes, quality, previous):
+    """{atlas name: entry} for members, reusing `previous` entries whose key
+    and file are unchanged; halves the members while an atlas is over budget."""
+    key = atlas_key(members, crops, max_dim, quality)
+    old = previous.get(name)
+    if old and old["key"] == key and os.path.exists(os.path.join(ATLAS_DIR, old["file"])):
+        return {name: old}
+    data, size, regions = render_atlas(members, crops, crop_dir, max_dim, quality)
+    if len(data) > max_bytes and len(members) > 1:
+        half = len(members) // 2
+        entries = build_atlas(f"{name}a", members[:half], crops, crop_dir, max_dim, max_bytes, quality,
+                              previous)
+        entries.update(build_atlas(f"{name}b", members[half:], crops, crop_dir, max_dim, max_bytes,
+                                   quality, previous))
+        return entries
+    filename = hashed_filename(f"{name}.jpg", data)
+    with open(os.path.join(ATLAS_DIR, filename), "wb") as f:
+        f.write(data)
+    print(f"  Atlas {filename}: {size[0]}x{size[1]}, {len(members)} crops ({len(data) / 1024:.1f}KB)")
+    return {name: {
+        "file": filename,
+        "key": key,
+        "width": size[0],
+        "height": size[1],
+        "bytes": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "regions": regions,
+    }}
+
+
+def build_atlases(crops, scale_ids, crop_dir, mode, quality, previous=None,
+                  max_dim=DEFAULT_MAX_DIM, max_bytes=DEFAULT_MAX_KB * 1024):
+    """Build (or reuse) the atlases for the given questions.
+
+    Returns the manifest section: {"mode", "max_dim", "max_bytes", "quality",
+    "atlases"}. Questions without a built crop, or whose crop is larger than
+    max_dim, are left out (clients fall back to the single image).
+    """
+    previous = previous or {}
+    settings = {"mode": mode, "max_dim": max_dim, "max_bytes": max_bytes, "quality": quality}
+    same_settings = all(previous.get(name) == value for name, value in settings.items())
+    previous_atlases = previous.get("atlases", {}) if same_settings else {}
+    os.makedirs(ATLAS_DIR, exist_ok=True)
+    atlases = {}
+    for group, members in group_questions(scale_ids, mode).items():
+        members = [qid for qid in members if qid in crops and "width" in crops[qid]]
+        fitting = [qid for qid in members if pack([(crops[qid]["width"], crops[qid]["height"])], max_dim)]
+        for qid in sorted(set(members) - set(fitting), key=question_sort_key):
+            print(f"  WARNING: {qid} is larger than {max_dim}px, left out of the atlas")
+        estimates = {qid: jpeg_bytes(crops[qid], crop_dir, quality) for qid in fitting}
+        for i, atlas_members in enumerate(plan_atlases(fitting, crops, max_dim, max_bytes, estimates), 1):
+            atlases.update(build_atlas(f"{group}-{i}", atlas_members, crops, crop_dir, max_dim,
+                                       max_bytes, quality, previous_atlases))
+    reused = sum(1 for name, entry in atlases.items() if previous_atlases.get(name) is entry)
+    if reused:
+        print(f"  Up to date: {reused} atlases")
+    prune(atlases)
+    return dict(settings, atlases=atlases)
+
+
+def drop_stale(section, crops):
+    """Remove atlases whose crops were rebuilt since (runs without --atlas)."""
+    if not section:
+        return section
+    atlases = {}
+    for name, entry in section["atlases"].items():
+        members = list(entry["regions"])
+        if all(qid in crops for qid in members) and entry["key"] == atlas_key(
+                members, crops, section["max_dim"], section["quality"]):
+            atlases[name] = entry
+    if len(atlases) != len(section["atlases"]):
+        print(f"Dropped {len(section['atlases']) - len(atlases)} outdated atlases (rebuild with --atlas)")
+    prune(atlases)
+    return dict(section, atlases=atlases) if atlases else None
+
+
+def prune(atlases):
+    """Delete atlas files that no current atlas uses."""
+    if not os.path.isdir(ATLAS_DIR):
+        return
+    current = {entry["file"] for entry in atlases.values()}
+    for name in os.listdir(ATLAS_DIR):
+        if name.endswith(".jpg") and name not in current:
+            os.remove(os.path.join(ATLAS_DIR, name))
+
+
+def sprite_entries(section):
+    """{qid: sprite} for the map module and the coordinates file."""
+    sprites = {}
+    for entry in (section or {}).get("atlases", {}).values():
+        src = public_url(os.path.join(ATLAS_DIR, entry["file"]))
+        for qid, (x, y, width, height) in entry["regions"].items():
+            sprites[qid] = {
+                "src": src,
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "atlasWidth": entry["width"],
+                "atlasHeight": entry["height"],
+            }
+    return {qid: sprites[qid] for qid in sorted(sprites, key=question_sort_key)}
+
+
+def asset_entries(section):
+    """Manifest "assets" entries for the atlas files."""
+    return [{
+        "path": public_url(os.path.join(ATLAS_DIR, entry["file"])),
+        "questions": sorted(entry["regions"], key=question_sort_key),
+        "sha256": entry["sha256"],
+        "bytes": entry["bytes"],
+        "width": entry["width"],
+        "height": entry["height"],
+        "format": "jpeg",
+    } for entry in (section or {}).get("atlases", {}).values()]
+
+
+def write_coordinates(section, path=COORDINATES_PATH):
+    """Write the coordinates file (or remove it when there are no atlases)."""
+    if not section:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    atlases = {name: {key: entry[key] for key in ("width", "height", "bytes")}
+               for name, entry in section["atlases"].items()}
+    for name, entry in section["atlases"].items():
+        atlases[name]["src"] = public_url(os.path.join(ATLAS_DIR, entry["file"]))
+    data = {"mode": section["mode"], "atlases": atlases, "sprites": sprite_entries(section)}
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    return path
+
+
+def add_atlas_arguments(parser):
+    """Add the --atlas switches to an ArgumentParser."""
+    parser.add_argument("--atlas", choices=MODES,
+                        help="also pack crops into sprite atlases per category, or one pool for "
+                             "a practice session")
+    parser.add_argument("--atlas-max-dim", type=int, default=DEFAULT_MAX_DIM, metavar="PX",
+                        help="maximum atlas width/height (default: %(default)s)")
+    parser.add_argument("--atlas-max-kb", type=float, default=DEFAULT_MAX_KB, metavar="KB",
+                        help="byte budget per atlas (default: %(default)s)")
@@ -0,0 +1,187 @@
+"""
+Perceptual-Hash Crop Verification
+Checks cropped sheet music against the clean per-question reference
+renderings in public/sheet-music (e.g. i_1_ab_major_scale_*.png) instead of
+OCRing its label.
+
+Every image is trimmed to its ink and shrunk to a FEATURES-sized thumbnail
+whose rows are centred and scaled to unit length (the feature vector), plus a
+64-bit DCT perceptual hash. Reference features are computed once and stored in
+INDEX_PATH keyed by file content hash, so only new or changed references are
+re-read. A crop is scored against every reference by correlation; verdicts
+are only trusted when the best question is clearly ahead, anything else is
+"ambiguous" and left to OCR.
+"""
+
+from PIL import Image, ImageOps
+import numpy as np
+import json
+import os
+import re
+
+from ocr_cache import file_hash
+
+REFERENCE_DIR = "public/sheet-music"
+INDEX_PATH = ".cache/reference-hashes.json"
+
+# Reference renderings are named <roman>_<number>_<description>_<timestamp>.png
+REFERENCE_NAME = re.compile(r"^(i|ii|iii|iv|v|vi)_(\d+)_.+\.png$")
+
+# Feature parameters; stored with the index, so changing them rebuilds it.
+# "ink": gray level below which a pixel counts as notation when trimming.
+# "decode_width": JPEG crops are draft-decoded at about this width.
+FEATURES = {"width": 64, "height": 16, "ink": 128, "decode_width": 512, "version": 2}
+
+# A verdict is confident when the best reference correlates at least
+# MIN_SIMILARITY, leads the best other question by MIN_MARGIN and its pHash is
+# within PHASH_MAX_DISTANCE bits of the crop's
+MIN_SIMILARITY = 0.6
+MIN_MARGIN = 0.1
+PHASH_MAX_DISTANCE = 22
+
+HASH_SIZE = 32
+_n = np.arange(HASH_SIZE)
+DCT = np.cos(np.pi * (2 * _n[None, :] + 1) * _n[:, None] / (2 * HASH_SIZE))
+
+
+def reference_qid(filename):
+    """Question ID of a reference rendering (e.g. "IV-3"), or None."""
+    match = REFERENCE_NAME.match(filename)
+    if not match:
+        return None
+    return f"{match.group(1).upper()}-{int(match.group(2))}"
+
+
+def open_gray(path, width=FEATURES["decode_width"]):
+    """Open an image as grayscale; JPEGs are draft-decoded near `width`."""
+    img = Image.open(path)
+    if img.format == 'JPEG' and img.size[0] > width:
+        img.draft('L', (width, max(1, img.size[1] * width // img.size[0])))
+    return img.convert('L')
+
+
+def ink_box(gray, ink=FEATURES["ink"]):
+    """(top, bottom, left, right) of the rows/columns holding notation.
+
+    A row or column needs ink in 0.5% of its pixels, so JPEG specks and
+    scanner dust at the margins don't widen the box.
+    """
+    mask = gray < ink
+    rows = np.flatnonzero(mask.sum(axis=1) > mask.shape[1] * 0.005)
+    cols = np.flatnonzero(mask.sum(axis=0) > mask.shape[0] * 0.005)
+    if len(rows) < 2 or len(cols) < 2:
+        return 0, gray.shape[0], 0, gray.shape[1]
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+def phash(img):
+    """64-bit DCT perceptual hash of a grayscale image, as an int."""
+    pixels = np.asarray(img.resize((HASH_SIZE, HASH_SIZE), Image.BOX), dtype=np.float64)
+    low = (DCT @ pixels @ DCT.T)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def features(img):
+    """(vector, phash) for a PIL image."""
+    gray = np.asarray(ImageOps.autocontrast(img.convert('L'), cutoff=1))
+    top, bottom, left, right = ink_box(gray)
+    trimmed = Image.fromarray(gray[top:bottom, left:right])
+    thumb = np.asarray(trimmed.resize((FEATURES["width"], FEATURES["height"]), Image.BOX),
+                       dtype=np.float32)
+    # Centring each row removes the staff lines every question shares, so
+    # similarity comes from the notes and labels
+    vector = (thumb - thumb.mean(axis=1, keepdims=True)).ravel()
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector), phash(trimmed)
+
+
+class ReferenceIndex:
+    """Reference feature vectors by question ID.
+
+    rank() scores a crop against every reference; verify() turns that into a
+    "pass", "fail" or "ambiguous" verdict for an expected question.
+    """
+
+    def __init__(self, entries):
+        # entries: {filename: {"qid", "sha256", "phash", "vector"}}
+        self.entries = entries
+        names = sorted(entries)
+        self.qids = [entries[name]["qid"] for name in names]
+        self.hashes = [int(entries[name]["phash"], 16) for name in names]
+        self.vectors = np.array([entries[name]["vector"] for name in names], dtype=np.float32)
+
+    @classmethod
+    def load(cls, reference_dir=REFERENCE_DIR, path=INDEX_PATH):
+        """Index of the references in reference_dir, reusing stored features."""
+        stored = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("features") == FEATURES:
+                stored = data["references"]
+
+        entries = {}
+        changed = False
+        for filename in sorted(os.listdir(reference_dir)):
+            qid = reference_qid(filename)
+            if qid is None:
+                continue
+            filepath = os.path.join(reference_dir, filename)
+            digest = file_hash(filepath)
+            entry = stored.get(filename)
+            if entry is None or entry["sha256"] != digest:
+                try:
+                    vector, hash_value = features(Image.open(filepath))
+                except OSError as e:
+                    print(f"  Skipping reference {filename}: {e}")
+                    continue
+                entry = {
+                    "qid": qid,
+                    "sha256": digest,
+                    "phash": f"{hash_value:016x}",
+                    "vector": [round(float(v), 5) for v in vector],
+                }
+                changed = True
+            entries[filename] = entry
+
+        if changed or set(entries) != set(stored):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({"features": FEATURES, "references": entries}, f)
+        return cls(entries)
+
+    def __len__(self):
+        return len(self.qids)
+
+    def rank(self, img):
+        """[(question_id, similarity)] best first (one per question), plus the
+        pHash distance of the best reference."""
+        vector, hash_value = features(img)
+        similarities = self.vectors @ vector if len(self) else []
+        best = {}
+        for i, similarity in enumerate(similarities):
+            qid = self.qids[i]
+            if qid not in best or similarity > best[qid][0]:
+                best[qid] = (float(similarity), hamming(self.hashes[i], hash_value))
+        ranked = sorted(best.items(), key=lambda item: -item[1][0])
+        distance = ranked[0][1][1] if ranked else None
+        return [(qid, round(similarity, 3)) for qid, (similarity, _) in ranked], distance
+
+    def verify(self, qid, image_path):
+        """("pass" | "fail" | "ambiguous", ranked) for a crop expected to show qid.
+
+        Questions without a reference rendering are always ambiguous.
+        """
+        ranked, distance = self.rank(open_gray(image_path))
+        if qid not in self.qids or not ranked:
+            return "ambiguous", ranked
+        top = ranked[0][1]
+        runner_up = ranked[1][1] if len(ranked) > 1 else -1.0
+        if top < MIN_SIMILARITY or top - runner_up < MIN_MARGIN or distance > PHASH_MAX_DISTANCE:
+            return "ambiguous", ranked
+        return ("pass" if ranked[0][0] == qid else "fail"), ranked
@@ -0,0 +1,146 @@
+"""
+Shared Page Buffers for the Sheet Music Scripts
+Decodes and converts a page once into a NumPy array; OCR regions are
+zero-copy slices of that array instead of separate crops and conversions.
+"""
+
+import numpy as np
+
+
+def to_gray_array(img):
+    """Convert a PIL image to a 2-D uint8 grayscale array (one conversion)."""
+    if img.mode != 'L':
+        img = img.convert('L')
+    return np.asarray(img)
+
+
+class PageBuffer:
+    """A page held once in memory. region() returns views, never copies.
+
+    `scale` is the buffer's size relative to the source image, so boxes are
+    always given in source-image pixels (e.g. a 2x upscaled OCR buffer).
+    """
+
+    def __init__(self, array, scale=1):
+        self.array = array
+        self.scale = scale
+
+    @classmethod
+    def from_image(cls, img):
+        return cls(to_gray_array(img))
+
+    @property
+    def size(self):
+        """(width, height) in source-image pixels."""
+        h, w = self.array.shape[:2]
+        return w // self.scale, h // self.scale
+
+    def region(self, box):
+        """View of box (left, top, right, bottom) in source-image pixels."""
+        left, top, right, bottom = (int(v * self.scale) for v in box)
+        return self.array[top:bottom, left:right]
+
+
+# Vectorized preprocessing. These mirror the PIL enhancers (same blend
+# formulas) but run on uint8 arrays so the whole chain is a few NumPy ops.
+
+THRESHOLD_MODES = ("fixed", "otsu", "sauvola")
+
+
+def enhance_contrast(gray, factor):
+    """Same as ImageEnhance.Contrast: blend against the mean gray level."""
+    mean = int(gray.mean() + 0.5)
+    out = mean + factor * (gray.astype(np.float32) - mean)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def enhance_sharpness(gray, factor):
+    """Same as ImageEnhance.Sharpness: blend against PIL's SMOOTH 3x3 filter."""
+    padded = np.pad(gray.astype(np.float32), 1, mode='edge')
+    h, w = gray.shape
+    smooth = 4 * padded[1:h + 1, 1:w + 1]
+    for dy in range(3):
+        for dx in range(3):
+            smooth += padded[dy:dy + h, dx:dx + w]
+    smooth /= 13
+    out = smooth + factor * (gray - smooth)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def otsu_threshold(gray):
+    """Global threshold maximising between-class variance."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(hist * levels)
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+    variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(variance)) + 1
+
+
+def sauvola_threshold(gray, window=25, k=0.2, r=128.0):
+    """Per-pixel Sauvola threshold from integral images (handles uneven lighting)."""
+    g = gray.astype(np.float64)
+    half = window // 2
+    padded = np.pad(g, half + 1, mode='reflect')
+    integral = padded.cumsum(0).cumsum(1)
+    integral_sq = (padded ** 2).cumsum(0).cumsum(1)
+    h, w = gray.shape
+
+    def window_sum(table):
+        a = table[window:window + h, window:window + w]
+        b = table[:h, window:window + w]
+        c = table[window:window + h, :w]
+        d = table[:h, :w]
+        return a - b - c + d
+
+    area = window * window
+    mean = window_sum(integral) / area
+    var = np.maximum(window_sum(integral_sq) / area - mean ** 2, 0)
+    return mean * (1 + k * (np.sqrt(var) / r - 1))
+
+
+def binarize(gray, mode="fixed", level=180):
+    """Black (0) / white (255) array using the given threshold mode."""
+    if mode == "fixed":
+        threshold = level
+    elif mode == "otsu":
+        threshold = otsu_threshold(gray)
+    elif mode == "sauvola":
+        threshold = sauvola_threshold(gray)
+    else:
+        raise ValueError(f"Unknown threshold mode: {mode}")
+    return np.where(gray < threshold, 0, 255).astype(np.uint8)
+
+
+def upscale(binary, scale):
+    """Nearest-neighbour upscale; keeps a binary image binary."""
+    if scale == 1:
+        return binary
+    return binary.repeat(scale, axis=0).repeat(scale, axis=1)
+
+
+def _box_mean(a, size):
+    """Mean over every size x size window ('valid' positions) via integral images."""
+    integral = np.pad(a, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    total = (integral[size:, size:] - integral[:-size, size:]
+             - integral[size:, :-size] + integral[:-size, :-size])
+    return total / (size * size)
+
+
+def ssim(a, b, window=7):
+    """Mean structural similarity of two equally sized grayscale arrays."""
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    mu_a = _box_mean(a, window)
+    mu_b = _box_mean(b, window)
+    var_a = _box_mean(a * a, window) - mu_a ** 2
+    var_b = _box_mean(b * b, window) - mu_b ** 2
+    cov = _box_mean(a * b, window) - mu_a * mu_b
+    score = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / (
+        (mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(score.mean())
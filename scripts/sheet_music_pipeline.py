@@ -0,0 +1,238 @@
+"""
+Sheet Music Pipeline Runner
+Runs analyze -> crop -> verify -> report in one process, so each source page
+and each cropped JPEG is decoded once and shared by every stage that needs it.
+
+Usage:
+    python scripts/sheet_music_pipeline.py                 # all stages
+    python scripts/sheet_music_pipeline.py crop report     # any subset
+
+Stages run in dependency order. A stage whose dependency is not selected
+reads that stage's last output from disk instead (e.g. `verify` alone checks
+the crops already in public/sheet-music/cropped).
+
+The crop stage takes crop_sheet_music.py's output switches (--responsive,
+--palette, --target-ssim, ...); pass the ones the last build used, or every
+crop is rebuilt with the new settings.
+"""
+
+from PIL import Image
+import argparse
+import os
+import sys
+import threading
+import time
+
+import analyze_sheet_music
+import crop_sheet_music
+import generate_verification_report
+import verify_sheet_music
+from ocr_cache import add_cache_arguments, open_cache
+import ocr_engine
+from ocr_engine import OcrUnavailable, add_engine_argument
+import page_decode
+from page_store import PageStore, add_store_argument
+from sheet_music_hash import ReferenceIndex
+import sheet_music_trace as tracing
+from text_regions import add_localize_argument
+
+# Stage -> stages whose output it consumes
+STAGES = {
+    "analyze": (),
+    "crop": (),
+    "verify": ("crop",),
+    "report": ("verify",),
+}
+
+# Stages that work on source pages; they share one decode per page
+PAGE_STAGES = ("analyze", "crop")
+
+
+def stage_order(selected):
+    """Selected stages in dependency order."""
+    order = []
+
+    def visit(stage):
+        if stage in order:
+            return
+        for dep in STAGES[stage]:
+            if dep in selected:
+                visit(dep)
+        order.append(stage)
+
+    for stage in STAGES:
+        if stage in selected:
+            visit(stage)
+    return order
+
+
+class PipelineState:
+    """Decoded images shared between stages, plus decode counts.
+
+    Source pages are decoded (and auto-rotated) once and dropped after the
+    page stages are done with them; cropped JPEGs are opened once and kept
+    for verify and report (PIL decodes them lazily, at most once each).
+    With a PageStore both are memory-mapped from it instead. `flatten`
+    flattens pages (page_geometry) before any stage sees them.
+    """
+
+    def __init__(self, store=None, flatten=None):
+        self.store = store
+        self.flatten = flatten
+        self.pages = {}
+        self.crops = {}
+        self.page_decodes = 0
+        self.crop_opens = 0
+        self._lock = threading.Lock()
+
+    def page(self, source_path):
+        if source_path not in self.pages:
+            if self.store:
+                img = self.store.image(source_path, flatten=self.flatten)
+            else:
+                img = page_decode.decode_page(source_path, flatten=self.flatten)
+            self.pages[source_path] = img
+            self.page_decodes += 1
+        return self.pages[source_path]
+
+    def release_page(self, source_path):
+        self.pages.pop(source_path, None)
+
+    def crop(self, path):
+        with self._lock:
+            if path not in self.crops:
+                self.crops[path] = self.store.image(path, "L") if self.store else Image.open(path)
+                self.crop_opens += 1
+            return self.crops[path]
+
+
+def run_page_stages(stages, state, cache, force=False, timings=None, localize=True, options=None):
+    """Run analyze and/or crop page by page over a single decode of each page.
+
+    `options` are the crop build options (crop_sheet_music.crop_options()).
+    Crops are cut from the pages as `state` provides them, so a flattening
+    state builds with options["flatten"] (and its crop keys). `localize` is
+    passed on to analyze_page().
+    """
+    timings = timings if timings is not None else {}
+    analyze_paths = set()
+    if "analyze" in stages:
+        source_dir = analyze_sheet_music.SOURCE_DIR
+        analyze_paths = {
+            os.path.join(source_dir, f) for f in os.listdir(source_dir) if f.lower().endswith('.jpg')
+        }
+
+    build = None
+    crop_pages = {}
+    outputs = {}
+    if "crop" in stages:
+        options = options or crop_sheet_music.DEFAULT_OPTIONS
+        if state.flatten:
+            options = dict(options, flatten=state.flatten)
+        build = crop_sheet_music.start_build(options, force=force)
+        crop_pages = dict(build[2])
+
+    for source_path in sorted(analyze_paths | set(crop_pages)):
+        with tracing.span("load_page", source=source_path):
+            img = state.page(source_path) if os.path.exists(source_path) else None
+        if source_path in analyze_paths:
+            start = time.perf_counter()
+            with tracing.span("stage", stage="analyze", source=source_path):
+                analyze_sheet_music.analyze_page(os.path.basename(source_path), cache, img,
+                                                 flatten=state.flatten, localize=localize)
+            timings["analyze"] = timings.get("analyze", 0.0) + time.perf_counter() - start
+        if source_path in crop_pages:
+            start = time.perf_counter()
+            with tracing.span("stage", stage="crop", source=source_path):
+                crop_sheet_music.process_page(source_path, crop_pages[source_path], options,
+                                              outputs=outputs, img=img)
+            timings["crop"] = timings.get("crop", 0.0) + time.perf_counter() - start
+        state.release_page(source_path)
+
+    if build:
+        start = time.perf_counter()
+        manifest, layout, _, keys = build
+        crop_sheet_music.finish_build(manifest, layout, keys, outputs)
+        timings["crop"] = timings.get("crop", 0.0) + time.perf_counter() - start
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the sheet music pipeline stages in one process.")
+    parser.add_argument("stages", nargs="*", metavar="STAGE",
+                        help=f"stages to run: {', '.join(STAGES)} (default: all)")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild every crop, ignoring the manifest")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="images to OCR concurrently in verify (default: one per CPU)")
+    parser.add_argument("--hash", action="store_true",
+                        help="verify against the reference renderings first; OCR only ambiguous crops")
+    add_cache_arguments(parser)
+    add_engine_argument(parser)
+    # Full pages are shared with analyze, so there is no --low-memory here
+    crop_sheet_music.add_crop_arguments(parser, low_memory=False)
+    add_localize_argument(parser)
+    add_store_argument(parser)
+    tracing.add_trace_argument(parser)
+    args = parser.parse_args(argv)
+    unknown = [s for s in args.stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+    options = crop_sheet_music.crop_options(args, parser)
+    stages = stage_order(set(args.stages or STAGES))
+
+    print("Sheet Music Pipeline: " + " -> ".join(stages))
+    print("=" * 60)
+
+    ocr_engine.configure(args.ocr_engine)
+    verify_sheet_music.LOCALIZE = not args.no_localize
+    tracing.start(args)
+    state = PipelineState(PageStore() if args.page_store else None, args.flatten)
+    timings = {}
+    results = None
+    ok = True
+    cache = open_cache(no_cache=args.no_cache, clear=args.clear_cache)
+    try:
+        page_stages = [s for s in stages if s in PAGE_STAGES]
+        if page_stages:
+            run_page_stages(page_stages, state, cache, force=args.force, timings=timings,
+                            localize=not args.no_localize, options=options)
+
+        if "verify" in stages:
+            start = time.perf_counter()
+            results = {}
+            index = ReferenceIndex.load() if args.hash else None
+            with tracing.span("stage", stage="verify"):
+                ok = verify_sheet_music.verify_all(args.workers, cache, load=state.crop, results=results,
+                                                   index=index)
+            timings["verify"] = time.perf_counter() - start
+
+        if "report" in stages:
+            start = time.perf_counter()
+            with tracing.span("stage", stage="report"):
+                generate_verification_report.generate_report(results)
+            timings["report"] = time.perf_counter() - start
+    except OcrUnavailable as e:
+        print(f"\nERROR: {e}")
+        # The stages that ran are still worth a trace
+        tracing.finish(args)
+        return 2
+    finally:
+        print(f"\n{cache.summary()}")
+        cache.close()
+
+    print("\nStage timings:")
+    for stage in stages:
+        print(f"  {stage:<8} {timings.get(stage, 0.0):.2f}s")
+    print(f"Decoded {state.page_decodes} source pages, opened {state.crop_opens} crops (each decoded once)")
+    if state.store:
+        removed = state.store.prune()
+        if removed:
+            print(f"Removed {removed} stale page store entries")
+        print(state.store.summary())
+    tracing.finish(args)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Tracing for the Sheet Music Scripts
+Records nested spans (page, question, region, PSM attempt, ...) and counters
+(pixels processed, bytes written, OCR calls) and exports them as Chrome
+trace-event JSON (open in chrome://tracing or https://ui.perfetto.dev) plus
+a summary table.
+
+Tracing is off unless --trace is given: span() then returns one shared no-op
+object and count() returns immediately, so instrumented code pays a function
+call and a None check.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+_tracer = None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer.events.append({
+            "name": self.name,
+            "ph": "X",
+            "ts": self.start / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": self.args,
+        })
+        return False
+
+
+class Tracer:
+    """Collects trace events; safe to use from several threads."""
+
+    def __init__(self):
+        self.events = []
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] += value
+            total = self.counters[name]
+        self.events.append({
+            "name": name,
+            "ph": "C",
+            "ts": time.perf_counter_ns() / 1000,
+            "pid": os.getpid(),
+            "args": {name: total},
+        })
+
+
+def enable():
+    """Start recording (also used as a process-pool initializer)."""
+    global _tracer
+    _tracer = Tracer()
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, **args):
+    """Context manager timing a span, e.g. span("ocr", region="left_margin", psm=6)."""
+    if _tracer is None:
+        return NULL_SPAN
+    return _Span(_tracer, name, args)
+
+
+def count(name, value=1):
+    """Add to a counter, e.g. count("bytes_written", size)."""
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+
+def drain():
+    """Take this process's events and counters (worker processes send them back)."""
+    if _tracer is None:
+        return None
+    events, counters = _tracer.events, dict(_tracer.counters)
+    _tracer.events = []
+    _tracer.counters.clear()
+    return events, counters
+
+
+def merge(drained):
+    """Add events and counters drained from a worker process."""
+    if _tracer is None or not drained:
+        return
+    events, counters = drained
+    _tracer.events.extend(events)
+    with _tracer._lock:
+        for name, value in counters.items():
+            _tracer.counters[name] += value
+
+
+def export(path):
+    """Write Chrome trace-event JSON."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": _tracer.events, "displayTimeUnit": "ms"}, f)
+
+
+def print_summary():
+    """Per-span-name totals, slowest first, then counter totals."""
+    stats = defaultdict(list)
+    for event in _tracer.events:
+        if event["ph"] == "X":
+            stats[event["name"]].append(event["dur"] / 1000)
+    print("\nTrace summary:")
+    print(f"  {'span':<20} {'count':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9}")
+    for name, durations in sorted(stats.items(), key=lambda item: -sum(item[1])):
+        total = sum(durations)
+        print(f"  {name:<20} {len(durations):>7} {total:>10.1f} {total / len(durations):>9.2f} "
+              f"{max(durations):>9.2f}")
+    for name, value in sorted(_tracer.counters.items()):
+        print(f"  {name:<20} {value:>7}")
+
+
+def add_trace_argument(parser):
+    parser.add_argument("--trace", metavar="OUT.json",
+                        help="record spans and counters; write a Chrome trace and print a summary")
+
+
+def start(args):
+    """Enable tracing if --trace was given."""
+    if getattr(args, "trace", None):
+        enable()
+
+
+def finish(args):
+    """Export and summarize the trace if --trace was given."""
+    if getattr(args, "trace", None) and _tracer is not None:
+        export(args.trace)
+        print_summary()
+        print(f"Trace written to {args.trace}")
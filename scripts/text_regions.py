@@ -0,0 +1,217 @@
+"""
+Text Label Localization
+Finds the lines of text on a page or crop - exercise labels such as "Ab Major
+Scale" above the first staff - so OCR reads a few small line boxes with a
+single-line PSM instead of whole pages and wide margin strips.
+
+The ink mask is cleared of staff lines (long horizontal runs) and labelled
+into connected components from its horizontal runs, with every row handled at
+once in NumPy. Components of character size that lie outside the staves
+(noteheads sit on or next to the lines, stems and beams are too tall or too
+long) are grouped into words by their gaps, and words into lines.
+"""
+
+import json
+
+import numpy as np
+
+from ocr_cache import cache_key
+from page_layout import find_staves
+from sheet_music_image import otsu_threshold, to_gray_array
+
+# Horizontal runs longer than this fraction of the width are staff lines
+LINE_RUN = 0.08
+# Character size in staff spacings (or in median component heights on pages
+# without staves)
+CHAR_HEIGHT = (0.3, 3.0)
+MAX_CHAR_WIDTH = 6.0
+# Ink within this many spacings above/below a staff belongs to the music
+STAFF_MARGIN = 1.0
+# Gaps that still join characters into a word and words into a line, in
+# line heights
+WORD_GAP = 0.8
+LINE_GAP = 3.0
+# A line needs this many characters; lone marks are dynamics or fingerings
+MIN_CHARS = 3
+# Padding around a line box, in line heights (at least MIN_PADDING pixels)
+PADDING = 0.5
+MIN_PADDING = 2
+
+# Single-line page segmentation for the label boxes
+LABEL_PSM = 7
+
+# Part of the cache key of the label boxes found on an image
+TEXT_PARAMS = {
+    "line_run": LINE_RUN,
+    "char_height": list(CHAR_HEIGHT),
+    "char_width": MAX_CHAR_WIDTH,
+    "staff_margin": STAFF_MARGIN,
+    "word_gap": WORD_GAP,
+    "line_gap": LINE_GAP,
+    "min_chars": MIN_CHARS,
+    "padding": [PADDING, MIN_PADDING],
+}
+
+
+def horizontal_runs(mask):
+    """(rows, starts, ends) of the ink runs of a boolean mask, row-major."""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends
+
+
+def label_runs(rows, starts, ends, width):
+    """Component label per run (8-connectivity), numbered 0..n-1.
+
+    Runs in adjacent rows that overlap (diagonals included) are joined: for
+    every run the overlapping runs of the next row form one index range,
+    found by binary search on row-major positions. Labels are then the
+    minimum run index of each component, spread along those pairs with
+    pointer jumping until nothing changes.
+    """
+    count = len(rows)
+    if not count:
+        return np.zeros(0, dtype=np.int64)
+    stride = width + 2
+    start_pos = rows * stride + starts
+    end_pos = rows * stride + ends
+    below = (rows + 1) * stride
+    # Next-row runs that end at or after this start and begin at or before this end
+    lo = np.searchsorted(end_pos, below + starts, side="left")
+    hi = np.searchsorted(start_pos, below + ends, side="right")
+    counts = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(count), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    b = np.repeat(lo, counts) + offsets
+
+    labels = np.arange(count)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, a, labels[b])
+        np.minimum.at(labels, b, labels[a])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            break
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def components(mask, max_run=None):
+    """Boxes (x0, y0, x1, y1) and ink pixel counts of the connected
+    components of a mask, ignoring runs longer than max_run."""
+    rows, starts, ends = horizontal_runs(mask)
+    if max_run is not None:
+        short = (ends - starts) <= max_run
+        rows, starts, ends = rows[short], starts[short], ends[short]
+    labels = label_runs(rows, starts, ends, mask.shape[1])
+    n = int(labels.max()) + 1 if len(labels) else 0
+    boxes = np.empty((n, 4), dtype=np.int64)
+    boxes[:, :2] = np.iinfo(np.int64).max
+    boxes[:, 2:] = -1
+    np.minimum.at(boxes[:, 0], labels, starts)
+    np.minimum.at(boxes[:, 1], labels, rows)
+    np.maximum.at(boxes[:, 2], labels, ends)
+    np.maximum.at(boxes[:, 3], labels, rows + 1)
+    return boxes, np.bincount(labels, weights=ends - starts, minlength=n)
+
+
+def _split(values, gaps, limit):
+    """Index groups of sorted values, cut where the gap before one exceeds limit."""
+    cuts = np.flatnonzero(gaps > limit) + 1
+    return np.split(np.arange(len(values)), cuts)
+
+
+def group_lines(boxes):
+    """Character boxes -> [(line box, [word boxes])], top to bottom."""
+    if not len(boxes):
+        return []
+    heights = boxes[:, 3] - boxes[:, 1]
+    centers = (boxes[:, 1] + boxes[:, 3]) / 2
+    order = np.argsort(centers, kind="stable")
+    # Characters of one line have centres within about half a character height
+    rows = _split(order, np.diff(centers[order]), 0.6 * np.median(heights))
+
+    lines = []
+    for row in rows:
+        chars = boxes[order[row]]
+        chars = chars[np.argsort(chars[:, 0], kind="stable")]
+        height = np.median(chars[:, 3] - chars[:, 1])
+        # Gap to the furthest right edge so far, so overlapping boxes don't split
+        gaps = chars[1:, 0] - np.maximum.accumulate(chars[:, 2])[:-1]
+        words = [chars[group] for group in _split(chars, gaps, WORD_GAP * height)]
+        word_gaps = np.array([b[:, 0].min() - a[:, 2].max() for a, b in zip(words[:-1], words[1:])])
+        for group in _split(words, word_gaps, LINE_GAP * height):
+            members = [words[i] for i in group]
+            chars_in_line = np.vstack(members)
+            if len(chars_in_line) < MIN_CHARS:
+                continue
+            word_boxes = [tuple(int(v) for v in (w[:, 0].min(), w[:, 1].min(), w[:, 2].max(), w[:, 3].max()))
+                          for w in members]
+            line_box = (word_boxes[0][0], min(w[1] for w in word_boxes),
+                        word_boxes[-1][2], max(w[3] for w in word_boxes))
+            lines.append((line_box, word_boxes))
+    return sorted(lines, key=lambda line: (line[0][1], line[0][0]))
+
+
+def find_text(mask):
+    """[(line box, [word boxes])] of the text in an ink mask, in mask pixels."""
+    height, width = mask.shape
+    staves, spacing, (staff_left, staff_right) = find_staves(mask)
+    boxes, _ = components(mask, max_run=int(LINE_RUN * width))
+    if not len(boxes):
+        return []
+    sizes = boxes[:, 2:] - boxes[:, :2]
+    unit = spacing or float(np.median(sizes[:, 1]))
+
+    keep = ((sizes[:, 1] >= CHAR_HEIGHT[0] * unit) & (sizes[:, 1] <= CHAR_HEIGHT[1] * unit)
+            & (sizes[:, 0] <= MAX_CHAR_WIDTH * unit))
+    # Anything overlapping a staff (and its margin) between the staff ends is music
+    across = (boxes[:, 2] > staff_left) & (boxes[:, 0] < staff_right)
+    for top, bottom in staves:
+        reach = STAFF_MARGIN * spacing
+        keep &= ~(across & (boxes[:, 3] > top - reach) & (boxes[:, 1] < bottom + reach))
+    return group_lines(boxes[keep])
+
+
+def find_labels(gray):
+    """Padded line boxes (x0, y0, x1, y1) of the text on a grayscale array."""
+    boxes = []
+    height, width = gray.shape
+    for (x0, y0, x1, y1), _ in find_text(gray < otsu_threshold(gray)):
+        pad = max(MIN_PADDING, int(round(PADDING * (y1 - y0))))
+        boxes.append((max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad)))
+    return boxes
+
+
+def label_boxes(image):
+    """Label line boxes of a PIL image or grayscale array, in its pixels.
+
+    Pages are searched at full resolution: reduced to the layout analysis
+    size, small labels break up into specks below the character size.
+    """
+    gray = image if isinstance(image, np.ndarray) else to_gray_array(image)
+    return find_labels(gray)
+
+
+def cached_label_boxes(cache, image_hash, load, preprocess=None):
+    """label_boxes() through the OCR cache; `load()` returns the image (or
+    grayscale array) and is only called on a miss. `preprocess` describes
+    what was done to the image after decoding (e.g. flattening) when that
+    changes its pixels, and becomes part of the key."""
+    params = TEXT_PARAMS if preprocess is None else dict(TEXT_PARAMS, preprocess=preprocess)
+    key = cache_key(image_hash, (), params, "labels")
+    cached = cache.get(key)
+    if cached is not None:
+        return [tuple(box) for box in json.loads(cached)]
+    boxes = label_boxes(load())
+    cache.put(key, json.dumps(boxes))
+    return boxes
+
+
+def add_localize_argument(parser):
+    """Add the shared --no-localize switch to an ArgumentParser."""
+    parser.add_argument("--no-localize", action="store_true",
+                        help="skip the text lines found on the image and OCR only the fixed "
+                             "page regions (with several PSM modes)")
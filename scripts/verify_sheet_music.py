@@ -1,161 +1,266 @@
 """
 Automated Sheet Music Verification using OCR
 Uses image preprocessing for better text recognition.
+
+With --hash, crops are first matched against the clean reference renderings
+by perceptual hash (sheet_music_hash.py); only crops whose match is ambiguous
+are OCRed.
+
+OCR reads the text lines found on the crop (text_regions.py), one box each
+with a single-line PSM; the fixed REGIONS are the fallback when none of those
+lines matches.
 """
 
 from PIL import Image, ImageEnhance, ImageFilter, ImageOps
-import pytesseract
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import argparse
 import os
-import re
 import sys
+import time
 
-# Set Tesseract path for Windows
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+from ocr_cache import NullCache, add_cache_arguments, cache_key, file_hash, open_cache
+import ocr_engine
+from ocr_engine import OcrUnavailable, add_engine_argument
+from page_store import add_store_argument, default_store
+from sheet_music_image import (
+    THRESHOLD_MODES, PageBuffer, binarize, enhance_contrast, enhance_sharpness,
+    to_gray_array, upscale,
+)
+import sheet_music_trace as tracing
+from label_matcher import default_matcher, describe, is_match, load_catalog
+from sheet_music_assets import find_crop
+from sheet_music_hash import ReferenceIndex
+from text_regions import LABEL_PSM, add_localize_argument, cached_label_boxes
 
 CROPPED_DIR = "public/sheet-music/cropped"
 
-# Expected text patterns for each question ID
-# We look for keywords in the scale label text
-EXPECTED = {
-    "I-1": ("Ab", ["Ab", "A flat", "Apmajor"]),
-    "I-2": ("G# Minor Melodic", ["G#", "G sharp", "melodic"]),
-    "I-3": ("G# Minor Harmonic", ["G#", "G sharp", "harmonic"]),
-    "I-4": ("C Major", ["C major", "Cmajor"]),
-    "I-5": ("C Minor Melodic", ["C minor", "melodic"]),
-    "I-6": ("C Minor Harmonic", ["C minor", "harmonic"]),
-    "I-7": ("Db Major", ["Db", "D flat", "Dpmajor"]),
-    "I-8": ("C# Minor Melodic", ["C#", "C sharp", "melodic"]),
-    "I-9": ("C# Minor Harmonic", ["C#", "C sharp", "harmonic"]),
-    "I-10": ("Eb Major", ["Eb", "E flat", "Epmajor"]),
-    "I-11": ("Eb Minor Melodic", ["Eb", "E flat", "melodic"]),
-    "I-12": ("Eb Minor Harmonic", ["Eb", "E flat", "harmonic"]),
-    "I-13": ("E Major", ["E major", "Emajor"]),
-    "I-14": ("E Minor Melodic", ["E minor", "melodic"]),
-    "I-15": ("E Minor Harmonic", ["E minor", "harmonic"]),
-    "II-1": ("Ab Major Arp", ["Ab", "arpeggio"]),
-    "II-2": ("G# Minor Arp", ["G#", "arpeggio"]),
-    "II-3": ("C Major Arp", ["C major", "arpeggio"]),
-    "II-4": ("C Minor Arp", ["C minor", "arpeggio"]),
-    "II-5": ("Db Major Arp", ["Db", "arpeggio"]),
-    "II-6": ("C# Minor Arp", ["C#", "arpeggio"]),
-    "II-7": ("Eb Major Arp", ["Eb", "arpeggio"]),
-    "II-8": ("Eb Minor Arp", ["Eb", "arpeggio"]),
-    "II-9": ("E Major Arp", ["E major", "arpeggio"]),
-    "II-10": ("E Minor Arp", ["E minor", "arpeggio"]),
-    "III-1": ("Dom 7th Db", ["Db", "dominant", "7"]),
-    "III-2": ("Dom 7th F", ["F", "dominant", "7"]),
-    "III-3": ("Dom 7th Ab", ["Ab", "dominant", "7"]),
-    "III-4": ("Dom 7th A", ["A", "dominant", "7"]),
-    "IV-1": ("Dim 7th C", ["C", "diminished", "7"]),
-    "IV-2": ("Dim 7th Eb", ["Eb", "diminished", "7"]),
-    "IV-3": ("Dim 7th E", ["E", "diminished", "7"]),
-    "IV-4": ("Dim 7th Ab", ["Ab", "diminished", "7"]),
-    "V-1": ("Chromatic C", ["C", "chromatic"]),
-    "V-2": ("Chromatic Eb", ["Eb", "chromatic"]),
-    "V-3": ("Chromatic E", ["E", "chromatic"]),
-    "V-4": ("Chromatic Ab", ["Ab", "chromatic"]),
-    "VI-1": ("Double 3rds Bb", ["Bb", "3rd", "double"]),
-    "VI-5": ("Double Oct D", ["D", "octave"]),
-    "VI-6": ("Double Oct Gm Mel", ["G", "octave", "melodic"]),
-    "VI-7": ("Double Oct Gm Harm", ["G", "octave", "harmonic"]),
-    "VI-8": ("Double 6ths Eb", ["Eb", "6th", "double"]),
+# Regions to OCR as (name, left, top, right, bottom) fractions of the image -
+# scale labels are usually on the left. Tried in order with each PSM mode,
+# after the label lines found on the crop.
+REGIONS = [
+    ("left_margin", 0.0, 0.0, 0.25, 1.0),
+    ("top_left", 0.0, 0.0, 0.3, 0.3),
+    ("full_left", 0.0, 0.0, 0.4, 1.0),
+]
+PSM_MODES = [6, 11, 3]
+
+# --no-localize: skip the label lines and OCR only the fixed REGIONS
+LOCALIZE = True
+
+# Parameters used by preprocess_array(); part of the OCR cache key.
+# "scope": the whole crop is preprocessed once and regions sliced from it.
+# "mode": fixed (at "threshold"), otsu or sauvola; see --threshold.
+PREPROCESS = {
+    "contrast": 2.0, "sharpness": 2.0, "scale": 2, "threshold": 180,
+    "mode": "fixed", "scope": "page", "engine": "numpy",
 }
 
+# Question IDs to verify, with their titles from the app's question catalog.
+# OCR text is scored against every title by label_matcher.
+EXPECTED = dict(load_catalog())
+
 
 def preprocess_image(img):
-    """Apply preprocessing to improve OCR accuracy."""
+    """Apply preprocessing to improve OCR accuracy.
+
+    Original PIL chain, kept as the reference for --benchmark-preprocess.
+    """
     # Convert to grayscale
     gray = img.convert('L')
     
     # Increase contrast
     enhancer = ImageEnhance.Contrast(gray)
-    gray = enhancer.enhance(2.0)
+    gray = enhancer.enhance(PREPROCESS["contrast"])
     
     # Increase sharpness
     enhancer = ImageEnhance.Sharpness(gray)
-    gray = enhancer.enhance(2.0)
+    gray = enhancer.enhance(PREPROCESS["sharpness"])
     
     # Resize for better OCR (2x)
     w, h = gray.size
-    gray = gray.resize((w * 2, h * 2), Image.LANCZOS)
+    scale = PREPROCESS["scale"]
+    gray = gray.resize((w * scale, h * scale), Image.LANCZOS)
     
     # Binarize (threshold)
-    gray = gray.point(lambda x: 0 if x < 180 else 255)
+    threshold = PREPROCESS["threshold"]
+    gray = gray.point(lambda x: 0 if x < threshold else 255)
     
     return gray
 
 
-def extract_text(image_path):
-    """Extract text from image using OCR with preprocessing."""
-    img = Image.open(image_path)
-    
-    # Try multiple regions - scale labels are usually on the left
-    w, h = img.size
-    regions = [
-        ("left_margin", img.crop((0, 0, int(w * 0.25), h))),
-        ("top_left", img.crop((0, 0, int(w * 0.3), int(h * 0.3)))),
-        ("full_left", img.crop((0, 0, int(w * 0.4), h))),
+def region_boxes(size):
+    """Pixel boxes for REGIONS on an image of the given size."""
+    w, h = size
+    return [
+        (name, (int(w * left), int(h * top), int(w * right), int(h * bottom)))
+        for name, left, top, right, bottom in REGIONS
     ]
+
+
+def preprocess_array(img, params=None):
+    """Vectorized preprocessing: returns a binarized, upscaled uint8 array.
+
+    Thresholds at native resolution and then upscales with nearest-neighbour,
+    so only a quarter of the pixels of the PIL chain are enhanced/thresholded.
+    """
+    params = params or PREPROCESS
+    gray = to_gray_array(img)
+    gray = enhance_contrast(gray, params["contrast"])
+    gray = enhance_sharpness(gray, params["sharpness"])
+    binary = binarize(gray, params["mode"], params["threshold"])
+    return upscale(binary, params["scale"])
+
+
+def preprocess_page(img):
+    """Preprocess a whole crop once; regions are then views into the result."""
+    return PageBuffer(preprocess_array(img), scale=PREPROCESS["scale"])
+
+
+def ocr_attempts(image_path, cache=None, img=None):
+    """Yield OCR text for each label line, then each region/PSM combination, lazily.
+
+    The image is preprocessed at most once (only on a cache miss) and every
+    attempt OCRs a zero-copy slice of that buffer. Label line boxes are
+    cached too, so a fully cached crop is never decoded. `img` is the
+    already opened image when a caller shares it between stages.
+    """
+    cache = cache or NullCache()
+    if img is None:
+        img = Image.open(image_path)
+    image_hash = file_hash(image_path)
+    page = None
     
-    all_text = []
+    attempts = []
+    if LOCALIZE:
+        with tracing.span("localize", image=os.path.basename(image_path)):
+            labels = cached_label_boxes(cache, image_hash, lambda: img)
+        attempts += [(f"label_{i}", box, LABEL_PSM) for i, box in enumerate(labels, 1)]
+    # Try different PSM modes on the fixed regions
+    attempts += [(name, box, psm) for name, box in region_boxes(img.size) for psm in PSM_MODES]
     
-    for name, region in regions:
-        processed = preprocess_image(region)
-        
-        # Try different PSM modes
-        for psm in [6, 11, 3]:
+    for name, box, psm in attempts:
+        config = f'--psm {psm} --oem 3'
+        key = cache_key(image_hash, box, PREPROCESS, config)
+        text = cache.get(key)
+        if text is None:
+            if page is None:
+                with tracing.span("preprocess", image=os.path.basename(image_path)):
+                    page = preprocess_page(img)
+                tracing.count("pixels_preprocessed", img.size[0] * img.size[1])
+            region = page.region(box)
             try:
-                config = f'--psm {psm} --oem 3'
-                text = pytesseract.image_to_string(processed, config=config)
-                all_text.append(text)
+                with tracing.span("ocr", image=os.path.basename(image_path), region=name, psm=psm):
+                    text = ocr_engine.image_to_string(region, config=config)
+            except OcrUnavailable:
+                raise
             except:
-                pass
+                continue
+            finally:
+                tracing.count("ocr_calls")
+                tracing.count("pixels_ocr", region.size)
+            cache.put(key, text)
+        else:
+            tracing.count("ocr_cache_hits")
+        yield text
+
+
+def extract_text(image_path, qid=None, cache=None, img=None):
+    """Extract text from image using OCR with preprocessing.
+
+    With qid, stops at the first attempt whose text matches that question.
+    """
+    all_text = []
+    
+    for text in ocr_attempts(image_path, cache, img):
+        all_text.append(text)
+        if qid and check_match(text, qid):
+            break
     
     return "\n".join(all_text)
 
 
-def check_match(text, patterns):
-    """Check if any pattern is found in text."""
-    text_lower = text.lower()
-    matches = []
-    for pattern in patterns:
-        if pattern.lower() in text_lower:
-            matches.append(pattern)
-    return matches
+def check_match(text, qid):
+    """Ranked (question_id, score) candidates for text if qid matches, else []."""
+    ranked = default_matcher().match(text)
+    return ranked if is_match(ranked, qid) else []
+
+
+def verify_one(qid, cache=None, load=None, index=None):
+    """Verify one cropped image. Returns (qid, expected_name, ok, method, ranked, text).
+
+    method is "hash" when the reference index gave a confident verdict, else
+    "ocr"; ranked is that method's [(question_id, score)], best first. For a
+    missing crop ok, method and ranked are None and text is its path.
+
+    `load(path)` supplies the opened image (default: open it from disk);
+    `index` is a ReferenceIndex to try before OCR.
+    """
+    expected_name = EXPECTED[qid]
+    filepath = find_crop(CROPPED_DIR, qid)
+    
+    if not os.path.exists(filepath):
+        return qid, expected_name, None, None, None, filepath
+    
+    with tracing.span("question", qid=qid):
+        if index is not None:
+            with tracing.span("hash", qid=qid):
+                verdict, ranked = index.verify(qid, filepath)
+            if verdict != "ambiguous":
+                return qid, expected_name, verdict == "pass", "hash", ranked, ""
+            tracing.count("hash_fallbacks")
+        img = load(filepath) if load else None
+        text = extract_text(filepath, qid, cache, img)
+    ranked = default_matcher().match(text)
+    return qid, expected_name, is_match(ranked, qid), "ocr", ranked, text
+
 
+def verify_all(workers=None, cache=None, load=None, results=None, index=None):
+    """Verify all 42 scale images, OCRing up to `workers` images at once.
 
-def verify_all():
-    """Verify all 42 scale images."""
+    Per-question outcomes ("pass", "fail" or "missing") are collected into
+    `results` when given. With a reference `index`, only crops it cannot
+    decide are OCRed.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers > 1:
+        # Each tesseract instance would otherwise start one OpenMP thread per core
+        os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    
     print("=" * 70)
     print("AUTOMATED SHEET MUSIC VERIFICATION")
     print("=" * 70)
     
     passed = []
     failed = []
+    methods = {"hash": 0, "ocr": 0}
+    start = time.perf_counter()
     
-    for qid, (expected_name, patterns) in EXPECTED.items():
-        filename = f"{qid.lower().replace('-', '_')}.jpg"
-        filepath = os.path.join(CROPPED_DIR, filename)
-        
-        if not os.path.exists(filepath):
-            print(f"✗ {qid}: FILE NOT FOUND - {filepath}")
-            failed.append((qid, "File not found", ""))
-            continue
-        
-        text = extract_text(filepath)
-        matches = check_match(text, patterns)
-        
-        if matches:
-            print(f"✓ {qid}: PASS - Found: {matches}")
-            passed.append(qid)
-        else:
-            # Extract first 80 chars for debugging
-            clean_text = ' '.join(text.split())[:80]
-            print(f"✗ {qid}: FAIL - Expected {expected_name}, found: '{clean_text}'")
-            failed.append((qid, expected_name, clean_text))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for qid, expected_name, ok, method, ranked, text in pool.map(
+                partial(verify_one, cache=cache, load=load, index=index), EXPECTED):
+            if results is not None:
+                results[qid] = "missing" if ok is None else "pass" if ok else "fail"
+            if ok is None:
+                print(f"✗ {qid}: FILE NOT FOUND - {text}")
+                failed.append((qid, "File not found", ""))
+                continue
+            methods[method] += 1
+            if ok:
+                print(f"✓ {qid}: PASS ({method}) - {describe(ranked)}")
+                passed.append(qid)
+            else:
+                # Extract first 80 chars for debugging
+                clean_text = ' '.join(text.split())[:80]
+                print(f"✗ {qid}: FAIL ({method}) - Expected {expected_name}, best: {describe(ranked)}, "
+                      f"found: '{clean_text}'")
+                failed.append((qid, expected_name, clean_text or f"best match {describe(ranked, 1)}"))
     
     print("\n" + "=" * 70)
     print(f"RESULTS: {len(passed)} PASSED, {len(failed)} FAILED")
+    if index is not None:
+        print(f"Decided by hash: {methods['hash']}, by OCR: {methods['ocr']} "
+              f"({time.perf_counter() - start:.2f}s)")
     print("=" * 70)
     
     if failed:
@@ -166,10 +271,9 @@ def verify_all():
     return len(failed) == 0
 
 
-def analyze_one(qid):
+def analyze_one(qid, cache=None):
     """Detailed analysis of a single image."""
-    filename = f"{qid.lower().replace('-', '_')}.jpg"
-    filepath = os.path.join(CROPPED_DIR, filename)
+    filepath = find_crop(CROPPED_DIR, qid)
     
     print(f"\nDetailed analysis of {qid}")
     print("-" * 50)
@@ -178,20 +282,83 @@ def analyze_one(qid):
         print(f"ERROR: {filepath} not found")
         return
     
-    text = extract_text(filepath)
+    text = extract_text(filepath, cache=cache)
     print(f"Extracted text:\n{text}")
     
+    ranked = default_matcher().match(text)
+    print(f"\nRanked matches: {describe(ranked, limit=5)}")
     if qid in EXPECTED:
-        expected_name, patterns = EXPECTED[qid]
-        matches = check_match(text, patterns)
-        print(f"\nExpected: {expected_name}")
-        print(f"Patterns: {patterns}")
-        print(f"Matches: {matches}")
+        print(f"Expected: {EXPECTED[qid]}")
+        print(f"Match: {'yes' if is_match(ranked, qid) else 'no'}")
+
+
+def benchmark_preprocess(repeat=3):
+    """Time the PIL reference chain against preprocess_array() on every crop."""
+    files = sorted(f for f in os.listdir(CROPPED_DIR) if f.endswith('.jpg'))
+    images = [Image.open(os.path.join(CROPPED_DIR, f)) for f in files]
+    for img in images:
+        img.load()
+    
+    print(f"Preprocessing benchmark: {len(images)} images x {repeat} runs")
+    engines = [("pil", preprocess_image)] + [
+        (f"numpy/{mode}", partial(preprocess_array, params=dict(PREPROCESS, mode=mode)))
+        for mode in THRESHOLD_MODES
+    ]
+    for name, fn in engines:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for img in images:
+                fn(img)
+        per_image = (time.perf_counter() - start) / (repeat * max(len(images), 1)) * 1000
+        print(f"  {name:<15} {per_image:8.1f} ms/image")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify cropped sheet music via OCR.")
+    parser.add_argument("qid", nargs="?", help="analyze a single question ID in detail")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="images to OCR concurrently (default: one per CPU)")
+    parser.add_argument("--threshold", choices=THRESHOLD_MODES, default=PREPROCESS["mode"],
+                        help="binarization mode (default: %(default)s)")
+    parser.add_argument("--hash", action="store_true",
+                        help="match crops against the reference renderings first; OCR only ambiguous ones")
+    parser.add_argument("--benchmark-preprocess", action="store_true",
+                        help="compare PIL and NumPy preprocessing speed and exit")
+    add_cache_arguments(parser)
+    add_engine_argument(parser)
+    add_localize_argument(parser)
+    add_store_argument(parser)
+    tracing.add_trace_argument(parser)
+    args = parser.parse_args(argv)
+    
+    PREPROCESS["mode"] = args.threshold
+    global LOCALIZE
+    LOCALIZE = not args.no_localize
+    ocr_engine.configure(args.ocr_engine)
+    if args.benchmark_preprocess:
+        benchmark_preprocess()
+        return 0
+    
+    cache = open_cache(no_cache=args.no_cache, clear=args.clear_cache)
+    tracing.start(args)
+    try:
+        if args.qid:
+            analyze_one(args.qid, cache)
+            return 0
+        index = ReferenceIndex.load() if args.hash else None
+        # Crops are OCRed in grayscale, so map them that way
+        load = (lambda path: default_store().image(path, "L")) if args.page_store else None
+        return 0 if verify_all(args.workers, cache, load=load, index=index) else 1
+    except OcrUnavailable as e:
+        print(f"ERROR: {e}")
+        return 2
+    finally:
+        print(cache.summary())
+        if args.page_store:
+            print(default_store().summary())
+        cache.close()
+        tracing.finish(args)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        analyze_one(sys.argv[1])
-    else:
-        success = verify_all()
-        sys.exit(0 if success else 1)
+    sys.exit(main())
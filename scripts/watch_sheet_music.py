@@ -0,0 +1,188 @@
+"""
+Sheet Music Watch Mode
+Keeps decoded pages in memory and rebuilds crops as you edit, for tuning the
+crop boxes in PAGES without rerunning crop_sheet_music.py and
+generate_verification_report.py each time.
+
+    python scripts/watch_sheet_music.py
+    python scripts/watch_sheet_music.py --responsive --palette 4   # as the last build
+
+Takes crop_sheet_music.py's output switches, which are part of every crop
+key: pass the ones the last build used, or the first rebuild replaces every
+crop.
+
+Polls the source pages and crop_sheet_music.py for changes. PAGES is re-read
+from the script's source on every save (a half-typed edit that doesn't parse
+is ignored until the next save). Only crops whose source page or box changed
+are re-emitted, from pages kept upright in an LRU cache, and the report is
+regenerated with new image URLs for just those cards. Edits to anything but
+PAGES in crop_sheet_music.py need a restart.
+"""
+
+from collections import OrderedDict
+import argparse
+import ast
+import hashlib
+import os
+import sys
+import time
+
+import crop_sheet_music
+import generate_verification_report
+import page_decode
+from sheet_music_assets import question_sort_key
+
+CONFIG_PATH = crop_sheet_music.__file__
+DEFAULT_INTERVAL = 0.3
+DEFAULT_CACHE_PAGES = 16
+
+
+class PageCache:
+    """Decoded, upright pages keyed by path, file version and decode width,
+    least recently used evicted first. Pages are decoded as the build would:
+    flattened with `flatten`, draft-decoded with a min_width (--low-memory)."""
+
+    def __init__(self, max_pages=DEFAULT_CACHE_PAGES, flatten=None):
+        self.max_pages = max_pages
+        self.flatten = flatten
+        self.pages = OrderedDict()
+        self.hits = 0
+        self.decodes = 0
+
+    def get(self, source_path, min_width=None):
+        stat = os.stat(source_path)
+        key = (source_path, stat.st_mtime_ns, stat.st_size, min_width)
+        if key in self.pages:
+            self.hits += 1
+            self.pages.move_to_end(key)
+            return self.pages[key]
+        # Drop older versions of this page
+        for stale in [k for k in self.pages if k[0] == source_path]:
+            del self.pages[stale]
+        img = page_decode.decode_page(source_path, min_width, flatten=self.flatten)
+        self.decodes += 1
+        self.pages[key] = img
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+        return img
+
+
+def read_pages(path=CONFIG_PATH):
+    """(PAGES, digest of the rest of the file) from the crop script's source."""
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    tree = ast.parse(source)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == "PAGES" for target in node.targets):
+            lines = source.splitlines(keepends=True)
+            rest = "".join(lines[:node.lineno - 1] + lines[node.end_lineno:])
+            return ast.literal_eval(node.value), hashlib.sha256(rest.encode()).hexdigest()
+    raise ValueError(f"no PAGES assignment in {path}")
+
+
+def snapshot(paths):
+    """{path: (mtime_ns, size)} for the paths that exist."""
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats[path] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def watched_paths():
+    return [CONFIG_PATH] + sorted({source_path for source_path, _ in crop_sheet_music.PAGES})
+
+
+def write_report(manifest):
+    """Regenerate the report; image URLs carry each crop's build key."""
+    crops = manifest["sheet_music"]["crops"]
+    generate_verification_report.generate_report(
+        versions={qid: entry["key"][:12] for qid, entry in crops.items()})
+
+
+def decode_widths(layout, options):
+    """{source_path: --low-memory decode width (or None)} over every crop of
+    each page, so a page is cached at one width whichever crops changed."""
+    return {source_path: crop_sheet_music.page_decode_width(scales, options) for source_path, scales in layout}
+
+
+def rebuild(manifest, cache, options, auto_layout=False):
+    """Re-emit changed crops and refresh the report. Returns the rebuilt IDs."""
+    layout = crop_sheet_music.resolve_layout(crop_sheet_music.PAGES, manifest, auto=auto_layout,
+                                             flatten=options.get("flatten"))
+    widths = decode_widths(layout, options)
+    pages, keys, _ = crop_sheet_music.plan_build(layout, manifest, options=options)
+    outputs = {}
+    for source_path, scales in pages:
+        img = cache.get(source_path, widths[source_path]) if os.path.exists(source_path) else None
+        crop_sheet_music.process_page(source_path, scales, options, outputs, img=img)
+    if outputs:
+        crop_sheet_music.finish_build(manifest, layout, keys, outputs)
+        write_report(manifest)
+    return sorted(outputs, key=question_sort_key)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild sheet music crops as PAGES or pages change.")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between checks for changes (default: %(default)s)")
+    parser.add_argument("--cache-pages", type=int, default=DEFAULT_CACHE_PAGES,
+                        help="decoded pages kept in memory (default: %(default)s)")
+    parser.add_argument("--auto-layout", action="store_true",
+                        help="detect crop boxes from staff lines, as crop_sheet_music.py --auto-layout")
+    crop_sheet_music.add_crop_arguments(parser)
+    args = parser.parse_args(argv)
+
+    options = crop_sheet_music.crop_options(args, parser)
+    cache = PageCache(args.cache_pages, options.get("flatten"))
+    manifest = crop_sheet_music.load_manifest()
+    _, config_digest = read_pages()
+
+    print("Sheet Music Watch Mode")
+    print("=" * 50)
+    start = time.perf_counter()
+    layout = crop_sheet_music.resolve_layout(crop_sheet_music.PAGES, manifest, auto=args.auto_layout,
+                                             flatten=options.get("flatten"))
+    for source_path, width in list(decode_widths(layout, options).items())[:args.cache_pages]:
+        if os.path.exists(source_path):
+            cache.get(source_path, width)
+    print(f"Warmed {cache.decodes} pages in {time.perf_counter() - start:.2f}s")
+    if not rebuild(manifest, cache, options, args.auto_layout):
+        write_report(manifest)
+
+    seen = snapshot(watched_paths())
+    print(f"\nWatching {len(seen)} files (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(args.interval)
+            current = snapshot(watched_paths())
+            if current == seen:
+                continue
+            seen = current
+            start = time.perf_counter()
+            try:
+                pages, digest = read_pages()
+            except (SyntaxError, ValueError) as e:
+                print(f"\n{os.path.basename(CONFIG_PATH)}: {e} - keeping the previous PAGES")
+                continue
+            if digest != config_digest:
+                print(f"\nNOTE: {os.path.basename(CONFIG_PATH)} changed outside PAGES; restart to pick that up")
+                config_digest = digest
+            crop_sheet_music.PAGES = pages
+            rebuilt = rebuild(manifest, cache, options, args.auto_layout)
+            # New pages may have been added to PAGES
+            seen = snapshot(watched_paths())
+            print(f"\nRebuilt {len(rebuilt)} crops in {time.perf_counter() - start:.2f}s"
+                  + (f": {', '.join(rebuilt)}" if rebuilt else "")
+                  + f" (page cache: {cache.hits} hits, {cache.decodes} decodes)")
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
-// Sheet music mapping - uses compressed JPEG images from cropped photos
+// Sheet music mapping - uses compressed images from cropped photos
+// Generated by scripts/crop_sheet_music.py - do not edit by hand.
 
 export const SHEET_MUSIC_MAP = {
     // Scales I-1 to I-15
@@ -48,7 +49,7 @@ export const SHEET_MUSIC_MAP = {
     'V-3': '/sheet-music/cropped/v_3.jpg',
     'V-4': '/sheet-music/cropped/v_4.jpg',
 
-    // Double Stops VI-1, VI-5 to VI-8
+    // Double Stops VI-1 to VI-8
     'VI-1': '/sheet-music/cropped/vi_1.jpg',
     'VI-5': '/sheet-music/cropped/vi_5.jpg',
     'VI-6': '/sheet-music/cropped/vi_6.jpg',
@@ -56,7 +57,34 @@ export const SHEET_MUSIC_MAP = {
     'VI-8': '/sheet-music/cropped/vi_8.jpg',
 };
 
+// Responsive variants: <picture> sources (best format first) with
+// srcset strings and per-file byte sizes in the same order as srcset.
+export const SHEET_MUSIC_IMAGES = {};
+
+// Sprite atlases: the question's region (x, y, width, height) of a
+// shared atlas image of atlasWidth x atlasHeight pixels.
+export const SHEET_MUSIC_SPRITES = {};
+
+// Placeholders: tiny blurred grayscale previews as data: URLs, shown
+// (stretched to the image size) until the full crop has loaded.
+export const SHEET_MUSIC_PLACEHOLDERS = {};
+
 // Get the sheet music image path for a question
 export function getSheetMusicPath(questionId) {
     return SHEET_MUSIC_MAP[questionId] || null;
 }
+
+// Get the responsive image entry (src, size, sources) for a question
+export function getSheetMusicImage(questionId) {
+    return SHEET_MUSIC_IMAGES[questionId] || null;
+}
+
+// Get the atlas region (src, x, y, width, height) for a question
+export function getSheetMusicSprite(questionId) {
+    return SHEET_MUSIC_SPRITES[questionId] || null;
+}
+
+// Get the inline placeholder (data: URL) for a question
+export function getSheetMusicPlaceholder(questionId) {
+    return SHEET_MUSIC_PLACEHOLDERS[questionId] || null;
+}
@@ -0,0 +1,19 @@
+"""
+Shared setup for the tests of the Python scripts in scripts/.
+The scripts import each other as top-level modules, so scripts/ goes on
+sys.path; paths the scripts take relative to the repo root are resolved
+through the `repo_root` fixture.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+
+@pytest.fixture(scope="session")
+def repo_root():
+    return ROOT
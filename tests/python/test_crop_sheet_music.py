@@ -0,0 +1,95 @@
+import pytest
+
+import crop_sheet_music
+from crop_sheet_music import DEFAULT_OPTIONS, crop_key, plan_build, record_build
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+    """Two fake pages, an empty manifest and an output dir under tmp_path."""
+    out = tmp_path / "cropped"
+    out.mkdir()
+    monkeypatch.setattr(crop_sheet_music, "OUTPUT_DIR", str(out))
+    pages = []
+    for n, scales in [(1, ["I-1", "I-2"]), (2, ["II-1"])]:
+        path = tmp_path / f"page{n}.jpg"
+        path.write_bytes(f"page {n}".encode())
+        pages.append((str(path), [(scale, 10.0, 40.0, 5.0, 95.0) for scale in scales]))
+    manifest = {"sheet_music": {"sources": {}, "crops": {}}}
+    return pages, manifest, out
+
+
+def _record(manifest, keys, out):
+    outputs = {}
+    for scale_id in keys:
+        name = crop_sheet_music.output_filename(scale_id)
+        (out / name).write_bytes(b"crop")
+        outputs[scale_id] = [{"file": name, "width": 800, "height": 300, "bytes": 4}]
+    record_build(manifest, keys, outputs)
+
+
+def _pending(pages):
+    return [crop[0] for _, crops in pages for crop in crops]
+
+
+def test_first_build_does_everything(build):
+    pages, manifest, _ = build
+    pending, keys, skipped = plan_build(pages, manifest)
+    assert _pending(pending) == ["I-1", "I-2", "II-1"]
+    assert set(keys) == {"I-1", "I-2", "II-1"}
+    assert skipped == 0
+
+
+def test_recorded_crops_are_skipped(build):
+    pages, manifest, out = build
+    _record(manifest, plan_build(pages, manifest)[1], out)
+    assert plan_build(pages, manifest) == ([], {}, 3)
+
+
+def test_changed_box_rebuilds_only_that_crop(build):
+    pages, manifest, out = build
+    _record(manifest, plan_build(pages, manifest)[1], out)
+    path, crops = pages[0]
+    pages[0] = (path, [crops[0], ("I-2", 12.0, 40.0, 5.0, 95.0)])
+    pending, keys, skipped = plan_build(pages, manifest)
+    assert _pending(pending) == ["I-2"] and list(keys) == ["I-2"] and skipped == 2
+
+
+def test_changed_source_rebuilds_its_crops(build):
+    pages, manifest, out = build
+    _record(manifest, plan_build(pages, manifest)[1], out)
+    with open(pages[1][0], "wb") as f:
+        f.write(b"rescanned page 2")
+    assert _pending(plan_build(pages, manifest)[0]) == ["II-1"]
+
+
+def test_changed_options_rebuild_everything(build):
+    pages, manifest, out = build
+    _record(manifest, plan_build(pages, manifest)[1], out)
+    options = dict(DEFAULT_OPTIONS, palette=True)
+    assert _pending(plan_build(pages, manifest, options=options)[0]) == ["I-1", "I-2", "II-1"]
+
+
+def test_force_and_missing_outputs(build):
+    pages, manifest, out = build
+    _record(manifest, plan_build(pages, manifest)[1], out)
+    assert plan_build(pages, manifest, force=True)[2] == 0
+    (out / crop_sheet_music.output_filename("I-1")).unlink()
+    assert _pending(plan_build(pages, manifest)[0]) == ["I-1"]
+
+
+def test_missing_source_is_left_to_the_build(build, tmp_path):
+    pages, manifest, _ = build
+    missing = (str(tmp_path / "gone.jpg"), [("III-1", 10.0, 40.0, 5.0, 95.0)])
+    pending, keys, _ = plan_build([missing], manifest)
+    assert pending == [missing] and keys == {}
+
+
+def test_crop_key_inputs():
+    box = ("I-1", 10.0, 40.0, 5.0, 95.0)
+    base = crop_key("sha", *box)
+    assert crop_key("sha", *box, options=DEFAULT_OPTIONS) == base
+    assert crop_key("sha2", *box) != base
+    assert crop_key("sha", "I-1", 10.0, 40.0, 5.0, 90.0) != base
+    assert crop_key("sha", *box, options=dict(DEFAULT_OPTIONS, flatten="deskew")) != base
+    assert crop_key("sha", *box, options=dict(DEFAULT_OPTIONS, variants=("webp",))) != base
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from label_matcher import QUESTIONS_MODULE, LabelMatcher, describe, is_match, load_catalog
+
+
+@pytest.fixture(scope="module")
+def matcher(repo_root):
+    return LabelMatcher(load_catalog(os.path.join(repo_root, QUESTIONS_MODULE)))
+
+
+@pytest.mark.parametrize("text, qid", [
+    ("Ab Major Scale", "I-1"),
+    ("A♭ Major Scale", "I-1"),
+    ("Apmajor Scale", "I-1"),
+    ("G#Minor Melodic", "I-2"),
+    ("C Minor Arpeggio", "II-4"),
+    ("Dominant 7th in Db", "III-1"),
+    ("Double Stop 6ths in Eb Major", "VI-8"),
+    ("Eb Minor Harmonic", "I-12"),
+    # Spelled-out accidentals, as the old EXPECTED table accepted them
+    ("E flat major scale", "I-10"),
+    ("G sharp minor melodic", "I-2"),
+    ("D flat major", "I-7"),
+])
+def test_matches(matcher, text, qid):
+    ranked = matcher.match(text)
+    assert is_match(ranked, qid), describe(ranked)
+
+
+@pytest.mark.parametrize("text, qid", [
+    # No tonic: the mode word alone must not pass for a key
+    ("Major Scale", "I-4"),
+    ("Major Scale", "I-13"),
+    ("Major Scale", "I-10"),
+    # A different tonic is not an OCR misread
+    ("E Major Scale", "I-10"),
+    ("A Major Scale", "I-1"),
+    # A tonic with an accidental is not the natural tonic
+    ("Eb Major Scale", "I-13"),
+    ("Eb Minor Harmonic", "I-15"),
+])
+def test_rejects(matcher, text, qid):
+    ranked = matcher.match(text)
+    assert not is_match(ranked, qid), describe(ranked)
+
+
+def test_missing_tonic_matches_nothing(matcher):
+    assert matcher.match("Major Scale") == []
+
+
+def test_scan_reports_matching_lines(matcher):
+    ranked, lines = matcher.scan("page 3\nAb Major Scale\n(3 Octaves)")
+    assert ranked[0][0] == "I-1"
+    assert lines == [1, 2]
@@ -0,0 +1,49 @@
+import itertools
+
+import ocr_cache
+from ocr_cache import OcrCache, cache_key, source_hash
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(ocr_cache.time, "time", lambda: next(clock))
+    cache = OcrCache(str(tmp_path / "ocr.sqlite3"), max_entries=3)
+    for key in "abc":
+        cache.put(key, key.upper())
+    assert cache.get("a") == "A"  # a is now the most recently used
+    cache.put("d", "D")
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["A", "C", "D"]
+    cache.close()
+
+
+def test_entries_persist(tmp_path):
+    path = str(tmp_path / "ocr.sqlite3")
+    cache = OcrCache(path)
+    cache.put("k", "text")
+    cache.close()
+    cache = OcrCache(path)
+    assert cache.get("k") == "text"
+    assert (cache.hits, cache.misses) == (1, 0)
+    cache.close()
+
+
+def test_cache_key_covers_every_input():
+    base = cache_key("sha", (0, 0, 10, 10), {"grayscale": True}, "--psm 6")
+    assert cache_key("sha", [0, 0, 10, 10], {"grayscale": True}, "--psm 6") == base
+    assert cache_key("sha2", (0, 0, 10, 10), {"grayscale": True}, "--psm 6") != base
+    assert cache_key("sha", (0, 0, 10, 11), {"grayscale": True}, "--psm 6") != base
+    assert cache_key("sha", (0, 0, 10, 10), {"grayscale": False}, "--psm 6") != base
+    assert cache_key("sha", (0, 0, 10, 10), {"grayscale": True}, "--psm 7") != base
+
+
+def test_source_hash_reuses_record_until_file_changes(tmp_path):
+    path = tmp_path / "page.jpg"
+    path.write_bytes(b"one")
+    records = {}
+    sha = source_hash(str(path), records)
+    record = records[str(path)]
+    assert source_hash(str(path), records) == sha
+    assert records[str(path)] is record
+    path.write_bytes(b"two!")
+    assert source_hash(str(path), records) != sha
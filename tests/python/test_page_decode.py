@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from page_decode import OrientedPage, auto_rotate, load_page
+
+# EXIF orientations 5-8 store the page on its side
+SIDEWAYS = (5, 6, 7, 8)
+
+
+def _page(tmp_path, orientation):
+    # Gradients in both directions so every transpose gives different pixels
+    x, y = np.meshgrid(np.arange(48), np.arange(32))
+    pixels = np.stack([x * 5, y * 7, (x + y) * 3], axis=-1).astype(np.uint8)
+    exif = Image.Exif()
+    exif[274] = orientation
+    path = tmp_path / f"page_{orientation}.png"
+    Image.fromarray(pixels).save(path, exif=exif)
+    return Image.open(path)
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_oriented_page_crops_match_rotated_page(tmp_path, orientation):
+    img = _page(tmp_path, orientation)
+    upright = auto_rotate(img)
+    page = OrientedPage(img)
+    assert page.size == upright.size
+    assert (page.size != img.size) == (orientation in SIDEWAYS)
+    for box in [(0, 0, *page.size), (3, 5, 17, 11), (page.size[0] - 9, 2, page.size[0], 8)]:
+        assert np.array_equal(np.asarray(page.crop(box)), np.asarray(upright.crop(box)))
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_stored_box_covers_the_same_pixels(tmp_path, orientation):
+    img = _page(tmp_path, orientation)
+    page = OrientedPage(img)
+    box = (4, 6, 20, 13)
+    stored = page.stored_box(box)
+    w, h = box[2] - box[0], box[3] - box[1]
+    assert stored[2] - stored[0] == (h if orientation in SIDEWAYS else w)
+    expected = np.sort(np.asarray(auto_rotate(img).crop(box)).reshape(-1, 3), axis=0)
+    actual = np.sort(np.asarray(img.crop(stored)).reshape(-1, 3), axis=0)
+    assert np.array_equal(actual, expected)
+
+
+def test_load_page_applies_exif_orientation(tmp_path):
+    img = _page(tmp_path, 6)
+    assert load_page(img.filename).size == (32, 48)
@@ -0,0 +1,46 @@
+import os
+
+from sheet_music_assets import HASH_LENGTH, find_crop, find_file, hashed_filename, public_url, unhashed_filename
+
+
+def test_hashed_filename_embeds_content_hash():
+    name = hashed_filename("i_1.jpg", b"crop bytes")
+    stem, digest, ext = name.split(".")
+    assert (stem, ext) == ("i_1", "jpg")
+    assert len(digest) == HASH_LENGTH
+    assert hashed_filename("i_1.jpg", b"crop bytes") == name
+    assert hashed_filename("i_1.jpg", b"other bytes") != name
+
+
+def test_unhashed_filename_round_trips():
+    for filename in ("i_1.jpg", "ii_10-400w.webp", "vi_8.png"):
+        assert unhashed_filename(hashed_filename(filename, b"x")) == filename
+
+
+def test_unhashed_filename_leaves_plain_names():
+    assert unhashed_filename("i_1.jpg") == "i_1.jpg"
+    # Not a hash: wrong length, not hex
+    assert unhashed_filename("i_1.abc.jpg") == "i_1.abc.jpg"
+    assert unhashed_filename("i_1.zzzzzzzzzz.jpg") == "i_1.zzzzzzzzzz.jpg"
+
+
+def test_find_file_prefers_newest_hashed_copy(tmp_path):
+    plain = tmp_path / "i_1.jpg"
+    plain.write_bytes(b"plain")
+    old = tmp_path / hashed_filename("i_1.jpg", b"old")
+    new = tmp_path / hashed_filename("i_1.jpg", b"new")
+    old.write_bytes(b"old")
+    new.write_bytes(b"new")
+    os.utime(old, (1, 1))
+    assert find_file(str(tmp_path), "i_1.jpg") == str(new)
+    assert find_file(str(tmp_path), "i_2.jpg") == str(tmp_path / "i_2.jpg")
+
+
+def test_find_crop_accepts_palette_png(tmp_path):
+    png = tmp_path / hashed_filename("ii_3.png", b"png")
+    png.write_bytes(b"png")
+    assert find_crop(str(tmp_path), "II-3") == str(png)
+
+
+def test_public_url():
+    assert public_url(os.path.join("public", "sheet-music", "cropped", "i_1.jpg")) == "/sheet-music/cropped/i_1.jpg"
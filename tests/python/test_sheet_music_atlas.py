@@ -0,0 +1,46 @@
+from sheet_music_atlas import ALIGN, pack, plan_atlases
+
+
+def _overlaps(a, b):
+    (ax, ay, aw, ah), (bx, by, bw, bh) = a, b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+def test_pack_places_boxes_aligned_without_overlap():
+    sizes = [(800, 350), (800, 300), (500, 120), (300, 340), (790, 200)]
+    placements, (width, height) = pack(sizes, 2048)
+    boxes = [(x, y, w, h) for (x, y), (w, h) in zip(placements, sizes)]
+    for i, box in enumerate(boxes):
+        x, y, w, h = box
+        assert x % ALIGN == 0 and y % ALIGN == 0
+        assert x + w <= width and y + h <= height
+        assert not any(_overlaps(box, other) for other in boxes[i + 1:])
+
+
+def test_pack_rejects_what_does_not_fit():
+    assert pack([(900, 100)], 800) is None
+    assert pack([(800, 500), (800, 500)], 800) is None
+    assert pack([(400, 500), (400, 500)], 800) is not None
+
+
+def _crops(count, width=800, height=300, size=50_000):
+    return {f"I-{i}": {"width": width, "height": height, "bytes": size} for i in range(1, count + 1)}
+
+
+def test_plan_atlases_splits_on_byte_budget():
+    crops = _crops(5)
+    assert plan_atlases(list(crops), crops, 4096, 120_000) == [["I-1", "I-2"], ["I-3", "I-4"], ["I-5"]]
+
+
+def test_plan_atlases_splits_on_dimensions():
+    crops = _crops(4, width=1000, height=1000)
+    assert plan_atlases(list(crops), crops, 2048, 10**9) == [["I-1", "I-2", "I-3", "I-4"]]
+    assert plan_atlases(list(crops), crops, 1024, 10**9) == [["I-1"], ["I-2"], ["I-3"], ["I-4"]]
+
+
+def test_plan_atlases_uses_estimates_over_crop_bytes():
+    # e.g. palette PNG crops: a few KB each, far larger once JPEG-encoded
+    crops = _crops(4, size=5_000)
+    assert plan_atlases(list(crops), crops, 4096, 100_000) == [list(crops)]
+    estimates = {qid: 60_000 for qid in crops}
+    assert plan_atlases(list(crops), crops, 4096, 100_000, estimates) == [["I-1"], ["I-2"], ["I-3"], ["I-4"]]
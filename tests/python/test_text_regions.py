@@ -0,0 +1,64 @@
+import numpy as np
+
+from text_regions import components, horizontal_runs, label_runs
+
+
+MASK = np.array([
+    [1, 1, 0, 0, 0, 1],
+    [0, 1, 0, 0, 0, 1],
+    [0, 0, 1, 0, 0, 0],  # touches the blob above only diagonally
+    [0, 0, 0, 0, 1, 1],
+    [1, 0, 0, 0, 0, 0],
+], dtype=bool)
+
+
+def test_horizontal_runs():
+    rows, starts, ends = horizontal_runs(MASK)
+    assert list(zip(rows, starts, ends)) == [
+        (0, 0, 2), (0, 5, 6), (1, 1, 2), (1, 5, 6), (2, 2, 3), (3, 4, 6), (4, 0, 1),
+    ]
+
+
+def test_label_runs_joins_diagonal_neighbours():
+    rows, starts, ends = horizontal_runs(MASK)
+    labels = label_runs(rows, starts, ends, MASK.shape[1])
+    assert sorted(set(labels)) == list(range(4))
+    groups = {}
+    for run, label in enumerate(labels):
+        groups.setdefault(label, []).append(run)
+    assert sorted(groups.values()) == [[0, 2, 4], [1, 3], [5], [6]]
+
+
+def test_label_runs_merges_through_later_rows():
+    # A "U": two arms only meet at the bottom row
+    mask = np.array([
+        [1, 0, 0, 1],
+        [1, 0, 0, 1],
+        [1, 1, 1, 1],
+    ], dtype=bool)
+    rows, starts, ends = horizontal_runs(mask)
+    assert set(label_runs(rows, starts, ends, mask.shape[1])) == {0}
+
+
+def test_components_boxes_and_ink():
+    boxes, ink = components(MASK)
+    found = sorted(zip(map(tuple, boxes.tolist()), ink.tolist()))
+    assert found == [
+        ((0, 0, 3, 3), 4.0),
+        ((0, 4, 1, 5), 1.0),
+        ((4, 3, 6, 4), 2.0),
+        ((5, 0, 6, 2), 2.0),
+    ]
+
+
+def test_components_drops_long_runs():
+    mask = np.zeros((3, 20), dtype=bool)
+    mask[1, :] = True  # a staff line
+    mask[0, 3] = True
+    boxes, _ = components(mask, max_run=5)
+    assert boxes.tolist() == [[3, 0, 4, 1]]
+
+
+def test_components_of_empty_mask():
+    boxes, ink = components(np.zeros((4, 4), dtype=bool))
+    assert boxes.shape == (0, 4) and len(ink) == 0
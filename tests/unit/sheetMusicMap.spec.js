@@ -0,0 +1,47 @@
+import { describe, it, expect } from 'vitest';
+import { QUESTIONS } from '@data/questions';
+import {
+    SHEET_MUSIC_MAP,
+    SHEET_MUSIC_IMAGES,
+    SHEET_MUSIC_PLACEHOLDERS,
+    getSheetMusicPath,
+    getSheetMusicImage,
+    getSheetMusicPlaceholder,
+} from '@data/sheetMusicMap';
+
+describe('sheet music map', () => {
+    it('should have an image path for every question', () => {
+        QUESTIONS.forEach(q => {
+            expect(getSheetMusicPath(q.id)).toMatch(/^\/sheet-music\//);
+        });
+    });
+
+    it('should return null for unknown questions', () => {
+        expect(getSheetMusicPath('X-1')).toBeNull();
+        expect(getSheetMusicImage('X-1')).toBeNull();
+        expect(getSheetMusicPlaceholder('X-1')).toBeNull();
+    });
+
+    it('should list one byte size per srcset candidate', () => {
+        Object.values(SHEET_MUSIC_IMAGES).forEach(image => {
+            expect(image.width).toBeGreaterThan(0);
+            expect(image.height).toBeGreaterThan(0);
+            image.sources.forEach(source => {
+                expect(source.srcset.split(', ')).toHaveLength(source.bytes.length);
+            });
+        });
+    });
+
+    it('should use the fallback path as the responsive src', () => {
+        Object.entries(SHEET_MUSIC_IMAGES).forEach(([id, image]) => {
+            expect(image.src).toBe(SHEET_MUSIC_MAP[id]);
+        });
+    });
+
+    it('should inline placeholders as data URLs for known questions', () => {
+        Object.entries(SHEET_MUSIC_PLACEHOLDERS).forEach(([id, placeholder]) => {
+            expect(SHEET_MUSIC_MAP[id]).toBeDefined();
+            expect(placeholder).toMatch(/^data:image\/jpeg;base64,/);
+        });
+    });
+});